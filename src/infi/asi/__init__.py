@@ -1,11 +1,19 @@
 __import__("pkg_resources").declare_namespace(__name__)
 
 import os
+import time
+from collections import deque, Counter
 from infi.instruct import *
 from infi.pyutils.decorators import wraps
-from .errors import AsiException, AsiCheckConditionError, AsiInternalError
+from .errors import AsiException, AsiCheckConditionError, AsiInternalError, AsiRequestQueueFullError
+from .errors import AsiBusyError, AsiTaskSetFullError
 from .sense import *
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 try:
     from gevent import sleep as _gevent_friendly_sleep
 except ImportError:
@@ -46,12 +54,23 @@ class SCSICommand(object):
         self.command = command
 
 class SCSIReadCommand(SCSICommand):
-    def __init__(self, command, max_response_length):
+    def __init__(self, command, max_response_length, buffer=None):
+        """ If buffer (a writable bytearray, mmap, memoryview, etc.) is given, the response data is transferred
+        directly into it and the result of the command is a memoryview over the bytes that were read.
+        buffer may also be a list or tuple of writable buffers, which are filled in order (scatter read); the result
+        is then a list with a memoryview per buffer.
+        The response data always spans max_response_length bytes; once the command completes, transferred_length
+        is the number of bytes the device actually transferred (None if the executer does not report it). """
         super(SCSIReadCommand, self).__init__(command)
         self.max_response_length = max_response_length
+        self.buffer = buffer
+        self.transferred_length = None
 
 class SCSIWriteCommand(SCSICommand):
     def __init__(self, command, data):
+        """ data may be bytes or any object supporting the buffer protocol. Writable buffers (bytearray, mmap,
+        writable memoryview) are transferred to the device without being copied. data may also be a list or tuple
+        of such buffers, which are transferred in order (gather write). """
         super(SCSIWriteCommand, self).__init__(command)
         self.data = data
 
@@ -68,77 +87,307 @@ class CommandExecuter(object):
     def wait(self):
         raise NotImplementedError()
 
-class CommandExecuterBase(CommandExecuter):
-    def __init__(self, max_queue_size=DEFAULT_MAX_QUEUE_SIZE):
-        self.pending_packets = dict()
-        self.max_queue_size = max_queue_size
-        self.packet_index = 0
+class PendingPackets(Mapping):
+    """ A read-only view of the packets an executer has in flight, packet index -> (os_data, callback), that
+    follows them as they are sent and completed """
+    def __init__(self, executer):
+        super(PendingPackets, self).__init__()
+        self._executer = executer
 
-    def call(self, command):
-        result = []
-        def my_cb(data, exception):
-            result.append((data, exception))
+    def __getitem__(self, packet_index):
+        if not isinstance(packet_index, int) or self._executer._get_os_data(packet_index) is None:
+            raise KeyError(packet_index)
+        return self._executer._pending_slots[packet_index]
 
-        yield self.send(command, callback=my_cb)
+    def __iter__(self):
+        return (index for index, slot in enumerate(self._executer._pending_slots) if slot is not None)
+
+    def __len__(self):
+        return self._executer.pending_count
+
+    def __repr__(self):
+        return "PendingPackets({!r})".format(dict(self))
 
-        while len(result) == 0:
-            yield self._process_pending_response()
 
-        data, exception = result[0]
-        if exception is not None:
-            raise exception
+class CommandExecuterBase(CommandExecuter):
+    def __init__(self, max_queue_size=DEFAULT_MAX_QUEUE_SIZE, retry_policy=None):
+        self.max_queue_size = max_queue_size
+        # a retry.RetryPolicy deciding which failed commands call() sends again; can also be assigned later
+        self.retry_policy = retry_policy
+        self.pending_count = 0
+        # a slot per packet index holding (os_data, callback) while the packet is in flight, and a stack of the
+        # free indices, so allocating and completing a packet are O(1) even for very deep queues
+        self._pending_slots = [None] * max_queue_size
+        self._free_packet_indices = list(range(max_queue_size - 1, -1, -1))
+        self._pending_packets = PendingPackets(self)
+        self.queue_depth_controller = None
+        self._pending_commands = dict()     # packet index -> (command, callback, send time, attempts)
+        # (command, callback, attempts) waiting for the adaptive queue depth to let them in flight, including the
+        # commands the target rejected
+        self._queued_commands = deque()
+        self.metrics = None
+        self.metrics_device = None
+        self._metrics_samples = dict()      # packet index -> metrics.CommandSample
+
+    def enable_metrics(self, collector=None, device=None):
+        """ Starts recording per-command metrics into collector (by default, a new metrics.MetricsCollector), under
+        the given device name. Returns the collector """
+        from .metrics import MetricsCollector
+        self.metrics = collector if collector is not None else MetricsCollector()
+        self.metrics_device = device
+        return self.metrics
+
+    def disable_metrics(self):
+        self.metrics = None
+        self._metrics_samples.clear()
+
+    def enable_adaptive_queue_depth(self, controller=None, max_requeue_attempts=16):
+        """ Lets a queue depth controller (by default, an AdaptiveQueueDepth) decide how many commands are kept
+        in flight, up to max_queue_size. Commands the target rejects with TASK SET FULL, BUSY or a full queue are
+        sent again transparently, up to max_requeue_attempts times. """
+        from .queue_depth import AdaptiveQueueDepth
+        self.queue_depth_controller = controller or AdaptiveQueueDepth(self.max_queue_size)
+        self.max_requeue_attempts = max_requeue_attempts
+
+    def call(self, command):
+        retries = Counter()
+        while True:
+            result = []
+            def my_cb(data, exception):
+                result.append((data, exception))
+
+            yield self.send(command, callback=my_cb)
+
+            while len(result) == 0:
+                yield self._process_pending_response()
+
+            data, exception = result[0]
+            if exception is None:
+                break
+            delay = self._get_retry_delay(exception, retries)
+            if delay is None:
+                raise exception
+            if delay > 0:
+                from .retry import RetryDelay
+                yield RetryDelay(delay, self.retry_policy.sleep)
 
         yield data
 
+    def call_sync(self, command):
+        """ Executes a single command with plain function calls instead of a coroutine, and returns its response
+        data (or raises its exception). Failed commands are sent again as in call(). Use
+        coroutines.sync_adapter.sync_execute() to run a whole CDB this way. """
+        retries = Counter()
+        while True:
+            result = []
+            self._submit_sync(command, lambda data, exception: result.append((data, exception)))
+
+            while len(result) == 0:
+                self._process_pending_response_sync()
+
+            data, exception = result[0]
+            if exception is None:
+                return data
+            if not self._wait_before_retry(exception, retries):
+                raise exception
+
+    def _get_retry_delay(self, exception, retries):
+        """ Returns the number of seconds the retry policy wants to wait before sending a failed command again, or
+        None if the command should fail. Coroutines wait by yielding a retry.RetryDelay """
+        if self.retry_policy is None:
+            return None
+        return self.retry_policy.get_retry_delay(exception, retries)
+
+    def _wait_before_retry(self, exception, retries):
+        """ Returns True if the retry policy wants the failed command sent again, after blocking as long as it says """
+        delay = self._get_retry_delay(exception, retries)
+        if delay is None:
+            return False
+        if delay > 0:
+            self.retry_policy.sleep(delay)
+        return True
+
+    def get_queue_depth(self):
+        if self.queue_depth_controller is None:
+            return self.max_queue_size
+        return self.queue_depth_controller.depth
+
+    @property
+    def pending_packets(self):
+        """ A read-only PendingPackets mapping of the packets in flight, packet index -> (os_data, callback). It is
+        a live view: copy it (e.g. with dict()) to keep the packets of a given moment or to change them while
+        iterating """
+        return self._pending_packets
+
     def is_queue_full(self):
-        return len(self.pending_packets) >= self.max_queue_size
+        return self.pending_count >= self.get_queue_depth()
 
     def is_queue_empty(self):
-        return len(self.pending_packets) == 0
+        return self.pending_count == 0 and len(self._queued_commands) == 0
 
     def send(self, command, callback=None):
-        packet_index = self._next_packet_index()
+        if self.queue_depth_controller is not None:
+            # the command is sent once the commands in flight are fewer than the adaptive queue depth
+            self._queued_commands.append((command, callback, 0))
+            return self._send_queued_commands()
+        return self._send(command, callback, 0)
+
+    def _submit_sync(self, command, callback):
+        """ Like send(), with plain function calls instead of a coroutine """
+        if self.queue_depth_controller is not None:
+            self._queued_commands.append((command, callback, 0))
+            self._send_queued_commands_sync()
+        else:
+            self._send_sync(command, callback, 0)
 
-        os_data = self._os_prepare_to_send(command, packet_index)
+    def _send_queued_commands(self):
+        while self._queued_commands and not self.is_queue_full():
+            yield self._send(*self._queued_commands.popleft())
 
-        self.pending_packets[packet_index] = (os_data, callback)
+    def _send_queued_commands_sync(self):
+        while self._queued_commands and not self.is_queue_full():
+            self._send_sync(*self._queued_commands.popleft())
 
+    def _send(self, command, callback, attempts):
+        packet_index, os_data = self._register_packet(command, callback, attempts)
         try:
             yield self._os_send(os_data)
         except:
-            del self.pending_packets[packet_index]
+            self._unregister_packet(packet_index)
+            raise
+
+    def _send_sync(self, command, callback, attempts):
+        """ Like _send(), with plain function calls instead of a coroutine """
+        packet_index, os_data = self._register_packet(command, callback, attempts)
+        try:
+            self._os_send_sync(os_data)
+        except:
+            self._unregister_packet(packet_index)
+            raise
+
+    def _register_packet(self, command, callback, attempts):
+        """ Allocates a packet index for the command and prepares it. Returns (packet_index, os_data) """
+        packet_index = self._next_packet_index()
+        metrics = self.metrics
+        start_time = metrics.timer() if metrics is not None else None
+
+        try:
+            os_data = self._os_prepare_to_send(command, packet_index)
+        except:
+            self._release_packet_index(packet_index)
             raise
 
+        self._pending_slots[packet_index] = (os_data, callback)
+        if self.queue_depth_controller is not None:
+            self._pending_commands[packet_index] = (command, callback, time.time(), attempts)
+        if metrics is not None:
+            self._metrics_samples[packet_index] = metrics.start_command(command, start_time)
+        return packet_index, os_data
+
+    def _unregister_packet(self, packet_index):
+        """ Frees a packet that will not complete, e.g. because sending it failed """
+        os_data, callback = self._release_packet_index(packet_index)
+        self._pending_commands.pop(packet_index, None)
+        self._metrics_samples.pop(packet_index, None)
+        self._os_release(os_data)
+
     def wait(self):
         while not self.is_queue_empty():
             yield self._process_pending_response()
 
+    def map(self, cdbs, depth=None, ordered=True):
+        """ Executes the CDBs in cdbs (any iterable, consumed lazily) keeping up to depth (by default,
+        max_queue_size) of them in flight, and returns an iterator over their results - in the order of cdbs, or,
+        if ordered is False, in the order they complete. Unlike call(), this is a plain iterator, not a coroutine:
+
+            for result in executer.map(Read16Command(lba, 8) for lba in range(0, 1024, 8)):
+                ...
+        """
+        from .pipeline import pipeline_map
+        return pipeline_map(self, cdbs, depth, ordered)
+
+    def as_completed(self, cdbs, depth=None):
+        return self.map(cdbs, depth, ordered=False)
+
     def _next_packet_index(self):
-        if len(self.pending_packets) >= self.max_queue_size:
+        if not self._free_packet_indices:
             raise AsiRequestQueueFullError()
-        result = self.packet_index
-        self.packet_index = (self.packet_index + 1) % self.max_queue_size
-        return result
+        self.pending_count += 1
+        return self._free_packet_indices.pop()
+
+    def _release_packet_index(self, packet_index):
+        """ Frees the slot of a packet index and returns its (os_data, callback) """
+        slot = self._pending_slots[packet_index]
+        self._pending_slots[packet_index] = None
+        self._free_packet_indices.append(packet_index)
+        self.pending_count -= 1
+        return slot
 
     def _process_pending_response(self):
+        yield self._send_queued_commands()
+
         if self.is_queue_empty():
             yield False
+            return
 
         result, packet_id = yield self._os_receive()
+        completed = self._complete_packet(result, packet_id)
+        # send the queued commands the response made room for (a requeued command may be the response's own) now,
+        # as there may be no other response left to wait for
+        yield self._send_queued_commands()
+        yield completed
+
+    def _process_pending_response_sync(self):
+        """ Like _process_pending_response(), with plain function calls instead of a coroutine """
+        self._send_queued_commands_sync()
+
+        if self.is_queue_empty():
+            return False
+
+        result, packet_id = self._os_receive_sync()
+        completed = self._complete_packet(result, packet_id)
+        self._send_queued_commands_sync()
+        return completed
 
-        request, callback = self.pending_packets.pop(packet_id, (None, None))
-        if request is None:
+    def _complete_packet(self, result, packet_id):
+        """ Frees the packet of a response and calls its callback, unless the command was requeued """
+        if self._get_os_data(packet_id) is None:
             raise AsiInternalError("SCSI response doesn't appear in the pending I/O list.")
+        request, callback = self._release_packet_index(packet_id)
+
+        if self._metrics_samples:
+            sample = self._metrics_samples.pop(packet_id, None)
+            if sample is not None and self.metrics is not None:
+                self.metrics.complete_command(self.metrics_device, sample, result)
+
+        if self.queue_depth_controller is not None and self._handle_queue_depth(result, packet_id):
+            return True
 
         if isinstance(result, Exception):
             callback(None, result)
         else:
             callback(result, None)
 
-        yield True
+        return True
+
+    def _handle_queue_depth(self, result, packet_id):
+        """ Feeds the queue depth controller. Returns True if the command was requeued """
+        if packet_id not in self._pending_commands:
+            return False    # sent before the controller was enabled
+        command, callback, send_time, attempts = self._pending_commands.pop(packet_id)
+        if not isinstance(result, (AsiTaskSetFullError, AsiBusyError, AsiRequestQueueFullError)):
+            self.queue_depth_controller.on_success(time.time() - send_time)
+            return False
+        self.queue_depth_controller.on_congestion()
+        if attempts >= self.max_requeue_attempts:
+            return False
+        self._queued_commands.append((command, callback, attempts + 1))
+        return True
 
     def _get_os_data(self, packet_index):
-        return self.pending_packets.get(packet_index, (None, None))[0]
+        if not 0 <= packet_index < self.max_queue_size or self._pending_slots[packet_index] is None:
+            return None
+        return self._pending_slots[packet_index][0]
 
     def _os_prepare_to_send(self, command, packet_index):
         """Creates OS-specific data to send. Returns the opaque OS-specific data."""
@@ -152,6 +401,21 @@ class CommandExecuterBase(CommandExecuter):
         """Returns the raw packet or an exception and packet_id as a pair: (packet, packet_id)"""
         raise NotImplementedError()
 
+    def _os_release(self, os_data):
+        """Releases the OS-specific data of a packet that was unregistered without a response (e.g. unpins the
+        caller's buffers). Platforms whose OS-specific data outlives the packet should override it"""
+        pass
+
+    def _os_send_sync(self, os_data):
+        """Like _os_send(), as a plain function. Platforms that don't need a coroutine to send should override it"""
+        from .coroutines.sync_adapter import sync_wait
+        return sync_wait(self._os_send(os_data))
+
+    def _os_receive_sync(self):
+        """Like _os_receive(), as a plain function"""
+        from .coroutines.sync_adapter import sync_wait
+        return sync_wait(self._os_receive())
+
     def _check_condition(self, buf):
         sense = get_sense_object_from_buffer(buf)
         return AsiCheckConditionError(buf, sense)
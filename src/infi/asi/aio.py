@@ -0,0 +1,194 @@
+import asyncio
+from collections import deque, Counter
+
+from . import CommandExecuter, OSAsyncIOToken
+from .coroutines.sync_adapter import AsyncCoroutine, Trampoline, sync_wait
+
+
+class FutureIOToken(OSAsyncIOToken):
+    def __init__(self, future):
+        self.future = future
+
+    def get_result(self, block=False):
+        exception = self.future.exception()
+        return exception if exception is not None else self.future.result()
+
+
+class AwaitableCommandExecuter(object):
+    """ The interface of executers for native coroutines: the response data of a command (or its exception) is
+    returned by awaiting call_async(command). CDBs are run with await cdb.execute_async(executer) """
+    async def call_async(self, command):
+        raise NotImplementedError()
+
+
+class SyncAwaitableCommandExecuter(AwaitableCommandExecuter):
+    """ Executes the commands of native coroutines synchronously, with the call_sync() of a CommandExecuterBase.
+    Such coroutines never suspend, so they can be run without an event loop by sync_await() """
+    def __init__(self, executer):
+        super(SyncAwaitableCommandExecuter, self).__init__()
+        self.executer = executer
+
+    async def call_async(self, command):
+        return self.executer.call_sync(command)
+
+
+class AsyncioCommandExecuter(CommandExecuter, AwaitableCommandExecuter):
+    """ Adapts a command executer whose io has a pollable file descriptor (e.g. LinuxCommandExecuter) to asyncio.
+
+    Responses are read only when loop.add_reader() reports the descriptor as readable, so any number of commands,
+    on any number of devices, can be in flight on one event loop. Commands are run with:
+
+        result = await asyncio_executer.execute(cdb)
+
+    The CDB's execute() generator is used unchanged - this object is passed to it as the executer. It is also an
+    AwaitableCommandExecuter, for native coroutines:
+
+        result = await cdb.execute_async(asyncio_executer)
+    """
+    def __init__(self, executer, loop=None):
+        super(AsyncioCommandExecuter, self).__init__()
+        self.executer = executer
+        self.loop = loop or asyncio.get_event_loop()
+        self._slot_waiters = deque()
+        self.loop.add_reader(executer.io.fd, self._on_readable)
+
+    def _on_readable(self):
+        if self.executer.is_queue_empty():
+            return
+        sync_wait(self.executer._process_pending_response())
+        while self._slot_waiters and not self.executer.is_queue_full():
+            waiter = self._slot_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _create_future(self):
+        """ Returns a future and a command callback that completes it """
+        future = self.loop.create_future()
+
+        def callback(data, exception):
+            if future.done():
+                return
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(data)
+
+        return future, callback
+
+    def _create_delay(self, delay):
+        """ Returns a future completed after delay seconds """
+        future = self.loop.create_future()
+
+        def complete():
+            if not future.done():
+                future.set_result(None)
+
+        self.loop.call_later(delay, complete)
+        return future
+
+    def call(self, command):
+        retries = Counter()
+        while True:
+            while self.executer.is_queue_full():
+                waiter = self.loop.create_future()
+                self._slot_waiters.append(waiter)
+                yield FutureIOToken(waiter)
+
+            future, callback = self._create_future()
+            yield self.executer.send(command, callback=callback)
+            try:
+                data = yield FutureIOToken(future)
+                break
+            except Exception as error:
+                delay = self.executer._get_retry_delay(error, retries)
+                if delay is None:
+                    raise
+            if delay > 0:
+                yield FutureIOToken(self._create_delay(delay))
+        yield data
+
+    async def call_async(self, command):
+        retries = Counter()
+        while True:
+            while self.executer.is_queue_full():
+                waiter = self.loop.create_future()
+                self._slot_waiters.append(waiter)
+                await waiter
+
+            future, callback = self._create_future()
+            sync_wait(self.executer.send(command, callback=callback))
+            try:
+                return await future
+            except Exception as error:
+                delay = self.executer._get_retry_delay(error, retries)
+                if delay is None:
+                    raise
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    def send(self, command, callback=None):
+        return self.executer.send(command, callback)
+
+    def is_queue_full(self):
+        return self.executer.is_queue_full()
+
+    async def run(self, generator):
+        """ Runs a coroutine generator created with this object as its executer, e.g. cdb.execute(self) """
+        coroutine = AsyncCoroutine(generator)
+        while True:
+            result = coroutine.loop()
+            if coroutine.is_done():
+                return result
+            # exceptions are thrown into the coroutine by async_io_complete(), so we don't want them raised here
+            await asyncio.wait((result.future,))
+            coroutine.async_io_complete()
+
+    async def execute(self, cdb):
+        return await self.run(cdb.execute(self))
+
+    def close(self):
+        self.loop.remove_reader(self.executer.io.fd)
+
+
+class _AwaitedCall(object):
+    """ Returned by the call() of _AwaitingCommandExecuter in place of a coroutine, so execute_async() awaits it """
+    __slots__ = ("command",)
+
+    def __init__(self, command):
+        self.command = command
+
+
+class _AwaitingCommandExecuter(CommandExecuter):
+    def call(self, command):
+        return _AwaitedCall(command)
+
+
+async def _drive(generator, executer):
+    trampoline = Trampoline(generator)
+    done, value = trampoline.resume()
+    while not done:
+        error = None
+        if isinstance(value, _AwaitedCall):
+            try:
+                value = await executer.call_async(value.command)
+            except Exception as e:
+                value, error = None, e
+        done, value = trampoline.resume(value, error)
+    return value
+
+
+async def execute_async(cdb, executer):
+    """ Runs the execute() coroutine generator of a CDB as a native coroutine, awaiting the call_async() of an
+    AwaitableCommandExecuter for each of its commands. This is what CDB.execute_async() does by default """
+    return await _drive(cdb.execute(_AwaitingCommandExecuter()), executer)
+
+
+def sync_await(coroutine):
+    """ Returns the result of a native coroutine that completes without suspending, e.g. one whose commands are
+    executed by a SyncAwaitableCommandExecuter """
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise Exception("Synchronous coroutine was not completed")
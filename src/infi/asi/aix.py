@@ -2,6 +2,7 @@ from . import CommandExecuterBase, DEFAULT_TIMEOUT_IN_SEC, SCSIReadCommand, SCSI
 from . import SCSI_STATUS_CODES, gevent_friendly
 from .linux import prettify_status, SENSE_SIZE
 from .errors import AsiSCSIError, AsiOSError
+from .buffers import create_read_buffer, read_result_view, create_write_buffer
 from ctypes import *
 from logging import getLogger
 import six
@@ -274,6 +275,8 @@ class sc_passthru(Structure):
         ("residual", c_ulonglong),
     ]
 
+    user_buffer = None
+
     def __init__(self, *args, **kwargs):
         super(sc_passthru, self).__init__(*args, **kwargs)
         self.source_buffer = None
@@ -321,13 +324,14 @@ class sc_passthru(Structure):
         if isinstance(command, SCSIReadCommand):
             if command.max_response_length > 0:
                 scsicmd.flags = B_READ
-                scsicmd.set_data_buffer(create_string_buffer(command.max_response_length))
+                scsicmd.user_buffer = command.buffer
+                scsicmd.set_data_buffer(create_read_buffer(command))
             else:
                 scsicmd.flags = B_WRITE
                 scsicmd.set_data_buffer(None)
         else:
             scsicmd.flags = B_WRITE
-            scsicmd.set_data_buffer(create_string_buffer(command.data, len(command.data)))
+            scsicmd.set_data_buffer(create_write_buffer(command.data))
         return scsicmd
 
     @classmethod
@@ -402,7 +406,10 @@ class AixCommandExecuter(CommandExecuterBase):
 
         data = None
         if request_cmd.flags & B_READ and request_cmd.data_length != 0:
-            data = request_cmd.data_buffer.raw
+            if request_cmd.user_buffer is not None:
+                data = read_result_view(request_cmd.user_buffer, request_cmd.data_length, request_cmd.data_buffer)
+            else:
+                data = request_cmd.data_buffer.raw
 
         return (data, packet_id)
 
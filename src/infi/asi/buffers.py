@@ -0,0 +1,122 @@
+from ctypes import c_char, create_string_buffer
+
+# memoryview.cast() and ctypes' from_buffer() of a memoryview are Python 3 only: on Python 2 buffers are pinned
+# through the objects that own them, and multi-byte items are viewed through a copy
+_PY3_MEMORYVIEW = hasattr(memoryview, "cast")
+
+
+def byte_view(buffer):
+    """ Returns a memoryview of buffer in bytes, whatever its item format is """
+    try:
+        view = memoryview(buffer)
+    except TypeError:
+        if _PY3_MEMORYVIEW:
+            raise
+        # Python 2 mmap and array objects only support the old buffer protocol, which ctypes does understand
+        view = memoryview((c_char * (len(buffer) * getattr(buffer, "itemsize", 1))).from_buffer(buffer))
+    if view.itemsize != 1 or view.format != 'B':
+        if _PY3_MEMORYVIEW:
+            view = view.cast('B')
+        elif view.itemsize != 1:
+            view = memoryview(view.tobytes())
+    return view
+
+
+def _can_pin(buffer):
+    return _PY3_MEMORYVIEW or not isinstance(buffer, memoryview)
+
+
+def pin_writable_buffer(buffer, length):
+    """ Returns a ctypes char array of the given length that shares its memory with buffer, so the OS can transfer
+    data directly into it. buffer can be any writable object supporting the buffer protocol (bytearray, mmap,
+    writable memoryview, etc.) """
+    view = byte_view(buffer)
+    if view.readonly:
+        raise TypeError("buffer of type {} is read-only".format(type(buffer).__name__))
+    if len(view) < length:
+        raise ValueError("buffer is too small: {} bytes, need {}".format(len(view), length))
+    if not _can_pin(buffer):
+        raise TypeError("memoryviews can't be pinned on Python 2, pass the object they view instead")
+    return (c_char * length).from_buffer(view if _PY3_MEMORYVIEW else buffer)
+
+
+def is_writable_buffer(buffer):
+    return not isinstance(buffer, bytes) and not byte_view(buffer).readonly
+
+
+def is_buffer_sequence(buffer):
+    """ SCSIReadCommand and SCSIWriteCommand accept a list or tuple of buffers for scatter-gather transfers """
+    return isinstance(buffer, (list, tuple))
+
+
+def buffer_length(buffer):
+    """ Returns the length in bytes of a buffer, or the total length of a sequence of buffers """
+    if is_buffer_sequence(buffer):
+        return sum(len(byte_view(item)) for item in buffer)
+    return len(byte_view(buffer))
+
+
+def buffer_bytes(buffer):
+    """ Returns the contents of a buffer, a sequence of buffers or None (empty) as bytes """
+    if buffer is None:
+        return b""
+    if is_buffer_sequence(buffer):
+        return b"".join(byte_view(item).tobytes() for item in buffer)
+    return byte_view(buffer).tobytes()
+
+
+def scatter_views(buffers, length):
+    """ Returns a list with a memoryview per buffer, together covering the first length bytes of the sequence """
+    views = []
+    for buffer in buffers:
+        view = byte_view(buffer)[:length]
+        length -= len(view)
+        views.append(view)
+    return views
+
+
+def pin_scatter_buffers(buffers, length):
+    """ Pins the first length bytes of a sequence of writable buffers, returning a list of ctypes char arrays """
+    if buffer_length(buffers) < length:
+        raise ValueError("buffers are too small: {} bytes, need {}".format(buffer_length(buffers), length))
+    views = scatter_views(buffers, length)
+    return [pin_writable_buffer(buffer, len(view)) for buffer, view in zip(buffers, views) if len(view) > 0]
+
+
+def create_write_buffer(data):
+    """ Returns a ctypes char array holding the data of a SCSIWriteCommand. Writable buffers (bytearray, mmap,
+    writable memoryview) are pinned in place, so the OS transfers straight from the caller's memory; immutable
+    objects such as bytes are copied. A sequence of buffers is gathered into a single copy. """
+    if is_buffer_sequence(data):
+        return create_string_buffer(b"".join(byte_view(item).tobytes() for item in data), buffer_length(data))
+    view = byte_view(data)
+    array_type = c_char * len(view)
+    if view.readonly or not _can_pin(data):
+        return array_type.from_buffer_copy(view if _PY3_MEMORYVIEW else view.tobytes())
+    return array_type.from_buffer(view if _PY3_MEMORYVIEW else data)
+
+
+def create_read_buffer(command):
+    """ Returns the ctypes buffer the response of a SCSIReadCommand should be transferred into. A sequence of
+    buffers gets an intermediate buffer, which read_result_view() scatters into them. """
+    if is_buffer_sequence(command.buffer):
+        pin_scatter_buffers(command.buffer, command.max_response_length)
+        return create_string_buffer(command.max_response_length)
+    if command.buffer is not None:
+        return pin_writable_buffer(command.buffer, command.max_response_length)
+    return create_string_buffer(command.max_response_length)
+
+
+def read_result_view(buffer, length, source=None):
+    """ Returns a memoryview over the first length bytes of a caller-supplied read buffer. For a sequence of
+    buffers, returns a list of memoryviews (one per buffer); if source (the intermediate buffer from
+    create_read_buffer()) is given, the data is scattered from it into the buffers first. """
+    if not is_buffer_sequence(buffer):
+        return byte_view(buffer)[:length]
+    views = scatter_views(buffer, length)
+    if source is not None:
+        source_view, offset = byte_view(source), 0
+        for view in views:
+            view[:] = source_view[offset:offset + len(view)]
+            offset += len(view)
+    return views
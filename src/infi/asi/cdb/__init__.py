@@ -2,15 +2,33 @@ from infi.instruct import *
 from infi.instruct.buffer import Buffer
 
 
+def _execute_async(cdb, executer):
+    from ..aio import execute_async
+    return execute_async(cdb, executer)
+
+
 class CDB(Struct):
     _fields_ = []
 
     def create_datagram(self):
+        # a fixed_layout.FixedLayoutEncoder applies only to the class defining it, not to subclasses changing _fields_
+        encoder = type(self).__dict__.get("_encoder_")
+        if encoder is not None:
+            return encoder.encode(self)
         return type(self).write_to_string(self)
 
     def execute(self, executer):
         raise NotImplementedError()
 
+    def execute_async(self, executer):
+        """ Returns a native coroutine executing the CDB with an AwaitableCommandExecuter (see infi.asi.aio):
+
+            result = await cdb.execute_async(executer)
+
+        By default it runs execute() with its commands awaited; multi-step commands may override it. Python 3 only.
+        """
+        return _execute_async(self, executer)
+
 
 class CDBBuffer(Buffer):
     def create_datagram(self):
@@ -18,3 +36,7 @@ class CDBBuffer(Buffer):
 
     def execute(self, executer):
         raise NotImplementedError()
+
+    def execute_async(self, executer):
+        """ See CDB.execute_async() """
+        return _execute_async(self, executer)
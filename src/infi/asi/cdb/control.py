@@ -13,6 +13,9 @@ class Control(Struct):
 
 DEFAULT_CONTROL = Control(vendor_specific=0, naca=0)
 
+# the bit fields of a CDB's control field, for fixed_layout.FixedLayoutEncoder
+CONTROL_BIT_FIELDS = [("control.naca", 2, 1), ("control.vendor_specific", 6, 2)]
+
 
 class ControlBuffer(Buffer):
     naca = be_int_field(where=bytes_ref[0].bits[2:3])
@@ -0,0 +1,29 @@
+""" Native coroutines reading the SES diagnostic pages that depend on the configuration page (Python 3 only):
+
+    status_page = await get_enclosure_status_page(executer)
+
+executer is an AwaitableCommandExecuter (see infi.asi.aio). """
+from .configuration import ConfigurationDiagnosticPagesCommand
+from .enclosure_status import EnclosureStatusDiagnosticPagesCommand
+from .element_descriptor import ElementDescriptorDiagnosticPagesCommand
+
+
+async def get_configuration_page(executer):
+    return await ConfigurationDiagnosticPagesCommand().execute_async(executer)
+
+
+async def get_enclosure_status_page(executer, conf_page=None):
+    """ Reads the configuration page (unless conf_page is given) and then the enclosure status page """
+    if conf_page is None:
+        conf_page = await get_configuration_page(executer)
+    return await EnclosureStatusDiagnosticPagesCommand(conf_page).execute_async(executer)
+
+
+async def get_element_descriptor_page(executer, conf_page=None):
+    """ Reads the configuration page (unless conf_page is given) and then the element descriptor page """
+    if conf_page is None:
+        conf_page = await get_configuration_page(executer)
+    return await ElementDescriptorDiagnosticPagesCommand(conf_page).execute_async(executer)
+
+
+__all__ = ["get_configuration_page", "get_enclosure_status_page", "get_element_descriptor_page"]
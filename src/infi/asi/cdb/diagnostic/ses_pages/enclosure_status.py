@@ -1,4 +1,6 @@
+import struct
 from infi.instruct.buffer import Buffer, bytes_ref, be_int_field, list_field, buffer_field, int8, member_func_ref
+from ...fixed_layout import LazyList, lazy_list_fields
 from . import PCVReceiveDiagnosticResultCommand, DiagnosticDataBuffer
 
 
@@ -457,6 +459,13 @@ ELEMENT_TYPE_TO_ELEMENT_INFO = {0x00: GeneralStatusElement,
                                 0x9e: VendorSpecificElement}
 
 
+def _unpack_element(element_class, buffer, offset):
+    element = element_class()
+    element.unpack(buffer[offset:offset + element_class.byte_size])
+    return element
+
+
+@lazy_list_fields("individual_elements")
 class StatusDescriptor(Buffer):
     def _unpack_status_element(self, buffer, index, **kwargs):
         elem_type = self.type_descriptor_header.element_type
@@ -474,11 +483,20 @@ class StatusDescriptor(Buffer):
                                      n=member_func_ref(_possible_elements_num))
 
     def unpack(self, buffer, type_descriptor_header):
+        """ Unpacks the overall element; the individual elements are unpacked when first read """
         self.type_descriptor_header = type_descriptor_header
-        return super(StatusDescriptor, self).unpack(buffer)
+        count = self._possible_elements_num()
+        if not isinstance(buffer, bytes) or count < 0 or len(buffer) < 4 + 4 * count:
+            return super(StatusDescriptor, self).unpack(buffer)
+        element_class = self._unpack_status_element(buffer, 0)
+        self.overall_element = _unpack_element(GeneralStatusElement, buffer, 0)
+        self.individual_elements = LazyList(count,
+                                            lambda index: _unpack_element(element_class, buffer, 4 + 4 * index))
+        return 4 + 4 * count
 
 
 # ses3r05: 6.1.4
+@lazy_list_fields("status_descriptors")
 class EnclosureStatusDiagnosticPagesData(DiagnosticDataBuffer):
     def _unpack_status_descriptor(self, buffer, index, **kwargs):
         descriptor = StatusDescriptor()
@@ -488,6 +506,25 @@ class EnclosureStatusDiagnosticPagesData(DiagnosticDataBuffer):
     def _possible_elements_num(self):
         return len(self.conf_page.type_descriptor_header_list)
 
+    def unpack(self, buffer):
+        """ Unpacks the page header; the status descriptors (and their elements) are unpacked when first read """
+        headers = self.conf_page.type_descriptor_header_list
+        offsets = [8]
+        for header in headers:
+            if header.possible_elements_num < 0:
+                return super(EnclosureStatusDiagnosticPagesData, self).unpack(buffer)
+            offsets.append(offsets[-1] + 4 + 4 * header.possible_elements_num)
+        if not isinstance(buffer, (bytes, bytearray)) or len(buffer) < offsets[-1]:
+            # instruct unpacks what it can of truncated pages
+            return super(EnclosureStatusDiagnosticPagesData, self).unpack(buffer)
+        data = bytes(buffer)
+        self.page_code, flags, self.page_length, self.generation_code = struct.unpack_from(">bBhi", data)
+        self.unrecov, self.crit, self.non_crit, self.info, self.invop = [(flags >> bit) & 1 for bit in range(5)]
+        self.status_descriptors = LazyList(
+            len(headers), lambda index: self._unpack_status_descriptor(data[offsets[index]:offsets[index + 1]],
+                                                                       index)[0])
+        return offsets[-1]
+
     page_code = be_int_field(where=bytes_ref[0])
     unrecov = be_int_field(where=bytes_ref[1].bits[0])
     crit = be_int_field(where=bytes_ref[1].bits[1])
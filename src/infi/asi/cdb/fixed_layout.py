@@ -0,0 +1,396 @@
+""" Precompiled encoders and decoders for CDBs and responses of a fixed layout.
+
+infi.instruct packs a CDB field by field, which costs tens of microseconds per command. A FixedLayoutEncoder
+describes the same layout as a sequence of big-endian integers - each a constant, an attribute of the CDB, or bit
+fields of attributes packed into one byte - and compiles it once into a struct.Struct and a function calling its
+pack() with the attributes:
+
+    class Read10Command(CDB):
+        _fields_ = [...]
+        _encoder_ = FixedLayoutEncoder([
+            ("B", CDB_OPCODE_READ_10),
+            ("B", [("fua_nv", 1, 1), ("fua", 3, 1), ("dpo", 4, 1), ("rdprotect", 5, 3)]),
+            ("I", "logical_block_address"),
+            ("B", [("group_number", 0, 5)]),
+            ("H", "transfer_length"),
+            ("B", CONTROL_BIT_FIELDS)])
+
+Bit fields are (attribute, offset of the lowest bit, width); like instruct, values are masked to their width.
+CDB.create_datagram() uses the _encoder_ defined by the CDB's class, so the layout must match its _fields_
+(test_fixed_layout compares them).
+
+Likewise, instruct unpacks responses by evaluating the references of every field. A FixedLayoutDecoder lists the
+fields of a response buffer at their offsets (fixed_int, fixed_str, fixed_bytearray, fixed_buffer and fixed_list;
+the extent and presence of the variable ones are functions of the object decoded so far and the buffer length) and
+is compiled, on its first use, into a function of straight-line struct.unpack_from() calls and bit masks:
+
+    class BlockLimitsVPDPageBuffer(FixedLayoutBuffer, Buffer):
+        ...
+        _decoder_ = FixedLayoutDecoder([
+            fixed_buffer("peripheral_device", 0, PeripheralDeviceDataBuffer, end=1),
+            fixed_int("page_code", 1, "B"),
+            ...])
+
+FixedLayoutBuffer.unpack() (and FixedLayoutStruct.create_from_string()) use the _decoder_ defined by the class and
+produce the same fields and return value as instruct; inputs the decoder cannot handle - too short, not a bytes-like
+object, failing to decode - fall back to instruct, which unpacks them (or fails) as before. The decoders can be
+turned off with disable_compiled_decoders(), e.g. to compare with instruct.
+
+Large pages are mostly lists, which callers often do not read. A list field declared with lazy_list_fields() may be
+set to a LazyList, which keeps the raw buffer: the items are unpacked when the field is first read, and the field is
+then a plain list. fixed_lazy_list() declares one in a decoder, given a function returning the size of an item
+without unpacking it. The layout of the whole list is checked when the page is decoded, so a malformed page still
+fails (in instruct) when it is unpacked, and not when the list is read.
+"""
+import struct
+import itertools
+from infi.instruct.base import EMPTY_CONTEXT
+from infi.instruct.errors import InstructError
+
+
+class FixedLayoutEncoder(object):
+    def __init__(self, items):
+        super(FixedLayoutEncoder, self).__init__()
+        self.items = list(items)
+        self.struct = struct.Struct(">" + "".join(format_character for format_character, value in self.items))
+        self.size = self.struct.size
+        self.encode = self._compile()
+
+    def _compile(self):
+        arguments = []
+        for format_character, value in self.items:
+            if isinstance(value, int):
+                arguments.append(repr(value))
+            elif isinstance(value, str):
+                arguments.append("cdb." + value)
+            else:
+                arguments.append(" | ".join("((cdb.{} & {:#x}) << {})".format(name, (1 << width) - 1, offset)
+                                            for name, offset, width in value))
+        source = ("def encode(cdb):\n"
+                  "    try:\n"
+                  "        return pack({})\n"
+                  "    except error:\n"
+                  "        raise InstructError('Packing error occurred')\n").format(", ".join(arguments))
+        namespace = dict(pack=self.struct.pack, error=struct.error, InstructError=InstructError)
+        exec(compile(source, "<FixedLayoutEncoder>", "exec"), namespace)
+        return namespace["encode"]
+
+
+_decoders = dict(enabled=True)
+
+
+def enable_compiled_decoders():
+    _decoders["enabled"] = True
+
+
+def disable_compiled_decoders():
+    _decoders["enabled"] = False
+
+
+def compiled_decoders_enabled():
+    return _decoders["enabled"]
+
+
+class _DecoderItem(object):
+    def __init__(self, kind, name, offset, **kwargs):
+        super(_DecoderItem, self).__init__()
+        self.kind = kind
+        self.name = name
+        self.offset = offset
+        self.format = None          # fixed_int: a struct format character; fixed_list: of the items, if integers
+        self.bits = None            # fixed_int: (offset of the lowest bit, width)
+        self.type = None            # fixed_buffer, fixed_list: the buffer class of the value or of the items
+        self.end = None             # the end offset: an int, a function of (obj, length), or None for the buffer end
+        self.count = None           # fixed_list: the maximal number of items, a function of (obj, length)
+        self.item_size = None       # fixed_lazy_list: a function of (buffer, offset, end)
+        self.condition = None       # a function of (obj, length); when false, the field is None
+        self.min_length = None      # the field is None if the buffer is shorter
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+
+def fixed_int(name, offset, format_character, bits=None, min_length=None):
+    """ An integer: a big-endian struct format_character at offset, or bits=(lowest bit, width) of it """
+    return _DecoderItem("int", name, offset, format=format_character, bits=bits, min_length=min_length,
+                        end=offset + struct.calcsize(">" + format_character))
+
+
+def fixed_str(name, offset, end, min_length=None):
+    """ An ASCII string, left justified and padded with spaces (instruct's str_field defaults) """
+    return _DecoderItem("str", name, offset, end=end, min_length=min_length)
+
+
+def fixed_bytearray(name, offset, end=None, min_length=None):
+    return _DecoderItem("bytearray", name, offset, end=end, min_length=min_length)
+
+
+def fixed_buffer(name, offset, buffer_type, end=None, condition=None):
+    return _DecoderItem("buffer", name, offset, type=buffer_type, end=end, condition=condition)
+
+
+def fixed_list(name, offset, item, end=None, count=None, condition=None, min_length=None):
+    """ A list of integers (item is a struct format character) or of buffers (item is a buffer class) """
+    if isinstance(item, str):
+        return _DecoderItem("int_list", name, offset, format=item, end=end, count=count, condition=condition,
+                            min_length=min_length)
+    return _DecoderItem("buffer_list", name, offset, type=item, end=end, count=count, condition=condition,
+                        min_length=min_length)
+
+
+def fixed_lazy_list(name, offset, buffer_type, item_size, end=None, count=None, condition=None):
+    """ A LazyList of buffers, for a field declared with lazy_list_fields(). item_size(buffer, offset, end) returns
+    the size buffer_type unpacks from buffer[offset:end], or None if it would fail to, in which case instruct unpacks
+    the whole page """
+    return _DecoderItem("lazy_buffer_list", name, offset, type=buffer_type, item_size=item_size, end=end, count=count,
+                        condition=condition)
+
+
+class LazyList(object):
+    """ The count items of a lazy list field, the item at index being decode_item(index). Stored as the value of a
+    field declared with lazy_list_fields(), which replaces it with the list of its items when the field is read """
+    def __init__(self, count, decode_item):
+        super(LazyList, self).__init__()
+        self.count = count
+        self._decode_item = decode_item
+
+    def load(self):
+        return [self._decode_item(index) for index in range(self.count)]
+
+    def __reduce__(self):
+        # pickling (or copying) an object holding a lazy list holds the list instead
+        return list, (self.load(),)
+
+
+class _LazyListField(object):
+    def __init__(self, name, field):
+        super(_LazyListField, self).__init__()
+        self.name = name
+        self.field = field
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self.field
+        value = obj.__dict__.get(self.name, self.field)
+        if isinstance(value, LazyList):
+            value = obj.__dict__[self.name] = value.load()
+        return value
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+
+
+def lazy_list_fields(*names):
+    """ A class decorator for the fields of a buffer class that may be set to a LazyList: reading such a field
+    unpacks its items and sets it to a list of them """
+    def decorate(cls):
+        for name in names:
+            setattr(cls, name, _LazyListField(name, getattr(cls, name)))
+        return cls
+    return decorate
+
+
+def _lazy_buffer_list(buffer_type, buffer, offsets, end):
+    if not isinstance(buffer, bytes):
+        buffer = bytes(buffer)      # the caller may modify its buffer after unpacking
+    return LazyList(len(offsets), lambda index: _decode_buffer(buffer_type, buffer, offsets[index], end)[0])
+
+
+def _decode_buffer(buffer_type, buffer, start, end):
+    """ Returns (a new buffer_type unpacked from buffer[start:end], its unpacked size) """
+    decoder = buffer_type.__dict__.get("_decoder_")
+    if decoder is None or not _decoders["enabled"]:
+        obj = buffer_type()
+        return obj, obj.unpack(buffer[start:end])
+    obj = buffer_type.__new__(buffer_type)
+    size = decoder.decode(obj, buffer, start, end)
+    if size is None:
+        size = super(FixedLayoutBuffer, obj).unpack(buffer[start:end])
+    return obj, size
+
+
+class FixedLayoutDecoder(object):
+    def __init__(self, items):
+        super(FixedLayoutDecoder, self).__init__()
+        self.items = list(items)
+        self._decode = None
+
+    def decode(self, obj, buffer, start, end):
+        """ Sets the fields of obj, an instance of the class defining the decoder, from buffer[start:end]. Returns
+        the unpacked size, or None if the buffer cannot be decoded (and instruct should unpack it) """
+        if self._decode is None:
+            self._decode = self._compile(type(obj))
+        return self._decode(obj, buffer, start, end)
+
+    def _compile(self, owner):
+        namespace = dict(unpack_from=struct.unpack_from, decode_buffer=_decode_buffer,
+                         lazy_buffer_list=_lazy_buffer_list)
+        names = ("_{}".format(index) for index in itertools.count())
+        mandatory = [item for item in self.items if item.kind in ("int", "str") and item.min_length is None]
+        required = max([0] + [item.end for item in mandatory])
+        lines = ["def decode(obj, buffer, start, end):",
+                 "    length = end - start",
+                 "    if length < {}:".format(required),
+                 "        return None",
+                 "    try:"]
+        # the mandatory integers are read with one struct, if they do not overlap
+        reads = sorted(set((item.offset, item.format) for item in mandatory if item.kind == "int"))
+        if reads and all(offset + struct.calcsize(">" + format_character) <= next_offset
+                         for (offset, format_character), (next_offset, _) in zip(reads, reads[1:])):
+            format_characters, position = [], 0
+            for offset, format_character in reads:
+                format_characters.append("{}x{}".format(offset - position, format_character))
+                position = offset + struct.calcsize(">" + format_character)
+            namespace["unpack_mandatory"] = struct.Struct(">" + "".join(format_characters)).unpack_from
+            variables = dict((read, "v{}".format(index)) for index, read in enumerate(reads))
+            lines.append("        {}, = unpack_mandatory(buffer, start)".format(
+                ", ".join(variables[read] for read in reads)))
+        else:
+            variables = dict()
+        lines.append("        size = {}".format(max([0] + [item.end for item in mandatory if item.kind == "int"])))
+        for item in self.items:
+            lines.extend("        " + line for line in self._compile_item(item, namespace, names, variables))
+        lines.extend(["    except Exception:",
+                      "        return None"])
+        byte_size = getattr(owner, "byte_size", None)
+        lines.append("    return {}".format(repr(byte_size) if byte_size is not None else "size"))
+        exec(compile("\n".join(lines) + "\n", "<FixedLayoutDecoder {}>".format(owner.__name__), "exec"), namespace)
+        return namespace["decode"]
+
+    def _reference(self, value, namespace, names):
+        """ Returns the source of a dynamic property of an item - a constant or a function of (obj, length) """
+        if value is None or isinstance(value, int):
+            return repr(value)
+        name = next(names)
+        namespace[name] = value
+        return "{}(obj, length)".format(name)
+
+    def _compile_item(self, item, namespace, names, variables):
+        attribute = "obj." + item.name
+        if item.kind == "int":
+            value = variables.get((item.offset, item.format)) if item.min_length is None else None
+            if value is None:
+                value = "unpack_from('>{}', buffer, start + {})[0]".format(item.format, item.offset)
+            if item.bits is not None:
+                value = "({} >> {}) & {:#x}".format(value, item.bits[0], (1 << item.bits[1]) - 1)
+            lines = ["{} = {}".format(attribute, value)]
+            if item.min_length is not None:
+                lines.append("size = max(size, {})".format(item.end))
+        elif item.kind in ("str", "bytearray"):
+            # like instruct, the value is the part of [offset:end] in the buffer
+            lines = self._end(item, namespace, names)
+            value = "buffer[start + {}:item_end]".format(item.offset)
+            if item.kind == "str":
+                value = "bytes({}).rstrip(b'\\x00').rstrip(b' ').decode('ascii')".format(value)
+            else:
+                value = "bytearray({})".format(value)
+            lines.extend(["{} = {}".format(attribute, value),
+                          "size = max(size, item_end - start)"])
+        elif item.kind == "buffer":
+            lines = self._end(item, namespace, names) + [
+                "value, item_size = decode_buffer({}, buffer, start + {}, item_end)".format(
+                    self._reference_object(item.type, namespace, names), item.offset),
+                "{} = value".format(attribute),
+                "size = max(size, {} + item_size)".format(item.offset)]
+        else:
+            lines = self._end(item, namespace, names) + [
+                "count = {}".format(self._reference(item.count, namespace, names))]
+            if item.kind == "int_list":
+                item_size = struct.calcsize(">" + item.format)
+                lines.extend([
+                    "available = (item_end - start - {} + {}) // {}".format(item.offset, item_size - 1, item_size),
+                    "count = available if count is None else max(0, min(count, available))",
+                    "if start + {} + count * {} > item_end:".format(item.offset, item_size),
+                    "    return None",
+                    "{} = list(unpack_from('>%d{}' % count, buffer, start + {}))".format(
+                        attribute, item.format, item.offset),
+                    "size = max(size, {} + count * {})".format(item.offset, item_size)])
+            elif item.kind == "lazy_buffer_list":
+                lines.extend([
+                    "offsets = []",
+                    "offset = start + {}".format(item.offset),
+                    "while offset < item_end and (count is None or len(offsets) < count):",
+                    "    item_size = {}(buffer, offset, item_end)".format(
+                        self._reference_object(item.item_size, namespace, names)),
+                    "    if not item_size:",
+                    "        return None",
+                    "    offsets.append(offset)",
+                    "    offset += item_size",
+                    "{} = lazy_buffer_list({}, buffer, offsets, item_end)".format(
+                        attribute, self._reference_object(item.type, namespace, names)),
+                    "size = max(size, offset - start)"])
+            else:
+                lines.extend([
+                    "items = []",
+                    "offset = start + {}".format(item.offset),
+                    "while offset < item_end and (count is None or len(items) < count):",
+                    "    value, item_size = decode_buffer({}, buffer, offset, item_end)".format(
+                        self._reference_object(item.type, namespace, names)),
+                    "    items.append(value)",
+                    "    offset += item_size",
+                    "{} = items".format(attribute),
+                    "size = max(size, offset - start)"])
+        conditions = []
+        if item.min_length is not None:
+            conditions.append("length >= {}".format(item.min_length))
+            if item.kind == "int" and item.end > item.min_length:
+                # instruct would fail unpacking a field it should unpack
+                lines.insert(0, "if length < {}:".format(item.end))
+                lines.insert(1, "    return None")
+        if item.condition is not None:
+            conditions.append(self._reference(item.condition, namespace, names))
+        if not conditions:
+            return lines
+        return (["if {}:".format(" and ".join(conditions))] + ["    " + line for line in lines] +
+                ["else:", "    {} = None".format(attribute)])
+
+    def _reference_object(self, value, namespace, names):
+        name = next(names)
+        namespace[name] = value
+        return name
+
+    def _end(self, item, namespace, names):
+        """ Returns the source lines setting item_end to the absolute end of an item, clipped to the buffer like a
+        slice """
+        if item.end is None:
+            return ["item_end = end"]
+        if isinstance(item.end, int):
+            return ["item_end = max(start + {}, min(end, start + {}))".format(item.offset, item.end)]
+        # instruct fails on references ending before they start
+        return ["item_end = start + {}".format(self._reference(item.end, namespace, names)),
+                "if item_end < start + {}:".format(item.offset),
+                "    return None",
+                "item_end = min(end, item_end)"]
+
+
+def _to_bytes_like(buffer):
+    if isinstance(buffer, (bytes, bytearray)):
+        return buffer
+    if isinstance(buffer, memoryview):
+        return buffer.tobytes()
+    return None
+
+
+class FixedLayoutBuffer(object):
+    """ A mixin for infi.instruct Buffer classes with a FixedLayoutDecoder: class X(FixedLayoutBuffer, Buffer) """
+    def unpack(self, buffer):
+        decoder = type(self).__dict__.get("_decoder_")
+        if decoder is not None and _decoders["enabled"]:
+            data = _to_bytes_like(buffer)
+            if data is not None:
+                size = decoder.decode(self, data, 0, len(data))
+                if size is not None:
+                    return size
+        return super(FixedLayoutBuffer, self).unpack(buffer)
+
+
+class FixedLayoutStruct(object):
+    """ A mixin for infi.instruct Struct classes with a FixedLayoutDecoder: class X(FixedLayoutStruct, Struct) """
+    @classmethod
+    def create_from_string(cls, s, context=EMPTY_CONTEXT, *args, **kwargs):
+        decoder = cls.__dict__.get("_decoder_")
+        if decoder is not None and _decoders["enabled"] and context is EMPTY_CONTEXT and not args and not kwargs \
+                and isinstance(s, bytes):
+            obj = cls.__new__(cls)
+            if decoder.decode(obj, s, 0, len(s)) is not None:
+                return obj
+        return super(FixedLayoutStruct, cls).create_from_string(s, context, *args, **kwargs)
@@ -6,14 +6,19 @@ from infi.instruct import UBInt8, UBInt16, BitFields, BitPadding, BitField, BitF
 from infi.instruct import Field, ConstField
 from infi.instruct.buffer import Buffer, be_int_field, bytes_ref
 from infi.instruct.buffer.compat import buffer_to_struct_adapter
+from ..fixed_layout import FixedLayoutBuffer, FixedLayoutDecoder, fixed_int
 
 
 # spc4r30: 6.4.2 (page 261)
-class PeripheralDeviceDataBuffer(Buffer):
+class PeripheralDeviceDataBuffer(FixedLayoutBuffer, Buffer):
     byte_size = 1
     type = be_int_field(where=bytes_ref[0].bits[0:5])  # 0-4
     qualifier = be_int_field(where=bytes_ref[0].bits[5:8])  # 5-7
 
+    _decoder_ = FixedLayoutDecoder([
+        fixed_int("type", 0, "B", bits=(0, 5)),
+        fixed_int("qualifier", 0, "B", bits=(5, 3))])
+
 
 PeripheralDeviceData = buffer_to_struct_adapter(PeripheralDeviceDataBuffer)
 
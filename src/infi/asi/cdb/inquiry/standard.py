@@ -2,12 +2,14 @@ from infi.asi.cdb.read import SCSIReadCommand
 from infi.instruct.buffer import (Buffer, buffer_field, bytes_ref, int_field, uint_field, str_field, bytearray_field,
                                   b_uint16, input_buffer_length, min_ref, list_field, self_ref)
 from . import InquiryCommand, PeripheralDeviceDataBuffer
+from ..fixed_layout import (FixedLayoutBuffer, FixedLayoutDecoder, fixed_int, fixed_str, fixed_bytearray, fixed_buffer,
+                            fixed_list)
 
 # spc4r30: 6.4.1 (page 259)
 CDB_OPCODE_INQUIRY = 0x12
 
 
-class StandardInquiryExtendedDataBuffer(Buffer):
+class StandardInquiryExtendedDataBuffer(FixedLayoutBuffer, Buffer):
     vendor_specific_1 = bytearray_field(where_when_unpack=bytes_ref[0:min_ref(20, input_buffer_length)],
                                         where_when_pack=bytes_ref[0:])
     # SPC-5 specific
@@ -32,9 +34,18 @@ class StandardInquiryExtendedDataBuffer(Buffer):
     def _has_vendor_specific_2_data(self):
         return self.vendor_specific_2 is not None
 
+    _decoder_ = FixedLayoutDecoder([
+        fixed_bytearray("vendor_specific_1", 0, 20),
+        fixed_int("ius", 20, "B", bits=(0, 1), min_length=21),
+        fixed_int("qas", 20, "B", bits=(1, 1), min_length=21),
+        fixed_int("clocking", 20, "B", bits=(2, 2), min_length=21),
+        fixed_list("version_descriptors", 22, "H", count=lambda obj, length: min((length - 22) // 2, 8),
+                   min_length=24),
+        fixed_bytearray("vendor_specific_2", 60, min_length=61)])
+
 
 # spc4r30: 6.4.2 (page 261)
-class StandardInquiryDataBuffer(Buffer):
+class StandardInquiryDataBuffer(FixedLayoutBuffer, Buffer):
     peripheral_device = buffer_field(PeripheralDeviceDataBuffer, where=bytes_ref[0])
     # bytes_ref[1].bits[0:7] - reserved
     cong = uint_field(where=bytes_ref[1].bits[6])
@@ -74,6 +85,33 @@ class StandardInquiryDataBuffer(Buffer):
                             pack_if=self_ref._has_extended_data(),
                             unpack_if=additional_length > (36 - 5))
 
+    _decoder_ = FixedLayoutDecoder([
+        fixed_buffer("peripheral_device", 0, PeripheralDeviceDataBuffer, end=1),
+        fixed_int("cong", 1, "B", bits=(6, 1)),
+        fixed_int("rmb", 1, "B", bits=(7, 1)),
+        fixed_int("version", 2, "B"),
+        fixed_int("response_data_format", 3, "B", bits=(0, 4)),
+        fixed_int("hisup", 3, "B", bits=(4, 1)),
+        fixed_int("normaca", 3, "B", bits=(5, 1)),
+        fixed_int("additional_length", 4, "B"),
+        fixed_int("protect", 5, "B", bits=(0, 1)),
+        fixed_int("threepc", 5, "B", bits=(3, 1)),
+        fixed_int("tpgs", 5, "B", bits=(4, 2)),
+        fixed_int("acc", 5, "B", bits=(6, 1)),
+        fixed_int("sccs", 5, "B", bits=(7, 1)),
+        fixed_int("addr16", 6, "B", bits=(0, 1)),
+        fixed_int("multi_p", 6, "B", bits=(4, 1)),
+        fixed_int("enc_serv", 6, "B", bits=(6, 1)),
+        fixed_int("cmd_que", 7, "B", bits=(1, 1)),
+        fixed_int("sync", 7, "B", bits=(4, 1)),
+        fixed_int("wbus16", 7, "B", bits=(5, 1)),
+        fixed_str("t10_vendor_identification", 8, 16),
+        fixed_str("product_identification", 16, 32),
+        fixed_str("product_revision_level", 32, 36),
+        fixed_buffer("extended", 36, StandardInquiryExtendedDataBuffer,
+                     end=lambda obj, length: obj.additional_length + 5,
+                     condition=lambda obj, length: obj.additional_length > (36 - 5))])
+
     def _has_extended_data(self):
         return self.extended is not None
 
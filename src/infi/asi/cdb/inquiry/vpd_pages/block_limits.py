@@ -1,10 +1,11 @@
 from infi.asi.cdb.inquiry import PeripheralDeviceDataBuffer
 from infi.asi.cdb.inquiry.vpd_pages import EVPDInquiryCommand
+from infi.asi.cdb.fixed_layout import FixedLayoutBuffer, FixedLayoutDecoder, fixed_int, fixed_buffer
 from infi.instruct.buffer import Buffer, buffer_field, bytes_ref, be_uint_field
 
 
 # spc3r26: 6.5.3 (page 241)
-class BlockLimitsVPDPageBuffer(Buffer):
+class BlockLimitsVPDPageBuffer(FixedLayoutBuffer, Buffer):
     peripheral_device = buffer_field(where=bytes_ref[0:], type=PeripheralDeviceDataBuffer)
     page_code = be_uint_field(where=bytes_ref[1])
     page_length = be_uint_field(where=bytes_ref[2:4])
@@ -21,6 +22,23 @@ class BlockLimitsVPDPageBuffer(Buffer):
     ugavalid = be_uint_field(where=bytes_ref[32].bits[7])
     maximum_write_same_length = be_uint_field(where=bytes_ref[36:44])
 
+    _decoder_ = FixedLayoutDecoder([
+        fixed_buffer("peripheral_device", 0, PeripheralDeviceDataBuffer, end=1),
+        fixed_int("page_code", 1, "B"),
+        fixed_int("page_length", 2, "H"),
+        fixed_int("wsnz", 4, "B", bits=(0, 1)),
+        fixed_int("maximum_compare_and_write_length", 5, "B"),
+        fixed_int("optimal_transfer_length_granularity", 6, "H"),
+        fixed_int("maximum_transfer_length", 8, "I"),
+        fixed_int("optimal_transfer_length", 12, "I"),
+        fixed_int("maximum_prefetch_xdread_xdwrite_transfer_length", 16, "I"),
+        fixed_int("maximum_unmap_lba_count", 20, "I"),
+        fixed_int("maximum_unmap_block_descriptor_count", 24, "I"),
+        fixed_int("optimal_unmap_granularity", 28, "I"),
+        fixed_int("unmap_granularity_alignment", 32, "I", bits=(0, 31)),
+        fixed_int("ugavalid", 32, "B", bits=(7, 1)),
+        fixed_int("maximum_write_same_length", 36, "Q")])
+
 
 class BlockLimitsPageCommand(EVPDInquiryCommand):
     def __init__(self):
@@ -1,5 +1,8 @@
+import struct
 from .transport import TransportId
 from infi.asi.cdb import CDBBuffer
+from infi.asi.cdb.fixed_layout import (FixedLayoutBuffer, FixedLayoutDecoder, fixed_int, fixed_buffer, fixed_list,
+                                      fixed_lazy_list, lazy_list_fields)
 from infi.asi import SCSIReadCommand
 from infi.asi.cdb.control import DEFAULT_CONTROL_BUFFER, ControlBuffer
 from infi.instruct.buffer import *
@@ -18,7 +21,7 @@ class PERSISTENT_RESERVE_IN_SERVICE_ACTION_CODES(object):
     READ_FULL_STATUS = 0x03
 
 
-class PersistentReserveInReadKeysResponse(CDBBuffer):
+class PersistentReserveInReadKeysResponse(FixedLayoutBuffer, CDBBuffer):
     """
     The buffer class for parsing the response of the read keys service
     action of the persistent reserve in command.
@@ -32,11 +35,18 @@ class PersistentReserveInReadKeysResponse(CDBBuffer):
                                                    # per key.
                           unpack_if=input_buffer_length >= additional_length + 8)
 
+    _decoder_ = FixedLayoutDecoder([
+        fixed_int("pr_generation", 0, "I"),
+        fixed_int("additional_length", 4, "I"),
+        fixed_list("key_list", 8, "Q", end=lambda obj, length: 8 + obj.additional_length,
+                   count=lambda obj, length: obj.additional_length // 8,
+                   condition=lambda obj, length: length >= obj.additional_length + 8)])
+
     def required_allocation_length(self):
         return self.additional_length + 8
 
 
-class PersistentReserveInReadReservationResponse(CDBBuffer):
+class PersistentReserveInReadReservationResponse(FixedLayoutBuffer, CDBBuffer):
     """
     The buffer class for parsing the response of the read reservations
     service action of the persistent reserve in command.
@@ -51,11 +61,21 @@ class PersistentReserveInReadReservationResponse(CDBBuffer):
     scope = be_uint_field(where=bytes_ref[21].bits[4:8], unpack_if=input_buffer_length >= 21)
     obsolete_2 = be_uint_field(where=bytes_ref[22:24], unpack_if=input_buffer_length >= 24)
 
+    _decoder_ = FixedLayoutDecoder([
+        fixed_int("pr_generation", 0, "I"),
+        fixed_int("additional_length", 4, "I"),
+        fixed_int("reservation_key", 8, "Q", min_length=16),
+        fixed_int("obsolete_1", 16, "I", min_length=20),
+        fixed_int("reserved_1", 20, "B", min_length=21),
+        fixed_int("pr_type", 21, "B", bits=(0, 4), min_length=21),
+        fixed_int("scope", 21, "B", bits=(4, 4), min_length=21),
+        fixed_int("obsolete_2", 22, "H", min_length=24)])
+
     def required_allocation_length(self):
         return self.additional_length + 8
 
 
-class PersistentReserveInReportCapabilitiesResponse(CDBBuffer):
+class PersistentReserveInReportCapabilitiesResponse(FixedLayoutBuffer, CDBBuffer):
     """
     The buffer class for parsing the response of the report capabilities
     service action of the persistent reserve in command.
@@ -82,11 +102,32 @@ class PersistentReserveInReportCapabilitiesResponse(CDBBuffer):
     exclusive_access_all_registrants = be_uint_field(where=bytes_ref[5].bits[0])
     reserved_4 = be_uint_field(where=bytes_ref[6:8])
 
+    _decoder_ = FixedLayoutDecoder([
+        fixed_int("length", 0, "H"),
+        fixed_int("persist_through_power_lost_capable", 2, "B", bits=(0, 1)),
+        fixed_int("reserved_1", 2, "B", bits=(1, 1)),
+        fixed_int("all_target_ports_capable", 2, "B", bits=(2, 1)),
+        fixed_int("specify_initiator_ports_capable", 2, "B", bits=(3, 1)),
+        fixed_int("compatible_reservation_handling", 2, "B", bits=(4, 1)),
+        fixed_int("reserved_2", 2, "B", bits=(5, 2)),
+        fixed_int("replace_lost_reservation_capable", 2, "B", bits=(7, 1)),
+        fixed_int("persist_through_power_lost_activates", 3, "B", bits=(0, 1)),
+        fixed_int("reserved_3", 3, "B", bits=(1, 3)),
+        fixed_int("allow_commands", 3, "B", bits=(4, 3)),
+        fixed_int("type_mask_valid", 3, "B", bits=(7, 1)),
+        fixed_int("write_exclusive", 4, "B", bits=(1, 1)),
+        fixed_int("exclusive_access", 4, "B", bits=(3, 1)),
+        fixed_int("write_exclusive_registrants_only", 4, "B", bits=(5, 1)),
+        fixed_int("exclusive_access_registrants_only", 4, "B", bits=(6, 1)),
+        fixed_int("write_exclusive_all_registrants", 4, "B", bits=(7, 1)),
+        fixed_int("exclusive_access_all_registrants", 5, "B", bits=(0, 1)),
+        fixed_int("reserved_4", 6, "H")])
+
     def required_allocation_length(self):
         return 8
 
 
-class PersistentReserveInReadFullStatusDescriptor(CDBBuffer):
+class PersistentReserveInReadFullStatusDescriptor(FixedLayoutBuffer, CDBBuffer):
     """
     The buffer class for parsing a single status descriptor of the read
     full status service action of the persistent reserve in command.
@@ -102,8 +143,28 @@ class PersistentReserveInReadFullStatusDescriptor(CDBBuffer):
     transport_id = buffer_field(type=TransportId,
                                 where=bytes_ref[24:additional_length + 24])
 
+    _decoder_ = FixedLayoutDecoder([
+        fixed_int("reservation_key", 0, "Q"),
+        fixed_int("reservation_holder", 12, "B", bits=(0, 1)),
+        fixed_int("all_target_ports", 12, "B", bits=(1, 1)),
+        fixed_int("pr_type", 13, "B", bits=(0, 4)),
+        fixed_int("scope", 13, "B", bits=(4, 4)),
+        fixed_int("relative_target_port_identifier", 18, "H"),
+        fixed_int("additional_length", 20, "I"),
+        fixed_buffer("transport_id", 24, TransportId, end=lambda obj, length: obj.additional_length + 24)])
+
 
-class PersistentReserveInReadFullStatusResponse(CDBBuffer):
+def _get_full_status_descriptor_size(buffer, offset, end):
+    if end - offset <= 24:
+        return None
+    additional_length = struct.unpack_from(">I", buffer, offset + 20)[0]
+    if additional_length == 0:
+        return None     # instruct fails unpacking an empty transport ID
+    return min(24 + additional_length, end - offset)
+
+
+@lazy_list_fields("full_status_descriptors")
+class PersistentReserveInReadFullStatusResponse(FixedLayoutBuffer, CDBBuffer):
     """
     The buffer class for parsing the response of the read full status
     service action of the persistent reserve in command.
@@ -116,6 +177,13 @@ class PersistentReserveInReadFullStatusResponse(CDBBuffer):
         type=PersistentReserveInReadFullStatusDescriptor,
         unpack_if=additional_length > 0)
 
+    _decoder_ = FixedLayoutDecoder([
+        fixed_int("pr_generation", 0, "I"),
+        fixed_int("additional_length", 4, "I"),
+        fixed_lazy_list("full_status_descriptors", 8, PersistentReserveInReadFullStatusDescriptor,
+                        _get_full_status_descriptor_size, end=lambda obj, length: 8 + obj.additional_length,
+                        condition=lambda obj, length: obj.additional_length > 0)])
+
     def required_allocation_length(self):
         return additional_length + 8
 
@@ -1,10 +1,17 @@
 from infi.asi.cdb import CDBBuffer
+from infi.asi.cdb.fixed_layout import FixedLayoutBuffer, FixedLayoutDecoder, fixed_int, fixed_bytearray
 from infi.instruct.buffer import *
 from infi.instruct.buffer.macros import *
 
 # spc-4_rev36: 6.15.5
-class TransportId(CDBBuffer):
+class TransportId(FixedLayoutBuffer, CDBBuffer):
     protocol_identifier = be_uint_field(where=bytes_ref[0].bits[0:4], default=1)
     reserved_1 = be_uint_field(where=bytes_ref[0].bits[4:6], set_before_pack=0)
     format_code = be_uint_field(where=bytes_ref[0].bits[6:8], default=0)
-    specific_data = bytearray_field(where=bytes_ref[1:])
\ No newline at end of file
+    specific_data = bytearray_field(where=bytes_ref[1:])
+
+    _decoder_ = FixedLayoutDecoder([
+        fixed_int("protocol_identifier", 0, "B", bits=(0, 4)),
+        fixed_int("reserved_1", 0, "B", bits=(4, 2)),
+        fixed_int("format_code", 0, "B", bits=(6, 2)),
+        fixed_bytearray("specific_data", 1)])
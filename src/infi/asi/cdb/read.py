@@ -1,7 +1,8 @@
 from . import CDB
 from .. import SCSIReadCommand
 from .operation_code import OperationCode
-from .control import Control, DEFAULT_CONTROL
+from .control import Control, DEFAULT_CONTROL, CONTROL_BIT_FIELDS
+from .fixed_layout import FixedLayoutEncoder
 from infi.instruct import *
 from ..errors import AsiException
 # spc4r30: 6.4.1 (page 259)
@@ -25,6 +26,13 @@ class Read6Command(CDB):
         Field("control", Control, DEFAULT_CONTROL)
     ]
 
+    _encoder_ = FixedLayoutEncoder([
+        ("B", CDB_OPCODE_READ_6),
+        ("B", [("logical_block_address__msb", 0, 5)]),
+        ("H", "logical_block_address__lsb"),
+        ("B", "transfer_length"),
+        ("B", CONTROL_BIT_FIELDS)])
+
     def __init__(self, logical_block_address, transfer_length, block_size=DEFAULT_BLOCK_SIZE):
         super(Read6Command, self).__init__()
         self.logical_block_address = logical_block_address
@@ -63,17 +71,27 @@ class Read10Command(CDB):
                 Field("control", Control, DEFAULT_CONTROL)
                 ]
 
-    def __init__(self, logical_block_address, transfer_length, block_size=DEFAULT_BLOCK_SIZE):
+    _encoder_ = FixedLayoutEncoder([
+        ("B", CDB_OPCODE_READ_10),
+        ("B", [("fua_nv", 1, 1), ("fua", 3, 1), ("dpo", 4, 1), ("rdprotect", 5, 3)]),
+        ("I", "logical_block_address"),
+        ("B", [("group_number", 0, 5)]),
+        ("H", "transfer_length"),
+        ("B", CONTROL_BIT_FIELDS)])
+
+    def __init__(self, logical_block_address, transfer_length, block_size=DEFAULT_BLOCK_SIZE, buffer=None):
         super(Read10Command, self).__init__()
         self.logical_block_address = logical_block_address
         self.block_size = block_size
         self.transfer_length = transfer_length
+        self.buffer = buffer
         assert self.logical_block_address < 2 ** 32
         assert self.transfer_length < 2 ** 16
 
     def execute(self, executer):
         datagram = self.create_datagram()
-        result_datagram = yield executer.call(SCSIReadCommand(datagram, self.block_size * self.transfer_length))
+        result_datagram = yield executer.call(SCSIReadCommand(datagram, self.block_size * self.transfer_length,
+                                                              self.buffer))
         yield result_datagram
 
 
@@ -95,17 +113,27 @@ class Read12Command(CDB):
                 Field("control", Control, DEFAULT_CONTROL)
                 ]
 
-    def __init__(self, logical_block_address, transfer_length, block_size=DEFAULT_BLOCK_SIZE):
+    _encoder_ = FixedLayoutEncoder([
+        ("B", CDB_OPCODE_READ_12),
+        ("B", [("RelAdr", 0, 1), ("fua", 3, 1), ("dpo", 4, 1), ("reserved", 5, 3)]),
+        ("I", "logical_block_address"),
+        ("I", "transfer_length"),
+        ("B", 0),
+        ("B", CONTROL_BIT_FIELDS)])
+
+    def __init__(self, logical_block_address, transfer_length, block_size=DEFAULT_BLOCK_SIZE, buffer=None):
         super(Read12Command, self).__init__()
         self.logical_block_address = logical_block_address
         self.block_size = block_size
         self.transfer_length = transfer_length
+        self.buffer = buffer
         assert self.logical_block_address < 2 ** 32
         assert self.transfer_length < 2 ** 32
 
     def execute(self, executer):
         datagram = self.create_datagram()
-        result_datagram = yield executer.call(SCSIReadCommand(datagram, self.block_size * self.transfer_length))
+        result_datagram = yield executer.call(SCSIReadCommand(datagram, self.block_size * self.transfer_length,
+                                                              self.buffer))
         yield result_datagram
 
 class Read16Command(CDB):
@@ -129,15 +157,25 @@ class Read16Command(CDB):
                 Field("control", Control, DEFAULT_CONTROL)
                 ]
 
-    def __init__(self, logical_block_address, transfer_length, block_size=DEFAULT_BLOCK_SIZE):
+    _encoder_ = FixedLayoutEncoder([
+        ("B", CDB_OPCODE_READ_16),
+        ("B", [("fua_nv", 1, 1), ("fua", 3, 1), ("dpo", 4, 1), ("reserved", 5, 3)]),
+        ("Q", "logical_block_address"),
+        ("I", "transfer_length"),
+        ("B", [("group_number", 0, 5), ("mmc4", 7, 1)]),
+        ("B", CONTROL_BIT_FIELDS)])
+
+    def __init__(self, logical_block_address, transfer_length, block_size=DEFAULT_BLOCK_SIZE, buffer=None):
         super(Read16Command, self).__init__()
         self.logical_block_address = logical_block_address
         self.block_size = block_size
         self.transfer_length = transfer_length
+        self.buffer = buffer
         assert self.logical_block_address < 2 ** 64
         assert self.transfer_length < 2 ** 32
 
     def execute(self, executer):
         datagram = self.create_datagram()
-        result_datagram = yield executer.call(SCSIReadCommand(datagram, self.block_size * self.transfer_length))
+        result_datagram = yield executer.call(SCSIReadCommand(datagram, self.block_size * self.transfer_length,
+                                                              self.buffer))
         yield result_datagram
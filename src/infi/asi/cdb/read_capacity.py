@@ -2,6 +2,7 @@ from . import CDB
 from .. import SCSIReadCommand
 from .operation_code import OperationCode
 from .control import Control, DEFAULT_CONTROL
+from .fixed_layout import FixedLayoutStruct, FixedLayoutDecoder, fixed_int
 from infi.instruct import *
 
 # spc4r30: 6.37 (page 394)
@@ -68,7 +69,7 @@ class ReadCapacity16Command(CDB):
         yield result
 
 
-class ReportReadCapacityData16(Struct):
+class ReportReadCapacityData16(FixedLayoutStruct, Struct):
         _fields_ = [
         UBInt64("last_logical_block_address"),
         UBInt32("block_length_in_bytes"),
@@ -89,4 +90,15 @@ class ReportReadCapacityData16(Struct):
         UBInt8("lowest_aligned_lba_lsb"),
         Padding(16),
         ]
+        _decoder_ = FixedLayoutDecoder([
+            fixed_int("last_logical_block_address", 0, "Q"),
+            fixed_int("block_length_in_bytes", 8, "I"),
+            fixed_int("prot_en", 12, "B", bits=(0, 1)),
+            fixed_int("p_type", 12, "B", bits=(1, 3)),
+            fixed_int("logical_blocks_per_physical_block", 13, "B", bits=(0, 4)),
+            fixed_int("p_i_exponent", 13, "B", bits=(4, 4)),
+            fixed_int("lowest_aligned_lba_msb", 14, "B", bits=(0, 6)),
+            fixed_int("troz", 14, "B", bits=(6, 1)),
+            fixed_int("tpe", 14, "B", bits=(7, 1)),
+            fixed_int("lowest_aligned_lba_lsb", 15, "B")])
 
@@ -1,14 +1,20 @@
+import struct
+from functools import reduce
+from operator import or_
 from . import CDB
 from .. import SCSIReadCommand
 from .operation_code import OperationCode
 from .control import Control, DEFAULT_CONTROL
 from infi.asi.errors import AsiInternalError
 from infi.instruct import *
+from infi.instruct.base import EMPTY_CONTEXT
 
 # spc4r30: 6.37 (page 394)
 
 CDB_OPCODE = 0xA0
 ALLOCATION_SIZE_FOR_256_LUNS = 16384
+# the bits of a LUN that are zero in the simple logical unit addressing method with no second level LUN
+UNSUPPORTED_ADDRESSING_MASK = 0xC000FFFFFFFFFFFF
 
 
 class UnsupportedReportLuns(AsiInternalError):
@@ -59,6 +65,18 @@ class ReportLunsData(Struct):
         SumSizeArray("lun_list", ReadPointer("lun_list_length"), UBInt64),
     ]
 
+    @classmethod
+    def create_from_string(cls, s, context=EMPTY_CONTEXT, *args, **kwargs):
+        """ Like Struct.create_from_string, except that lun_list is unpacked with a single struct call """
+        if isinstance(s, (bytes, bytearray)) and context is EMPTY_CONTEXT and not args and not kwargs and len(s) >= 8:
+            lun_list_length = struct.unpack_from(">I", s)[0]
+            if lun_list_length % 8 == 0 and len(s) >= 8 + lun_list_length:
+                result = cls(lun_list_length=lun_list_length)
+                result.lun_list = list(struct.unpack_from(">{}Q".format(lun_list_length // 8), s, 8))
+                return result
+        # instruct fails on truncated lists
+        return super(ReportLunsData, cls).create_from_string(s, context, *args, **kwargs)
+
     def _raise_if_unsupported_lun_addressing_format(self, item):
         if item & 0xFFFFFFFFFFFF: # there is second/third/fourth level addressing
             raise UnsupportedLunAdressing(item)
@@ -66,7 +84,8 @@ class ReportLunsData(Struct):
             raise UnsupportedLogicalUnitAddressingMethod(item)
 
     def normalize_lun_list(self, allow_unsupported_addressing_format=False):
-        if not allow_unsupported_addressing_format:
+        # check every LUN only if their bits ORed together show that one of them is unsupported
+        if not allow_unsupported_addressing_format and reduce(or_, self.lun_list, 0) & UNSUPPORTED_ADDRESSING_MASK:
             for item in self.lun_list:
                 self._raise_if_unsupported_lun_addressing_format(item)
         self.lun_list = [item >> 48 for item in self.lun_list]
@@ -5,6 +5,7 @@ from .operation_code import OperationCode
 from .control import Control, DEFAULT_CONTROL
 from infi.instruct import *
 from ..errors import AsiException
+from .fixed_layout import FixedLayoutBuffer, FixedLayoutDecoder, fixed_int, fixed_list
 # spc4r30: 6.4.1 (page 259)
 from infi.instruct import UBInt32
 from infi.instruct.buffer import *
@@ -53,11 +54,13 @@ class RTPGCommand(CDB):
                                                 allocation_length=allocation_length)
         assert parameter_data_format in (0,1),"wrong parameter_data_format value {}".format(parameter_data_format)
 
-class TargetPortDescriptor(Buffer):
+class TargetPortDescriptor(FixedLayoutBuffer, Buffer):
     byte_size = 4
     relative_target_port_identifier = be_uint_field(where=bytes_ref[2:4])
 
-class TargetPortGroupDescriptor(Buffer):
+    _decoder_ = FixedLayoutDecoder([fixed_int("relative_target_port_identifier", 2, "H")])
+
+class TargetPortGroupDescriptor(FixedLayoutBuffer, Buffer):
     # SPC4-R37.pdf p. 481
 
     asymetric_access_state = be_int_field(where=bytes_ref[0].bits[0:4])
@@ -76,12 +79,36 @@ class TargetPortGroupDescriptor(Buffer):
     target_port_count = be_int_field(where=bytes_ref[7])
     target_port_list = list_field(type=TargetPortDescriptor, where=bytes_ref[8:], n=target_port_count)
 
-class TargetPortGroupLengthOnlyResponse(Buffer):
+    _decoder_ = FixedLayoutDecoder([
+        fixed_int("asymetric_access_state", 0, "B", bits=(0, 4)),
+        fixed_int("pref", 0, "B", bits=(7, 1)),
+        fixed_int("ao_sup", 1, "B", bits=(0, 1)),
+        fixed_int("an_sup", 1, "B", bits=(1, 1)),
+        fixed_int("s_sup", 1, "B", bits=(2, 1)),
+        fixed_int("u_sup", 1, "B", bits=(3, 1)),
+        fixed_int("lbd_sup", 1, "B", bits=(4, 1)),
+        fixed_int("o_sup", 1, "B", bits=(6, 1)),
+        fixed_int("t_sup", 1, "B", bits=(7, 1)),
+        fixed_int("target_port_group", 2, "H"),
+        fixed_int("status_code", 5, "b"),
+        fixed_int("target_port_count", 7, "b"),
+        fixed_list("target_port_list", 8, TargetPortDescriptor, count=lambda obj, length: obj.target_port_count)])
+
+class TargetPortGroupLengthOnlyResponse(FixedLayoutBuffer, Buffer):
     data_length = be_int_field(where=bytes_ref[0:4])
     descriptor_list = list_field(type=TargetPortGroupDescriptor, where=bytes_ref[4:4 + data_length])
 
-class TargetPortGroupExtendedResponse(Buffer):
+    _decoder_ = FixedLayoutDecoder([
+        fixed_int("data_length", 0, "i"),
+        fixed_list("descriptor_list", 4, TargetPortGroupDescriptor, end=lambda obj, length: 4 + obj.data_length)])
+
+class TargetPortGroupExtendedResponse(FixedLayoutBuffer, Buffer):
     data_length = be_int_field(where=bytes_ref[0:4])
     format_type = be_int_field(where=bytes_ref[4].bits[4:7])
     descriptor_list = list_field(type=TargetPortGroupDescriptor, where=bytes_ref[7:7 + data_length])
+
+    _decoder_ = FixedLayoutDecoder([
+        fixed_int("data_length", 0, "i"),
+        fixed_int("format_type", 4, "B", bits=(4, 3)),
+        fixed_list("descriptor_list", 7, TargetPortGroupDescriptor, end=lambda obj, length: 7 + obj.data_length)])
     # ...
@@ -1,9 +1,11 @@
 from . import CDB
 from .. import SCSIWriteCommand
 from .operation_code import OperationCode
-from .control import Control, DEFAULT_CONTROL
+from .control import Control, DEFAULT_CONTROL, CONTROL_BIT_FIELDS
+from .fixed_layout import FixedLayoutEncoder
 from infi.instruct import *
 from ..errors import AsiException
+from ..buffers import buffer_length
 # spc4r30: 6.4.1 (page 259)
 
 CDB_OPCODE_WRITE_6 = 0x0A
@@ -26,6 +28,13 @@ class Write6Command(CDB):
         Field("control", Control, DEFAULT_CONTROL)
     ]
 
+    _encoder_ = FixedLayoutEncoder([
+        ("B", CDB_OPCODE_WRITE_6),
+        ("B", [("logical_block_address__msb", 0, 5)]),
+        ("H", "logical_block_address__lsb"),
+        ("B", "transfer_length"),
+        ("B", CONTROL_BIT_FIELDS)])
+
     def __init__(self, logical_block_address, buffer, block_size=DEFAULT_BLOCK_SIZE):
         super(Write6Command, self).__init__()
         self.logical_block_address = logical_block_address
@@ -33,9 +42,9 @@ class Write6Command(CDB):
         self.block_size = block_size
 
         assert self.logical_block_address < 2 ** 21, "lba > 2**21"
-        assert len(buffer) % block_size == 0, "buffer length {0} is not a multiple of {1}".format(len(buffer), block_size)
+        assert buffer_length(buffer) % block_size == 0, "buffer length {0} is not a multiple of {1}".format(buffer_length(buffer), block_size)
 
-        num_blocks = len(buffer) // block_size
+        num_blocks = buffer_length(buffer) // block_size
         assert 0 < num_blocks <= 256, "number_of_blocks should be in range [1, 2**8]"
         if num_blocks == 256:
             self.transfer_length = 0
@@ -68,13 +77,21 @@ class Write10Command(CDB):
                 Field("control", Control, DEFAULT_CONTROL)
                 ]
 
+    _encoder_ = FixedLayoutEncoder([
+        ("B", CDB_OPCODE_WRITE_10),
+        ("B", [("fua_nv", 1, 1), ("fua", 3, 1), ("dpo", 4, 1), ("wrprotect", 5, 3)]),
+        ("I", "logical_block_address"),
+        ("B", [("group_number", 0, 5)]),
+        ("H", "transfer_length"),
+        ("B", CONTROL_BIT_FIELDS)])
+
     def __init__(self, logical_block_address, buffer, block_size=DEFAULT_BLOCK_SIZE):
         super(Write10Command, self).__init__()
         self.logical_block_address = logical_block_address
         self.buffer = buffer
         self.block_size = block_size
-        self.transfer_length = len(buffer) // block_size
-        assert len(buffer) % block_size == 0, "buffer length {0} is not a multiple of {1}".format(len(buffer), block_size)
+        self.transfer_length = buffer_length(buffer) // block_size
+        assert buffer_length(buffer) % block_size == 0, "buffer length {0} is not a multiple of {1}".format(buffer_length(buffer), block_size)
         assert self.logical_block_address < 2 ** 32, "lba > 2**32"
         assert 0 <= self.transfer_length < 2 ** 16, "number_of_blocks should be in range [0, 2**16)"
 
@@ -102,13 +119,21 @@ class Write12Command(CDB):
                 Field("control", Control, DEFAULT_CONTROL)
                 ]
 
+    _encoder_ = FixedLayoutEncoder([
+        ("B", CDB_OPCODE_WRITE_12),
+        ("B", [("fua_nv", 1, 1), ("fua", 3, 1), ("dpo", 4, 1), ("wrprotect", 5, 3)]),
+        ("I", "logical_block_address"),
+        ("I", "transfer_length"),
+        ("B", [("group_number", 0, 5)]),
+        ("B", CONTROL_BIT_FIELDS)])
+
     def __init__(self, logical_block_address, buffer, block_size=DEFAULT_BLOCK_SIZE):
         super(Write12Command, self).__init__()
         self.logical_block_address = logical_block_address
         self.buffer = buffer
         self.block_size = block_size
-        self.transfer_length = len(buffer) // block_size
-        assert len(buffer) % block_size == 0, "buffer length {0} is not a multiple of {1}".format(len(buffer), block_size)
+        self.transfer_length = buffer_length(buffer) // block_size
+        assert buffer_length(buffer) % block_size == 0, "buffer length {0} is not a multiple of {1}".format(buffer_length(buffer), block_size)
         assert self.logical_block_address < 2 ** 32, "lba > 2**32"
         assert 0 < self.transfer_length < 2 ** 32, "number_of_blocks should be in range [0, 2**32)"
 
@@ -136,13 +161,21 @@ class Write16Command(CDB):
                 Field("control", Control, DEFAULT_CONTROL)
                 ]
 
+    _encoder_ = FixedLayoutEncoder([
+        ("B", CDB_OPCODE_WRITE_16),
+        ("B", [("fua_nv", 1, 1), ("fua", 3, 1), ("dpo", 4, 1), ("wrprotect", 5, 3)]),
+        ("Q", "logical_block_address"),
+        ("I", "transfer_length"),
+        ("B", [("group_number", 0, 5)]),
+        ("B", CONTROL_BIT_FIELDS)])
+
     def __init__(self, logical_block_address, buffer, block_size=DEFAULT_BLOCK_SIZE):
         super(Write16Command, self).__init__()
         self.logical_block_address = logical_block_address
         self.buffer = buffer
         self.block_size = block_size
-        self.transfer_length = len(buffer) // block_size
-        assert len(buffer) % block_size == 0, "buffer length {0} is not a multiple of {1}".format(len(buffer), block_size)
+        self.transfer_length = buffer_length(buffer) // block_size
+        assert buffer_length(buffer) % block_size == 0, "buffer length {0} is not a multiple of {1}".format(buffer_length(buffer), block_size)
         assert self.logical_block_address < 2 ** 64, "lba > 2**64"
         assert 0 <= self.transfer_length < 2 ** 32, "number_of_blocks should be in range [0, 2**32)"
 
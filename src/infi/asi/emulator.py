@@ -0,0 +1,537 @@
+""" An in-process SCSI target, for exercising command executers and CDBs without a device.
+
+VirtualLun models a thin-provisioned direct-access logical unit: TEST UNIT READY, INQUIRY (standard data and the VPD
+pages of cdb.inquiry.vpd_pages), READ CAPACITY (10/16), READ and WRITE (6/10/12/16), WRITE SAME (10/16), UNMAP,
+COMPARE AND WRITE, REPORT LUNS and PERSISTENT RESERVE IN/OUT. EmulatedCommandExecuter executes commands on one:
+
+    lun = VirtualLun(block_count=1 << 20, queue_depth=32)
+    executer = EmulatedCommandExecuter(lun, max_queue_size=64, latency=LatencyModel(base=0.0002))
+    for data in executer.map(Read16Command(lba, 8) for lba in range(0, 1024, 8)):
+        ...
+
+Several executers (each with its own initiator transport ID) can share a LUN, e.g. to test persistent reservations.
+"""
+import heapq
+import itertools
+import random
+import struct
+import time
+from collections import OrderedDict
+from six.moves import range
+
+from . import CommandExecuterBase, SCSIReadCommand, SCSIWriteCommand, SCSI_STATUS_CODES, DEFAULT_MAX_QUEUE_SIZE
+from .errors import AsiSCSIError, AsiBusyError, AsiTaskSetFullError, AsiReservationConflictError
+from .buffers import buffer_bytes, is_buffer_sequence, read_result_view
+from .metrics import timer
+from .sense import SCSI_SENSE_KEY
+
+STATUS_GOOD = SCSI_STATUS_CODES['SCSI_STATUS_GOOD']
+STATUS_CHECK_CONDITION = SCSI_STATUS_CODES['SCSI_STATUS_CHECK_CONDITION']
+STATUS_BUSY = SCSI_STATUS_CODES['SCSI_STATUS_BUSY']
+STATUS_RESERVATION_CONFLICT = SCSI_STATUS_CODES['SCSI_STATUS_RESERVATION_CONFLICT']
+STATUS_TASK_SET_FULL = SCSI_STATUS_CODES['SCSI_STATUS_TASK_SET_FULL']
+
+# additional sense codes (asc, ascq) of the errors the emulator reports; spc4r30: table 51 (page 79)
+PARAMETER_LIST_LENGTH_ERROR = (0x1a, 0x00)
+MISCOMPARE_DURING_VERIFY_OPERATION = (0x1d, 0x00)
+INVALID_COMMAND_OPERATION_CODE = (0x20, 0x00)
+LOGICAL_BLOCK_ADDRESS_OUT_OF_RANGE = (0x21, 0x00)
+INVALID_FIELD_IN_CDB = (0x24, 0x00)
+INVALID_FIELD_IN_PARAMETER_LIST = (0x26, 0x00)
+INVALID_RELEASE_OF_PERSISTENT_RESERVATION = (0x26, 0x04)
+
+# opcode -> CDB size, for the commands that read or write the medium
+READ_OPCODES = {0x08: 6, 0x28: 10, 0xa8: 12, 0x88: 16}
+WRITE_OPCODES = {0x0a: 6, 0x2a: 10, 0xaa: 12, 0x8a: 16}
+MEDIUM_WRITE_OPCODES = set(WRITE_OPCODES) | set([0x41, 0x93, 0x42, 0x89])
+
+# spc4r30: 6.16.2, table 209 (page 377)
+PR_TYPE_WRITE_EXCLUSIVE = 0x01
+PR_TYPE_EXCLUSIVE_ACCESS = 0x03
+PR_TYPE_WRITE_EXCLUSIVE_REGISTRANTS_ONLY = 0x05
+PR_TYPE_EXCLUSIVE_ACCESS_REGISTRANTS_ONLY = 0x06
+PR_TYPE_WRITE_EXCLUSIVE_ALL_REGISTRANTS = 0x07
+PR_TYPE_EXCLUSIVE_ACCESS_ALL_REGISTRANTS = 0x08
+PR_TYPES = (PR_TYPE_WRITE_EXCLUSIVE, PR_TYPE_EXCLUSIVE_ACCESS, PR_TYPE_WRITE_EXCLUSIVE_REGISTRANTS_ONLY,
+            PR_TYPE_EXCLUSIVE_ACCESS_REGISTRANTS_ONLY, PR_TYPE_WRITE_EXCLUSIVE_ALL_REGISTRANTS,
+            PR_TYPE_EXCLUSIVE_ACCESS_ALL_REGISTRANTS)
+
+_LBA_AND_LENGTH_10 = struct.Struct(">2xIxH")
+_LBA_AND_LENGTH_12 = struct.Struct(">2xII")
+_LBA_AND_LENGTH_16 = struct.Struct(">2xQI")
+_UNMAP_BLOCK_DESCRIPTOR = struct.Struct(">QI4x")
+_PR_PARAMETERS = struct.Struct(">QQ")
+_PR_FULL_STATUS_DESCRIPTOR = struct.Struct(">Q4xBB4xHI")
+
+
+def _unpack_lba_and_length_6(cdb):
+    return ((cdb[1] & 0x1f) << 16) | (cdb[2] << 8) | cdb[3], cdb[4] or 256
+
+
+_UNPACK_LBA_AND_LENGTH = {6: _unpack_lba_and_length_6, 10: _LBA_AND_LENGTH_10.unpack_from,
+                          12: _LBA_AND_LENGTH_12.unpack_from, 16: _LBA_AND_LENGTH_16.unpack_from}
+
+_port_names = itertools.count(0x21000024ff000001)
+_serial_numbers = itertools.count(1)
+
+
+def create_fc_transport_id(port_name=None):
+    """ Returns the Fibre Channel transport ID (spc4r30: 7.5.4.2) of an N_Port name (by default, a new one) """
+    return struct.pack(">8xQ8x", port_name if port_name is not None else next(_port_names))
+
+
+def create_fixed_sense(sense_key, asc, ascq, information=None):
+    """ Returns fixed format sense data; if information is given, it is stored and marked valid """
+    sense = bytearray(18)
+    sense[0] = 0x70 if information is None else 0xf0
+    sense[2] = sense_key
+    if information is not None:
+        sense[3:7] = struct.pack(">I", information)
+    sense[7] = 10
+    sense[12], sense[13] = asc, ascq
+    return bytes(sense)
+
+
+class _CommandError(Exception):
+    def __init__(self, status, sense=b""):
+        super(_CommandError, self).__init__(status)
+        self.status = status
+        self.sense = sense
+
+
+def _illegal_request(additional_sense_code):
+    return _CommandError(STATUS_CHECK_CONDITION, create_fixed_sense(SCSI_SENSE_KEY['ILLEGAL_REQUEST'],
+                                                                    *additional_sense_code))
+
+
+def _ata_string(text, length):
+    """ ATA IDENTIFY DEVICE strings hold two characters per little-endian word, the first in the high byte """
+    text = text.ljust(length)[:length].encode("ascii")
+    return b"".join(text[index + 1:index + 2] + text[index:index + 1] for index in range(0, length, 2))
+
+
+class VirtualLun(object):
+    """ A thin-provisioned disk of block_count blocks of block_size bytes. Only blocks holding non-zero data are
+    stored, so a large LUN costs memory only for what was written to it; the other blocks read as zeros.
+
+    queue_depth, if not None, is the number of tasks the LUN accepts; executers sharing the LUN check it with
+    is_task_set_full() before executing a command and report it with add_task(). luns are the LUN numbers
+    REPORT LUNS returns. """
+
+    vendor = "INFI-ASI"
+    product = "VIRTUAL LUN"
+    revision = "0001"
+    maximum_compare_and_write_length = 1
+    maximum_transfer_length = 0xffff
+    maximum_unmap_lba_count = 0xffffffff
+    maximum_unmap_block_descriptor_count = 256
+    maximum_write_same_length = 0xffffffff
+
+    def __init__(self, block_count=1 << 21, block_size=512, queue_depth=None, serial=None, luns=(0,)):
+        super(VirtualLun, self).__init__()
+        self.block_count = block_count
+        self.block_size = block_size
+        self.queue_depth = queue_depth
+        unique_id = next(_serial_numbers)
+        self.serial = serial if serial is not None else "EMU{:08d}".format(unique_id)
+        self.naa = struct.pack(">QQ", 0x6001405000000000, unique_id)
+        self.luns = list(luns)
+        self.blocks = dict()                # lba -> data, for the blocks holding non-zero data
+        self.registrations = OrderedDict()  # initiator transport ID -> reservation key
+        self.reservation = None             # (holder transport ID or None for all registrants, type)
+        self.pr_generation = 0
+        self._zero_block = b"\x00" * block_size
+        self._tasks = []                    # a heap of the completion times of the tasks in progress
+
+    def is_task_set_full(self, now):
+        """ Returns True if queue_depth tasks are still in progress at time now """
+        if self.queue_depth is None:
+            return False
+        tasks = self._tasks
+        while tasks and tasks[0] <= now:
+            heapq.heappop(tasks)
+        return len(tasks) >= self.queue_depth
+
+    def add_task(self, completion_time):
+        if self.queue_depth is not None:
+            heapq.heappush(self._tasks, completion_time)
+
+    def read_blocks(self, lba, count):
+        self._check_range(lba, count)
+        blocks, zero_block = self.blocks, self._zero_block
+        return b"".join([blocks.get(block, zero_block) for block in range(lba, lba + count)])
+
+    def write_blocks(self, lba, data):
+        block_size = self.block_size
+        count = len(data) // block_size
+        self._check_range(lba, count)
+        for index in range(count):
+            self._store(lba + index, data[index * block_size:(index + 1) * block_size])
+
+    def deallocate_blocks(self, lba, count):
+        self._check_range(lba, count)
+        blocks = self.blocks
+        if count > len(blocks):
+            for block in [block for block in blocks if lba <= block < lba + count]:
+                del blocks[block]
+        else:
+            for block in range(lba, lba + count):
+                blocks.pop(block, None)
+
+    def _store(self, lba, block):
+        if block == self._zero_block:
+            self.blocks.pop(lba, None)
+        else:
+            self.blocks[lba] = block
+
+    def _check_range(self, lba, count):
+        if lba + count > self.block_count:
+            raise _illegal_request(LOGICAL_BLOCK_ADDRESS_OUT_OF_RANGE)
+
+    def execute(self, cdb, data_out=b"", allocation_length=0, initiator=b""):
+        """ Executes a CDB with its data-out buffer on behalf of initiator (a transport ID). Returns (status, data):
+        the response, truncated to allocation_length, if status is STATUS_GOOD; the sense data if it is
+        STATUS_CHECK_CONDITION """
+        cdb = bytearray(cdb)
+        handler = self._HANDLERS.get(cdb[0])
+        try:
+            if handler is None:
+                raise _illegal_request(INVALID_COMMAND_OPERATION_CODE)
+            self._check_reservation(cdb[0], initiator)
+            data = handler(self, cdb, bytes(data_out), initiator)
+        except _CommandError as error:
+            return error.status, error.sense
+        return STATUS_GOOD, data[:allocation_length]
+
+    def _check_reservation(self, opcode, initiator):
+        if self.reservation is None or (opcode not in READ_OPCODES and opcode not in MEDIUM_WRITE_OPCODES):
+            return
+        holder, pr_type = self.reservation
+        if initiator == holder:
+            return
+        if pr_type >= PR_TYPE_WRITE_EXCLUSIVE_REGISTRANTS_ONLY and initiator in self.registrations:
+            return
+        if opcode in MEDIUM_WRITE_OPCODES or pr_type not in (PR_TYPE_WRITE_EXCLUSIVE,
+                                                             PR_TYPE_WRITE_EXCLUSIVE_REGISTRANTS_ONLY,
+                                                             PR_TYPE_WRITE_EXCLUSIVE_ALL_REGISTRANTS):
+            raise _CommandError(STATUS_RESERVATION_CONFLICT)
+
+    # sbc3r25: 5.8-5.15, 5.28-5.33
+
+    def _read(self, cdb, data_out, initiator):
+        lba, count = _UNPACK_LBA_AND_LENGTH[READ_OPCODES[cdb[0]]](cdb)
+        return self.read_blocks(lba, count)
+
+    def _write(self, cdb, data_out, initiator):
+        lba, count = _UNPACK_LBA_AND_LENGTH[WRITE_OPCODES[cdb[0]]](cdb)
+        if len(data_out) != count * self.block_size:
+            raise _illegal_request(INVALID_FIELD_IN_CDB)
+        self.write_blocks(lba, data_out)
+        return b""
+
+    def _write_same(self, cdb, data_out, initiator):
+        lba, count = (_LBA_AND_LENGTH_10 if cdb[0] == 0x41 else _LBA_AND_LENGTH_16).unpack_from(cdb)
+        count = count or self.block_count - lba
+        if len(data_out) != self.block_size:
+            raise _illegal_request(INVALID_FIELD_IN_CDB)
+        if cdb[1] & 0x08 or data_out == self._zero_block:
+            self.deallocate_blocks(lba, count)
+        else:
+            self._check_range(lba, count)
+            for block in range(lba, lba + count):
+                self.blocks[block] = data_out
+        return b""
+
+    def _unmap(self, cdb, data_out, initiator):
+        if len(data_out) < 8:
+            return b""
+        descriptors_length, = struct.unpack_from(">H", data_out, 2)
+        end = min(8 + descriptors_length, len(data_out))
+        ranges = [_UNMAP_BLOCK_DESCRIPTOR.unpack_from(data_out, offset)
+                  for offset in range(8, end - _UNMAP_BLOCK_DESCRIPTOR.size + 1, _UNMAP_BLOCK_DESCRIPTOR.size)]
+        if len(ranges) > self.maximum_unmap_block_descriptor_count:
+            raise _illegal_request(INVALID_FIELD_IN_PARAMETER_LIST)
+        for lba, count in ranges:
+            self._check_range(lba, count)
+        for lba, count in ranges:
+            self.deallocate_blocks(lba, count)
+        return b""
+
+    def _compare_and_write(self, cdb, data_out, initiator):
+        lba, = struct.unpack_from(">Q", cdb, 2)
+        count = cdb[13]
+        if count > self.maximum_compare_and_write_length:
+            raise _illegal_request(INVALID_FIELD_IN_CDB)
+        length = count * self.block_size
+        if len(data_out) != 2 * length:
+            raise _illegal_request(INVALID_FIELD_IN_CDB)
+        current = self.read_blocks(lba, count)
+        if current != data_out[:length]:
+            offset = next(index for index in range(length) if current[index:index + 1] != data_out[index:index + 1])
+            raise _CommandError(STATUS_CHECK_CONDITION,
+                                create_fixed_sense(SCSI_SENSE_KEY['MISCOMPARE'], *MISCOMPARE_DURING_VERIFY_OPERATION,
+                                                   information=offset))
+        self.write_blocks(lba, data_out[length:])
+        return b""
+
+    def _test_unit_ready(self, cdb, data_out, initiator):
+        return b""
+
+    def _read_capacity_10(self, cdb, data_out, initiator):
+        return struct.pack(">II", min(self.block_count - 1, 0xffffffff), self.block_size)
+
+    def _service_action_in_16(self, cdb, data_out, initiator):
+        if cdb[1] & 0x1f != 0x10:     # READ CAPACITY (16)
+            raise _illegal_request(INVALID_FIELD_IN_CDB)
+        # thin provisioning enabled (tpe), unmapped blocks read as zeros (tprz)
+        return struct.pack(">QIBBBB16x", self.block_count - 1, self.block_size, 0, 0, 0xc0, 0)
+
+    # spc4r30: 6.4, 6.15, 6.16, 6.27
+
+    def _report_luns(self, cdb, data_out, initiator):
+        # peripheral device addressing for LUNs up to 255, flat space addressing above
+        luns = b"".join(struct.pack(">H6x", lun if lun < 256 else 0x4000 | lun) for lun in self.luns)
+        return struct.pack(">I4x", len(luns)) + luns
+
+    def _inquiry(self, cdb, data_out, initiator):
+        page_code = cdb[2]
+        if not cdb[1] & 0x01:
+            if page_code != 0:
+                raise _illegal_request(INVALID_FIELD_IN_CDB)
+            return self._standard_inquiry_data()
+        page = self._VPD_PAGES.get(page_code)
+        if page is None:
+            raise _illegal_request(INVALID_FIELD_IN_CDB)
+        payload = page(self)
+        return struct.pack(">BBH", 0, page_code, len(payload)) + payload
+
+    def _standard_inquiry_data(self):
+        # SPC-4, hierarchical LUN addressing, response data format 2, command queuing
+        return (struct.pack(">BBBBBBBB", 0, 0, 0x06, 0x12, 31, 0, 0, 0x02) + self.vendor.ljust(8).encode("ascii") +
+                self.product.ljust(16).encode("ascii") + self.revision.ljust(4).encode("ascii"))
+
+    def _supported_vpd_pages(self):
+        return bytes(bytearray(sorted(self._VPD_PAGES)))
+
+    def _unit_serial_number_page(self):
+        return self.serial.encode("ascii")
+
+    def _device_identification_page(self):
+        t10_vendor_id = self.vendor.ljust(8).encode("ascii") + self.serial.encode("ascii")
+        # NAA (binary, type 3) and T10 vendor ID (ASCII, type 1) designators of the logical unit
+        return (struct.pack(">BBxB", 0x01, 0x03, len(self.naa)) + self.naa +
+                struct.pack(">BBxB", 0x02, 0x01, len(t10_vendor_id)) + t10_vendor_id)
+
+    def _ata_information_page(self):
+        identify = bytearray(512)
+        identify[20:40] = _ata_string(self.serial, 20)
+        identify[46:54] = _ata_string(self.revision, 8)
+        identify[54:94] = _ata_string(self.product, 40)
+        return (b"\x00" * 4 + self.vendor.ljust(8).encode("ascii") + self.product.ljust(16).encode("ascii") +
+                self.revision.ljust(4).encode("ascii") + b"\x00" * 20 + b"\xec\x00\x00\x00" + bytes(identify))
+
+    def _block_limits_page(self):
+        page = bytearray(60)
+        page[1] = self.maximum_compare_and_write_length
+        struct.pack_into(">I", page, 4, self.maximum_transfer_length)
+        struct.pack_into(">II", page, 16, self.maximum_unmap_lba_count, self.maximum_unmap_block_descriptor_count)
+        struct.pack_into(">I", page, 24, 1)                   # optimal unmap granularity
+        struct.pack_into(">I", page, 28, 0x80000000)          # ugavalid, unmap granularity alignment 0
+        struct.pack_into(">Q", page, 32, self.maximum_write_same_length)
+        return bytes(page)
+
+    def _logical_block_provisioning_page(self):
+        # lbpu, lbpws, lbpws10 and lbprz set; thin provisioned
+        return struct.pack(">BBBB", 0, 0xe4, 0x02, 0)
+
+    def _veritas_page(self):
+        return struct.pack(">BBBB", 0x01, 0, 0, 0)      # a thin LUN
+
+    def _persistent_reserve_in(self, cdb, data_out, initiator):
+        service_action = cdb[1] & 0x1f
+        if service_action == 0x00:      # READ KEYS
+            keys = b"".join(struct.pack(">Q", key) for key in self.registrations.values())
+            return struct.pack(">II", self.pr_generation, len(keys)) + keys
+        if service_action == 0x01:      # READ RESERVATION
+            if self.reservation is None:
+                return struct.pack(">II", self.pr_generation, 0)
+            holder, pr_type = self.reservation
+            key = 0 if pr_type >= PR_TYPE_WRITE_EXCLUSIVE_ALL_REGISTRANTS else self.registrations[holder]
+            return struct.pack(">IIQ4xxB2x", self.pr_generation, 16, key, pr_type)
+        if service_action == 0x02:      # REPORT CAPABILITIES: the type mask lists all the PR_TYPES
+            return struct.pack(">HBBBB2x", 8, 0, 0x80, 0xea, 0x01)
+        if service_action == 0x03:      # READ FULL STATUS
+            descriptors = b"".join(_PR_FULL_STATUS_DESCRIPTOR.pack(key, int(self._is_reservation_holder(registrant)),
+                                                                   self.reservation[1] if self.reservation else 0, 1,
+                                                                   len(registrant)) + registrant
+                                   for registrant, key in self.registrations.items())
+            return struct.pack(">II", self.pr_generation, len(descriptors)) + descriptors
+        raise _illegal_request(INVALID_FIELD_IN_CDB)
+
+    def _is_reservation_holder(self, initiator):
+        if self.reservation is None or initiator not in self.registrations:
+            return False
+        holder, pr_type = self.reservation
+        return holder == initiator or pr_type >= PR_TYPE_WRITE_EXCLUSIVE_ALL_REGISTRANTS
+
+    def _holder(self, initiator, pr_type):
+        """ All the registrants hold the reservations of the all registrants types, which have no single holder """
+        return None if pr_type >= PR_TYPE_WRITE_EXCLUSIVE_ALL_REGISTRANTS else initiator
+
+    def _persistent_reserve_out(self, cdb, data_out, initiator):
+        service_action, pr_type = cdb[1] & 0x1f, cdb[2] & 0x0f
+        if len(data_out) < 24:
+            raise _illegal_request(PARAMETER_LIST_LENGTH_ERROR)
+        key, service_action_key = _PR_PARAMETERS.unpack_from(data_out)
+        registrations = self.registrations
+
+        if service_action in (0x00, 0x06):      # REGISTER, REGISTER AND IGNORE EXISTING KEY
+            if service_action == 0x00 and registrations.get(initiator, 0) != key:
+                raise _CommandError(STATUS_RESERVATION_CONFLICT)
+            if service_action_key != 0:
+                registrations[initiator] = service_action_key
+            elif initiator in registrations:
+                if self._is_reservation_holder(initiator) and \
+                        (self.reservation[0] == initiator or len(registrations) == 1):
+                    self.reservation = None     # the holder, or the last of all registrants, is gone
+                del registrations[initiator]
+            self.pr_generation += 1
+            return b""
+
+        if initiator not in registrations or registrations[initiator] != key:
+            raise _CommandError(STATUS_RESERVATION_CONFLICT)
+        if service_action == 0x01:              # RESERVE
+            if pr_type not in PR_TYPES:
+                raise _illegal_request(INVALID_FIELD_IN_CDB)
+            if self.reservation is not None:
+                if not self._is_reservation_holder(initiator) or self.reservation[1] != pr_type:
+                    raise _CommandError(STATUS_RESERVATION_CONFLICT)
+                return b""
+            self.reservation = (self._holder(initiator, pr_type), pr_type)
+        elif service_action == 0x02:            # RELEASE
+            if self._is_reservation_holder(initiator):
+                if self.reservation[1] != pr_type:
+                    raise _illegal_request(INVALID_RELEASE_OF_PERSISTENT_RESERVATION)
+                self.reservation = None
+        elif service_action == 0x03:            # CLEAR
+            registrations.clear()
+            self.reservation = None
+            self.pr_generation += 1
+        elif service_action in (0x04, 0x05):    # PREEMPT, PREEMPT AND ABORT
+            preempted = [registrant for registrant, registrant_key in registrations.items()
+                         if registrant_key == service_action_key and registrant != initiator]
+            if not preempted:
+                raise _CommandError(STATUS_RESERVATION_CONFLICT)
+            if self.reservation is not None and self.reservation[0] in preempted:
+                self.reservation = (self._holder(initiator, pr_type), pr_type)
+            for registrant in preempted:
+                del registrations[registrant]
+            self.pr_generation += 1
+        else:                                   # REGISTER AND MOVE and REPLACE LOST RESERVATION are not emulated
+            raise _illegal_request(INVALID_FIELD_IN_CDB)
+        return b""
+
+    _HANDLERS = dict.fromkeys(READ_OPCODES, _read)
+    _HANDLERS.update(dict.fromkeys(WRITE_OPCODES, _write))
+    _HANDLERS.update({0x00: _test_unit_ready, 0x12: _inquiry, 0x25: _read_capacity_10, 0x41: _write_same,
+                      0x42: _unmap, 0x5e: _persistent_reserve_in, 0x5f: _persistent_reserve_out,
+                      0x89: _compare_and_write, 0x93: _write_same, 0x9e: _service_action_in_16, 0xa0: _report_luns})
+
+    _VPD_PAGES = {0x00: _supported_vpd_pages, 0x80: _unit_serial_number_page, 0x83: _device_identification_page,
+                  0x89: _ata_information_page, 0xb0: _block_limits_page, 0xb2: _logical_block_provisioning_page,
+                  0xc0: _veritas_page}
+
+
+class LatencyModel(object):
+    """ A synthetic service time for emulated commands: base seconds per command, plus per_byte seconds per byte
+    transferred, scaled by a random factor in [1 - jitter, 1 + jitter] """
+    def __init__(self, base=0.0, per_byte=0.0, jitter=0.0, seed=None):
+        super(LatencyModel, self).__init__()
+        self.base = base
+        self.per_byte = per_byte
+        self.jitter = jitter
+        self.random = random.Random(seed)
+
+    def __call__(self, opcode, transferred):
+        latency = self.base + self.per_byte * transferred
+        if self.jitter:
+            latency *= self.random.uniform(1 - self.jitter, 1 + self.jitter)
+        return latency
+
+
+class EmulatedCommandExecuter(CommandExecuterBase):
+    """ Executes commands on a VirtualLun (by default, a new one) as initiator (a transport ID; by default, a new
+    Fibre Channel one). A command is executed when it is sent and completes latency(opcode, bytes transferred)
+    seconds later, so the commands in flight are serviced in parallel and their responses are received in
+    completion order. Without a latency model, commands complete immediately and only the CPU cost of the
+    executer, the CDBs and the emulation is measured. """
+    def __init__(self, lun=None, max_queue_size=DEFAULT_MAX_QUEUE_SIZE, latency=None, initiator=None,
+                 retry_policy=None, timer=timer, sleep=time.sleep):
+        super(EmulatedCommandExecuter, self).__init__(max_queue_size, retry_policy)
+        self.lun = lun if lun is not None else VirtualLun()
+        self.latency = latency
+        self.initiator = initiator if initiator is not None else create_fc_transport_id()
+        self.timer = timer
+        self.sleep = sleep
+        self._completions = []      # a heap of (completion time, sequence number, packet index, result)
+        self._sequence = itertools.count()
+
+    def _os_prepare_to_send(self, command, packet_index):
+        return (packet_index, command)
+
+    def _os_send_sync(self, os_data):
+        packet_index, command = os_data
+        now = self.timer()
+        if self.lun.is_task_set_full(now):
+            heapq.heappush(self._completions, (now, next(self._sequence), packet_index, AsiTaskSetFullError()))
+            return
+        result, transferred = self._execute(command)
+        completion_time = now
+        if self.latency is not None:
+            completion_time += self.latency(bytearray(command.command[:1])[0], transferred)
+        self.lun.add_task(completion_time)
+        heapq.heappush(self._completions, (completion_time, next(self._sequence), packet_index, result))
+
+    def _os_send(self, os_data):
+        yield self._os_send_sync(os_data)
+
+    def _os_receive_sync(self):
+        completion_time, sequence, packet_index, result = heapq.heappop(self._completions)
+        delay = completion_time - self.timer()
+        if delay > 0:
+            self.sleep(delay)
+        return (result, packet_index)
+
+    def _os_receive(self):
+        yield self._os_receive_sync()
+
+    def _execute(self, command):
+        """ Executes a command on the LUN. Returns (its result, the number of data bytes transferred) """
+        data_out = buffer_bytes(command.data) if isinstance(command, SCSIWriteCommand) else b""
+        allocation_length = command.max_response_length if isinstance(command, SCSIReadCommand) else 0
+        status, data = self.lun.execute(buffer_bytes(command.command), data_out, allocation_length, self.initiator)
+        if status == STATUS_GOOD:
+            return self._response(command, data), len(data_out) + len(data)
+        if status == STATUS_CHECK_CONDITION:
+            return self._check_condition(data), 0
+        if status == STATUS_RESERVATION_CONFLICT:
+            return AsiReservationConflictError(), 0
+        if status == STATUS_BUSY:
+            return AsiBusyError(), 0
+        return AsiSCSIError("SCSI response status is not zero: 0x{:02x}".format(status)), 0
+
+    def _response(self, command, data):
+        if not isinstance(command, SCSIReadCommand) or command.max_response_length == 0:
+            return None
+        # like the Linux executer, the response spans the allocation length
+        command.transferred_length = len(data)
+        length = command.max_response_length
+        if command.buffer is None:
+            return data + b"\x00" * (length - len(data))
+        if is_buffer_sequence(command.buffer):
+            views = read_result_view(command.buffer, length)
+            read_result_view(command.buffer, len(data), source=data)
+            return views
+        view = read_result_view(command.buffer, length)
+        view[:len(data)] = data
+        return view
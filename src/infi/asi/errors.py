@@ -27,5 +27,13 @@ class AsiReservationConflictError(AsiSCSIError):
     def __init__(self):
         super(AsiReservationConflictError, self).__init__("SCSI reservation conflict")
 
+class AsiBusyError(AsiSCSIError):
+    def __init__(self):
+        super(AsiBusyError, self).__init__("SCSI target is busy")
+
+class AsiTaskSetFullError(AsiSCSIError):
+    def __init__(self):
+        super(AsiTaskSetFullError, self).__init__("SCSI task set full")
+
 class AsiInternalError(AsiException):
     pass
@@ -39,6 +39,18 @@ def linux_sg(device):
         handle.close()
 
 
+@contextmanager
+def linux_sg_gevent(device):
+    from infi.asi.linux_gevent import GeventLinuxCommandExecuter
+
+    handle = create_os_file(device)
+    executer = GeventLinuxCommandExecuter(handle, timeout=SG_TIMEOUT_IN_MS)
+    try:
+        yield executer
+    finally:
+        handle.close()
+
+
 @contextmanager
 def solaris(device):
     handle = create_os_file(device)
@@ -0,0 +1,124 @@
+""" A user-space stand-in for a Linux sg character device, for exercising LinuxCommandExecuter (and UnixFile) end to
+end without the sg driver or a device:
+
+    with FakeSgDevice(VirtualLun(), latency=LatencyModel(base=0.0001)) as device:
+        io = device.open()
+        executer = LinuxCommandExecuter(io, max_queue_size=32)
+        ...
+        io.close()
+
+The device is one end of a SOCK_SEQPACKET socket pair, so every write of an sg_io_hdr to the other end is read as
+one header. A service thread executes the commands of the headers on an emulator.VirtualLun, transferring their data
+to and from the memory the headers point at (the thread runs in the process that wrote them), fills in the status,
+sense, resid and duration, and writes the headers back when their latency passed - in completion order, like sg.
+"""
+import heapq
+import itertools
+import os
+import select
+import socket
+import threading
+from ctypes import memmove, string_at
+
+from .emulator import VirtualLun, create_fc_transport_id, STATUS_GOOD, STATUS_CHECK_CONDITION, STATUS_TASK_SET_FULL
+from .linux import SGIO, SGIOVec, SG_DXFER_TO_DEV, SG_DXFER_FROM_DEV, DRIVER_STATUS_CODES
+from .metrics import timer
+from .unix import UnixFile
+
+SG_INFO_CHECK = 0x1
+
+
+def _segments(sgio):
+    """ Returns (address, length) of the memory segments of an SGIO's data transfer """
+    if sgio.iovec_count == 0:
+        return [(sgio.dxferp, sgio.dxfer_len)]
+    iovec = (SGIOVec * sgio.iovec_count).from_address(sgio.dxferp)
+    return [(item.iov_base, item.iov_len) for item in iovec]
+
+
+class FakeSgDevice(object):
+    """ Serves the sg_io_hdr protocol on fd for a VirtualLun (by default, a new one) as initiator (by default, a new
+    Fibre Channel transport ID). latency is an emulator.LatencyModel (or any callable of the opcode and the bytes
+    transferred) giving the time each command takes; without one, commands complete as soon as they are read """
+    def __init__(self, lun=None, latency=None, initiator=None):
+        super(FakeSgDevice, self).__init__()
+        self.lun = lun if lun is not None else VirtualLun()
+        self.latency = latency
+        self.initiator = initiator if initiator is not None else create_fc_transport_id()
+        self.timer = timer
+        self._device_socket, self._client_socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.fd = self._client_socket.fileno()
+        self._thread = threading.Thread(target=self._serve, name="FakeSgDevice")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def open(self):
+        """ Returns a UnixFile of a new file descriptor of the device, to be closed by the caller """
+        return UnixFile(os.dup(self.fd))
+
+    def close(self):
+        self._device_socket.shutdown(socket.SHUT_RDWR)
+        self._thread.join()
+        self._device_socket.close()
+        self._client_socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _serve(self):
+        completions = []    # a heap of (completion time, sequence number, response header)
+        sequence = itertools.count()
+        device_socket, header_size = self._device_socket, SGIO.sizeof()
+        while True:
+            timeout = max(0, completions[0][0] - self.timer()) if completions else None
+            if select.select([device_socket], [], [], timeout)[0]:
+                raw = device_socket.recv(header_size)
+                if not raw:
+                    break       # closed
+                completion_time, response = self._execute(raw)
+                heapq.heappush(completions, (completion_time, next(sequence), response))
+            now = self.timer()
+            while completions and completions[0][0] <= now:
+                device_socket.send(heapq.heappop(completions)[2])
+
+    def _execute(self, raw):
+        """ Executes the command of a request header. Returns (its completion time, the response header) """
+        sgio = SGIO.from_string(raw)
+        cdb = string_at(sgio.cmdp, sgio.cmd_len)
+        data_out, allocation_length = b"", 0
+        if sgio.dxfer_direction == SG_DXFER_TO_DEV:
+            data_out = b"".join(string_at(address, length) for address, length in _segments(sgio))
+        elif sgio.dxfer_direction == SG_DXFER_FROM_DEV:
+            allocation_length = sgio.dxfer_len
+
+        now, latency = self.timer(), 0
+        if self.lun.is_task_set_full(now):
+            status, data = STATUS_TASK_SET_FULL, b""
+        else:
+            status, data = self.lun.execute(cdb, data_out, allocation_length, self.initiator)
+            if self.latency is not None:
+                transferred = len(data_out) + (len(data) if status == STATUS_GOOD else 0)
+                latency = self.latency(bytearray(cdb[:1])[0], transferred)
+            self.lun.add_task(now + latency)
+
+        sgio.status = status
+        sgio.masked_status = status >> 1
+        sgio.duration = int(latency * 1000)
+        sgio.resid = sgio.dxfer_len if sgio.dxfer_direction == SG_DXFER_FROM_DEV else 0
+        if status == STATUS_GOOD and allocation_length:
+            sgio.resid -= len(data)
+            offset = 0
+            for address, length in _segments(sgio):
+                chunk = data[offset:offset + length]
+                memmove(address, chunk, len(chunk))
+                offset += len(chunk)
+        elif status == STATUS_CHECK_CONDITION:
+            sense = data[:sgio.mx_sb_len]
+            memmove(sgio.sbp, sense, len(sense))
+            sgio.sb_len_wr = len(sense)
+            sgio.driver_status = DRIVER_STATUS_CODES['SG_ERR_DRIVER_SENSE']
+        sgio.info = 0 if status == STATUS_GOOD else SG_INFO_CHECK
+        return now + latency, sgio.to_raw()
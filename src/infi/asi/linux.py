@@ -1,8 +1,14 @@
 from . import CommandExecuterBase, DEFAULT_MAX_QUEUE_SIZE, DEFAULT_TIMEOUT, SCSIReadCommand, SCSIWriteCommand
 from . import SCSI_STATUS_CODES, gevent_friendly
-from .errors import AsiSCSIError, AsiRequestQueueFullError, AsiReservationConflictError
+from .errors import AsiSCSIError, AsiRequestQueueFullError, AsiReservationConflictError, AsiBusyError
+from .errors import AsiTaskSetFullError
+from .buffers import pin_writable_buffer, read_result_view, is_writable_buffer, create_write_buffer, byte_view
+from .buffers import is_buffer_sequence, pin_scatter_buffers
 from ctypes import *
+from collections import deque
 from logging import getLogger
+from six.moves import queue
+import threading
 
 logger = getLogger(__name__)
 
@@ -108,6 +114,7 @@ HOST_STATUS_CODES = dict(
 )
 
 SENSE_SIZE = 0xFF
+DEFAULT_CDB_BUFFER_SIZE = 16
 
 
 def prettify_status(code, status_dict):
@@ -115,6 +122,14 @@ def prettify_status(code, status_dict):
     return "%s 0x%02x" % (code_string[0], code)
 
 
+class SGIOVec(Structure):
+    """ typedef struct sg_iovec { void * iov_base; size_t iov_len; } sg_iovec_t; """
+    _fields_ = [
+        ("iov_base", c_void_p),
+        ("iov_len", c_size_t)
+        ]
+
+
 class SGIO(Structure):
     _fields_ = [
         ("interface_id", c_int),
@@ -141,6 +156,13 @@ class SGIO(Structure):
         ("info", c_uint)
         ]
 
+    # caller-supplied read buffer (see SCSIReadCommand) and the ctypes array pinning a caller's read/write buffer
+    # (or, for scatter-gather transfers, the pinned arrays and the sg_iovec array pointing at them)
+    user_buffer = None
+    pinned_buffer = None
+    # the SCSIReadCommand being executed, whose transferred_length is set when it completes
+    read_command = None
+
     def __init__(self, *args, **kwargs):
         super(SGIO, self).__init__(*args, **kwargs)
         self.source_buffer = None
@@ -167,6 +189,14 @@ class SGIO(Structure):
     def to_raw(self):
         return self.source_buffer.raw
 
+    def release(self):
+        """ Drops the references to the caller's buffers, unpinning them so they can be resized or closed again """
+        self.user_buffer = self.pinned_buffer = self.read_command = None
+
+    def transferred_length(self):
+        """ Returns the number of data bytes actually transferred (dxfer_len - resid) """
+        return max(0, min(self.dxfer_len, self.dxfer_len - self.resid))
+
     def __repr__(self):
         return ("SGIO(interface_id={self.interface_id}, dxfer_direction={self.dxfer_direction}, " +
                 "cmd_len={self.cmd_len}, mx_sb_len={self.mx_sb_len}, iovec_count={self.iovec_count}, " +
@@ -197,11 +227,92 @@ class SGIO(Structure):
                 sgio.set_data_buffer(None)
         else:
             sgio.dxfer_direction = SG_DXFER_TO_DEV
-            sgio.set_data_buffer(create_string_buffer(command.data, len(command.data)))
+            sgio.set_data_buffer(create_write_buffer(command.data))
 
         sgio.flags = SG_FLAG_DIRECT_IO
         return sgio
 
+    @classmethod
+    def allocate(cls, pack_id):
+        """ Creates an SGIO that owns its header, sense, command and data buffers and can be refilled with fill() """
+        buf = create_string_buffer(sizeof(SGIO))
+        sgio = SGIO.from_buffer(buf)
+        sgio.source_buffer = buf
+        sgio.interface_id = ord('S')
+        sgio.pack_id = pack_id
+        sgio.init_sense_buffer()
+        sgio.command_buffer = create_string_buffer(DEFAULT_CDB_BUFFER_SIZE)
+        sgio.cmdp = addressof(sgio.command_buffer)
+        sgio.data_buffer = None
+        return sgio
+
+    def _reserve_command_buffer(self, length):
+        if sizeof(self.command_buffer) < length:
+            self.command_buffer = create_string_buffer(length)
+            self.cmdp = addressof(self.command_buffer)
+        self.cmd_len = length
+
+    def _reserve_data_buffer(self, length):
+        if self.data_buffer is None or sizeof(self.data_buffer) < length:
+            self.data_buffer = create_string_buffer(length)
+        self.dxferp = addressof(self.data_buffer)
+        self.dxfer_len = length
+
+    def _set_scatter_gather(self, arrays):
+        iovec = (SGIOVec * len(arrays))(*[SGIOVec(addressof(array), sizeof(array)) for array in arrays])
+        self.pinned_buffer = (arrays, iovec)
+        self.iovec_count = len(arrays)
+        self.dxferp = addressof(iovec) if arrays else 0
+        self.dxfer_len = sum(sizeof(array) for array in arrays)
+        self.flags = 0    # the sg driver doesn't do direct IO for scatter-gather transfers
+
+    def fill(self, command, timeout=0):
+        """ Refills an SGIO created by allocate() for a new command, reusing (and growing if needed) its buffers """
+        cdb = command.command
+        self._reserve_command_buffer(len(cdb))
+        memmove(self.command_buffer, cdb, len(cdb))
+        self.timeout = timeout
+        self.flags = SG_FLAG_DIRECT_IO
+        self.iovec_count = 0
+        self.status = self.masked_status = self.msg_status = self.sb_len_wr = 0
+        self.host_status = self.driver_status = 0
+        self.resid = self.duration = self.info = 0
+        self.user_buffer = self.pinned_buffer = self.read_command = None
+
+        if isinstance(command, SCSIReadCommand):
+            self.read_command = command
+            if command.max_response_length > 0 and is_buffer_sequence(command.buffer):
+                self.dxfer_direction = SG_DXFER_FROM_DEV
+                self.user_buffer = command.buffer
+                self._set_scatter_gather(pin_scatter_buffers(command.buffer, command.max_response_length))
+            elif command.max_response_length > 0 and command.buffer is not None:
+                self.dxfer_direction = SG_DXFER_FROM_DEV
+                self.user_buffer = command.buffer
+                self.pinned_buffer = pin_writable_buffer(command.buffer, command.max_response_length)
+                self.dxferp = addressof(self.pinned_buffer)
+                self.dxfer_len = command.max_response_length
+            elif command.max_response_length > 0:
+                self.dxfer_direction = SG_DXFER_FROM_DEV
+                self._reserve_data_buffer(command.max_response_length)
+            else:
+                self.dxfer_direction = SG_DXFER_NONE
+                self.dxferp = 0
+                self.dxfer_len = 0
+        elif is_buffer_sequence(command.data):
+            self.dxfer_direction = SG_DXFER_TO_DEV
+            self._set_scatter_gather([create_write_buffer(item) for item in command.data if len(byte_view(item))])
+        elif is_writable_buffer(command.data):
+            self.dxfer_direction = SG_DXFER_TO_DEV
+            self.pinned_buffer = create_write_buffer(command.data)
+            self.dxferp = addressof(self.pinned_buffer)
+            self.dxfer_len = sizeof(self.pinned_buffer)
+        else:
+            data = command.data if isinstance(command.data, bytes) else byte_view(command.data).tobytes()
+            self.dxfer_direction = SG_DXFER_TO_DEV
+            self._reserve_data_buffer(len(data))
+            memmove(self.data_buffer, data, len(data))
+        return self
+
     @classmethod
     def from_string(cls, string):
         buf = create_string_buffer(string, len(string))
@@ -218,29 +329,63 @@ class LinuxCommandExecuter(CommandExecuterBase):
         super(LinuxCommandExecuter, self).__init__(max_queue_size)
         self.io = io
         self.timeout = timeout
+        self.sgio_slots = [None] * max_queue_size
 
     def _os_prepare_to_send(self, command, packet_index):
-        return SGIO.create(packet_index, command, self.timeout)
+        # every packet index owns a preallocated SGIO, so submitting a command doesn't allocate new buffers
+        sgio = self.sgio_slots[packet_index]
+        if sgio is None:
+            sgio = self.sgio_slots[packet_index] = SGIO.allocate(packet_index)
+        return sgio.fill(command, self.timeout)
 
     def _os_send(self, os_data):
-        yield gevent_friendly(self.io.write)(os_data.to_raw())
+        yield self._os_send_sync(os_data)
+
+    def _os_send_sync(self, os_data):
+        return gevent_friendly(self.io.write)(os_data.source_buffer)
 
     def _handle_raw_response(self, raw):
         response_sgio = SGIO.from_string(raw)
-
+        if self.metrics is None:
+            return self._handle_response(response_sgio)
+
+        start_time = self.metrics.timer()
+        result, packet_id = self._handle_response(response_sgio)
+        sample = self._metrics_samples.get(packet_id)
+        if sample is not None:
+            sample.os_parse_time = self.metrics.timer() - start_time
+            sample.kernel_duration = response_sgio.duration / 1000.0    # reported in milliseconds
+            sample.transferred = response_sgio.transferred_length()
+        return result, packet_id
+
+    def _handle_response(self, response_sgio):
+        request_sgio = self._get_os_data(response_sgio.pack_id)
+        try:
+            return self._parse_response(response_sgio, request_sgio)
+        finally:
+            # unpin the caller's buffer whether the command succeeded or not
+            if request_sgio is not None:
+                request_sgio.release()
+
+    def _parse_response(self, response_sgio, request_sgio):
         packet_id = response_sgio.pack_id
-        request_sgio = self._get_os_data(packet_id)
-
         if (response_sgio.status & SCSI_STATUS_CODES['SCSI_STATUS_CHECK_CONDITION']) != 0 or \
                 (response_sgio.driver_status & DRIVER_STATUS_CODES['SG_ERR_DRIVER_SENSE'] != 0):
             logger.debug("response_sgio.status = 0x{:x}".format(response_sgio.status))
             logger.debug("response_sgio.driver_status = 0x{:x}".format(response_sgio.driver_status))
-            return (self._check_condition(string_at(response_sgio.sbp, SENSE_SIZE)), packet_id)
+            # sb_len_wr is the number of sense bytes actually written by the device
+            sense_length = response_sgio.sb_len_wr or SENSE_SIZE
+            return (self._check_condition(string_at(response_sgio.sbp, sense_length)), packet_id)
 
         if response_sgio.status != 0:
+            if response_sgio.status == SCSI_STATUS_CODES['SCSI_STATUS_TASK_SET_FULL']:
+                return (AsiTaskSetFullError(), packet_id)
+            if response_sgio.status == SCSI_STATUS_CODES['SCSI_STATUS_BUSY']:
+                return (AsiBusyError(), packet_id)
             if response_sgio.host_status == 0x07:
                 return (AsiRequestQueueFullError(), packet_id)
-            if response_sgio.host_status == SCSI_STATUS_CODES['SCSI_STATUS_RESERVATION_CONFLICT']:
+            if response_sgio.status == SCSI_STATUS_CODES['SCSI_STATUS_RESERVATION_CONFLICT'] or \
+                    response_sgio.host_status == SCSI_STATUS_CODES['SCSI_STATUS_RESERVATION_CONFLICT']:
                 return (AsiReservationConflictError(), packet_id)
             error = AsiSCSIError(("SCSI response status is not zero: %s" +
                                   "(driver status: %s, host status: %s)") %
@@ -265,14 +410,31 @@ class LinuxCommandExecuter(CommandExecuterBase):
 
         data = None
         if request_sgio.dxfer_direction == SG_DXFER_FROM_DEV and request_sgio.dxfer_len != 0:
-            data = request_sgio.data_buffer.raw
-
+            # the data spans the whole allocation length, as the response parsers expect; the number of bytes the
+            # device actually transferred (dxfer_len - resid) is reported in the command's transferred_length
+            length = response_sgio.transferred_length()
+            if request_sgio.read_command is not None:
+                request_sgio.read_command.transferred_length = length
+            if request_sgio.user_buffer is not None:
+                data = read_result_view(request_sgio.user_buffer, request_sgio.dxfer_len)
+            else:
+                if length < request_sgio.dxfer_len:
+                    # the slot's buffer is reused, so the part the device didn't transfer is zeroed like a new one
+                    memset(request_sgio.dxferp + length, 0, request_sgio.dxfer_len - length)
+                data = string_at(request_sgio.dxferp, request_sgio.dxfer_len)
         return (data, packet_id)
 
     def _os_receive(self):
         raw = yield gevent_friendly(self.io.read)(SGIO.sizeof())
         yield self._handle_raw_response(raw)
 
+    def _os_release(self, os_data):
+        # the SGIO of a packet index is reused, so it would keep the caller's buffers pinned until the next command
+        os_data.release()
+
+    def _os_receive_sync(self):
+        return self._handle_raw_response(gevent_friendly(self.io.read)(SGIO.sizeof()))
+
 SG_IO = 0x2285
 
 
@@ -283,11 +445,119 @@ class LinuxIoctlCommandExecuter(LinuxCommandExecuter):
         self.timeout = timeout
 
     def _os_send(self, os_data):
+        yield self._os_send_sync(os_data)
+
+    def _os_send_sync(self, os_data):
         from fcntl import ioctl
+        # the SGIO buffer is mutable, so the ioctl fills in the response status fields in place
+        gevent_friendly(ioctl)(self.io.fd, SG_IO, os_data.source_buffer)
         self.buffer = os_data.to_raw()
-        gevent_friendly(ioctl)(self.io.fd, SG_IO, self.buffer)
-        yield len(self.buffer)
+        return len(self.buffer)
 
     def _os_receive(self):
         raw = yield self.buffer
         yield self._handle_raw_response(raw)
+
+    def _os_receive_sync(self):
+        return self._handle_raw_response(self.buffer)
+
+
+class IoctlThreadPool(object):
+    """ Worker threads issuing blocking SG_IO ioctls (which release the GIL) on behalf of any number of
+    ThreadPoolIoctlCommandExecuters. Each device has its own queue of requests, and the workers serve the devices
+    that have requests round robin, so a device with a deep queue can't starve the others. """
+    def __init__(self, workers=4):
+        super(IoctlThreadPool, self).__init__()
+        self._condition = threading.Condition()
+        self._requests = dict()        # executer -> deque of SGIOs
+        self._ready = deque()          # executers with requests, in the order they are served
+        self._closed = False
+        self._threads = [threading.Thread(target=self._worker, name="IoctlThreadPool-{}".format(i))
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, executer, sgio):
+        with self._condition:
+            if executer not in self._requests:
+                self._requests[executer] = deque()
+                self._ready.append(executer)
+            self._requests[executer].append(sgio)
+            self._condition.notify()
+
+    def _next_request(self):
+        with self._condition:
+            while not self._ready and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                return None, None
+            executer = self._ready.popleft()
+            requests = self._requests[executer]
+            sgio = requests.popleft()
+            if requests:
+                self._ready.append(executer)
+            else:
+                del self._requests[executer]
+            return executer, sgio
+
+    def _worker(self):
+        while True:
+            executer, sgio = self._next_request()
+            if executer is None:
+                return
+            executer._execute(sgio)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+
+class ThreadPoolIoctlCommandExecuter(LinuxIoctlCommandExecuter):
+    """ Keeps up to max_queue_size SG_IO ioctls in flight on one device by issuing them from an IoctlThreadPool.
+    Pass the same pool to the executers of several devices to share its workers between them; otherwise the
+    executer creates (and closes) a pool of its own with the given number of workers. Finished ioctls are put on
+    completions, a queue.Queue by default; a pool that completes them elsewhere (e.g. in the gevent hub) needs a
+    queue of its own kind. """
+    def __init__(self, io, max_queue_size=DEFAULT_MAX_QUEUE_SIZE, timeout=DEFAULT_TIMEOUT, workers=None, pool=None,
+                 completions=None):
+        super(ThreadPoolIoctlCommandExecuter, self).__init__(io, max_queue_size, timeout)
+        self._owns_pool = pool is None
+        self.pool = IoctlThreadPool(workers or max_queue_size) if pool is None else pool
+        self._completions = queue.Queue() if completions is None else completions
+
+    def _ioctl(self, sgio):
+        from fcntl import ioctl
+        ioctl(self.io.fd, SG_IO, sgio.source_buffer)
+
+    def _execute(self, sgio):
+        """ Called from the pool's worker threads """
+        try:
+            self._ioctl(sgio)
+            self._completions.put((sgio, None))
+        except Exception as error:
+            self._completions.put((sgio, error))
+
+    def _os_send(self, os_data):
+        yield self._os_send_sync(os_data)
+
+    def _os_send_sync(self, os_data):
+        self.pool.submit(self, os_data)
+        return os_data.dxfer_len
+
+    def _os_receive(self):
+        yield self._os_receive_sync()
+
+    def _os_receive_sync(self):
+        sgio, error = self._completions.get()
+        if error is not None:
+            sgio.release()
+            return (error, sgio.pack_id)
+        return self._handle_raw_response(sgio.to_raw())
+
+    def close(self):
+        if self._owns_pool:
+            self.pool.close()
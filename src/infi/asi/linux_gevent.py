@@ -0,0 +1,123 @@
+""" Command executers for gevent applications. Unlike gevent_friendly(), which yields to the hub only after a blocking
+call returned, these executers never block the hub: responses are awaited with hub I/O watchers and SG_IO ioctls run
+in the hub's threadpool. Any number of greenlets can share an executer and keep up to max_queue_size commands in
+flight on its device:
+
+    executer = GeventLinuxCommandExecuter(create_os_file("/dev/sg1"))
+    greenlets = [gevent.spawn(sync_execute, Read16Command(lba, 8), executer) for lba in range(0, 1024, 8)]
+    gevent.joinall(greenlets)
+
+Commands can be run with sync_wait(cdb.execute(executer)) or sync_execute(cdb, executer), which suspend only the
+calling greenlet.
+"""
+from collections import Counter
+
+import gevent
+from gevent.event import AsyncResult, Event
+from gevent.queue import Queue
+from gevent.socket import wait_read
+
+from .linux import LinuxCommandExecuter, ThreadPoolIoctlCommandExecuter, SGIO
+from .unix import UnixFile
+from . import DEFAULT_MAX_QUEUE_SIZE, DEFAULT_TIMEOUT
+
+
+class GeventCommandExecuterMixin(object):
+    """ Lets many greenlets call() the same executer: the responses are read by a single reader greenlet, spawned
+    while commands are in flight, that completes the AsyncResult of each call """
+    def _init_gevent(self):
+        self._reader = None
+        self._slot_freed = Event()
+
+    def call(self, command):
+        yield self.call_sync(command)
+
+    def call_sync(self, command):
+        retries = Counter()
+        while True:
+            while self.is_queue_full():
+                self._slot_freed.clear()
+                self._slot_freed.wait()
+            result = AsyncResult()
+            self._submit_sync(command, self._completion_callback(result))
+            if self._reader is None:
+                self._reader = gevent.spawn(self._read_responses)
+            try:
+                return result.get()
+            except Exception as exception:
+                delay = self._get_retry_delay(exception, retries)
+                if delay is None:
+                    raise
+            if delay > 0:
+                gevent.sleep(delay)     # and not the retry policy's sleep(), which may block the hub
+
+    def _completion_callback(self, result):
+        def callback(data, exception):
+            if exception is not None:
+                result.set_exception(exception)
+            else:
+                result.set(data)
+        return callback
+
+    def _read_responses(self):
+        try:
+            while not self.is_queue_empty():
+                self._process_pending_response_sync()
+                self._slot_freed.set()
+        except Exception as error:
+            self._fail_pending_commands(error)
+        finally:
+            self._reader = None
+
+    def _fail_pending_commands(self, error):
+        """ Completes the commands in flight with error, e.g. when the device stopped responding """
+        for packet_index, (os_data, callback) in list(self.pending_packets.items()):
+            self._unregister_packet(packet_index)
+            callback(None, error)
+        while self._queued_commands:
+            command, callback, attempts = self._queued_commands.popleft()
+            callback(None, error)
+        self._slot_freed.set()
+
+
+class GeventLinuxCommandExecuter(GeventCommandExecuterMixin, LinuxCommandExecuter):
+    """ Sends commands by writing to an sg device and waits for their responses with a hub I/O watcher """
+    def __init__(self, io, max_queue_size=DEFAULT_MAX_QUEUE_SIZE, timeout=DEFAULT_TIMEOUT):
+        super(GeventLinuxCommandExecuter, self).__init__(io, max_queue_size, timeout)
+        self._init_gevent()
+
+    def _os_receive(self):
+        yield self._os_receive_sync()
+
+    def _os_receive_sync(self):
+        read_timeout = getattr(self.io, "_read_timeout", UnixFile.READ_TIMEOUT)
+        wait_read(self.io.fd, read_timeout, IOError("Timeout while waiting for file descriptor to become readable"))
+        return self._handle_raw_response(self.io.read(SGIO.sizeof()))
+
+
+class GeventIoctlThreadPool(object):
+    """ Issues the SG_IO ioctls of GeventIoctlCommandExecuters from a gevent.threadpool.ThreadPool, in place of an
+    IoctlThreadPool. Their completions are put on the executer's queue from the hub, as gevent queues aren't
+    thread-safe. """
+    def __init__(self, threadpool):
+        super(GeventIoctlThreadPool, self).__init__()
+        self.threadpool = threadpool
+
+    def submit(self, executer, sgio):
+        def on_complete(result):
+            # called in the hub; the queue is unbounded, so put() doesn't block
+            executer._completions.put((sgio, result.exception))
+        self.threadpool.spawn(executer._ioctl, sgio).rawlink(on_complete)
+
+    def close(self):
+        pass
+
+
+class GeventIoctlCommandExecuter(GeventCommandExecuterMixin, ThreadPoolIoctlCommandExecuter):
+    """ Issues SG_IO ioctls (e.g. for device-mapper devices) from the threadpool of the gevent hub, or from the given
+    gevent.threadpool.ThreadPool """
+    def __init__(self, io, max_queue_size=DEFAULT_MAX_QUEUE_SIZE, timeout=DEFAULT_TIMEOUT, threadpool=None):
+        # an idle gevent ThreadPool has a len() of 0, so it's tested against None and not for truth
+        pool = GeventIoctlThreadPool(gevent.get_hub().threadpool if threadpool is None else threadpool)
+        super(GeventIoctlCommandExecuter, self).__init__(io, max_queue_size, timeout, pool=pool, completions=Queue())
+        self._init_gevent()
@@ -0,0 +1,286 @@
+""" Per-command instrumentation of command executers. Metrics are collected only after they are enabled:
+
+    metrics = executer.enable_metrics(device="/dev/sg1")
+    ...
+    read16 = metrics.get("/dev/sg1", 0x88)
+    print(read16.latency.count, read16.latency.percentile(99), read16.statuses)
+
+Times are recorded in microseconds, into log2 histograms that cost a few integer operations per sample. The same
+MetricsCollector can be passed to the enable_metrics() of several executers to collect the metrics of many devices.
+
+The executer measures the commands themselves. Packing a CDB and parsing its response happen in the CDB's execute()
+coroutine, and are measured by the functions driving it - sync_execute(), executer.map() / as_completed() and
+EpollReactor.submit() - which run it with a TimedCommandExecuter while the executer records metrics.
+"""
+import time
+from collections import Counter
+
+from . import CommandExecuter
+from .errors import AsiCheckConditionError, AsiBusyError, AsiTaskSetFullError, AsiRequestQueueFullError
+from .errors import AsiReservationConflictError
+
+timer = getattr(time, "perf_counter", time.time)
+
+HISTOGRAM_BUCKETS = 64
+
+STATUS_GOOD = "good"
+STATUS_CHECK_CONDITION = "check_condition"
+STATUS_BUSY = "busy"
+STATUS_TASK_SET_FULL = "task_set_full"
+STATUS_QUEUE_FULL = "queue_full"
+STATUS_RESERVATION_CONFLICT = "reservation_conflict"
+STATUS_ERROR = "error"
+
+
+def get_status_class(result):
+    """ Returns the status class of a command's result (its response data or exception) """
+    if not isinstance(result, Exception):
+        return STATUS_GOOD
+    for error_class, status in ((AsiCheckConditionError, STATUS_CHECK_CONDITION), (AsiBusyError, STATUS_BUSY),
+                                (AsiTaskSetFullError, STATUS_TASK_SET_FULL),
+                                (AsiRequestQueueFullError, STATUS_QUEUE_FULL),
+                                (AsiReservationConflictError, STATUS_RESERVATION_CONFLICT)):
+        if isinstance(result, error_class):
+            return status
+    return STATUS_ERROR
+
+
+class Histogram(object):
+    """ A histogram of non-negative integers with power of two buckets: bucket 0 counts zeros and bucket i counts
+    the values in [2 ** (i - 1), 2 ** i). Values too large for the last bucket are counted in it """
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        super(Histogram, self).__init__()
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        value = int(value)
+        self.counts[min(value.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def mean(self):
+        return float(self.total) / self.count if self.count else None
+
+    def percentile(self, percent):
+        """ Returns an upper bound of the given percentile: the upper limit of its bucket, or the maximum value """
+        if not self.count:
+            return None
+        rank = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min((1 << index) - 1, self.max)
+        return self.max
+
+    def buckets(self):
+        """ Returns a list of (low, high, count) of the non-empty buckets, each counting the values in [low, high] """
+        return [(0 if index == 0 else 1 << (index - 1), (1 << index) - 1, count)
+                for index, count in enumerate(self.counts) if count]
+
+    def to_dict(self):
+        return dict(count=self.count, total=self.total, min=self.min, max=self.max, mean=self.mean,
+                    p50=self.percentile(50), p99=self.percentile(99), buckets=self.buckets())
+
+    def __repr__(self):
+        return "<Histogram count={} mean={} max={}>".format(self.count, self.mean, self.max)
+
+
+class CommandMetrics(object):
+    """ The metrics of one opcode on one device:
+
+    latency:          submit-to-complete wall time of the commands, in microseconds
+    kernel_duration:  the duration the OS reported for the commands (where available), in microseconds
+    transferred:      data bytes transferred by the commands
+    os_prepare_time:  time the executer spent preparing the commands for the OS (copying the CDB and data), in
+                      microseconds. Packing the CDBs happens before, and is not included
+    os_parse_time:    time the executer spent parsing the OS responses (status and sense decoding), in
+                      microseconds
+    pack_time:        time the CDBs spent before sending the commands (packing the CDB), in microseconds
+    parse_time:       time the CDBs spent after the responses arrived (parsing them), in microseconds
+    statuses:         a Counter of the status classes (STATUS_GOOD, STATUS_CHECK_CONDITION, ...)
+
+    pack_time and parse_time are recorded only for CDBs run by a TimedCommandExecuter. When a CDB sends several
+    commands, the time between two of them is counted as parsing the response of the first.
+    """
+    HISTOGRAMS = ("latency", "kernel_duration", "transferred", "os_prepare_time", "os_parse_time", "pack_time",
+                  "parse_time")
+    __slots__ = HISTOGRAMS + ("statuses",)
+
+    def __init__(self):
+        super(CommandMetrics, self).__init__()
+        for name in self.HISTOGRAMS:
+            setattr(self, name, Histogram())
+        self.statuses = Counter()
+
+    def merge(self, other):
+        for name in self.HISTOGRAMS:
+            getattr(self, name).merge(getattr(other, name))
+        self.statuses.update(other.statuses)
+
+    def to_dict(self):
+        result = dict((name, getattr(self, name).to_dict()) for name in self.HISTOGRAMS)
+        result["statuses"] = dict(self.statuses)
+        return result
+
+
+class CommandSample(object):
+    """ What is known about a command in flight; the platform fills in the fields it can measure """
+    __slots__ = ("command", "opcode", "submit_time", "os_prepare_time", "kernel_duration", "transferred",
+                 "os_parse_time")
+
+    def __init__(self, command, opcode, submit_time, os_prepare_time):
+        self.command = command
+        self.opcode = opcode
+        self.submit_time = submit_time
+        self.os_prepare_time = os_prepare_time
+        self.kernel_duration = None
+        self.transferred = None
+        self.os_parse_time = None
+
+
+def _get_opcode(command):
+    opcode = bytearray(command.command[:1])
+    return opcode[0] if opcode else None
+
+
+class MetricsCollector(object):
+    def __init__(self):
+        super(MetricsCollector, self).__init__()
+        self.timer = timer
+        self.commands = dict()      # (device, opcode) -> CommandMetrics
+
+    def start_command(self, command, start_time):
+        """ Called after a command is prepared for sending; start_time is when its preparation started """
+        now = self.timer()
+        return CommandSample(command, _get_opcode(command), now, now - start_time)
+
+    def _get_metrics(self, device, opcode):
+        metrics = self.commands.get((device, opcode))
+        if metrics is None:
+            metrics = self.commands[(device, opcode)] = CommandMetrics()
+        return metrics
+
+    def complete_command(self, device, sample, result):
+        """ Records a command whose result (response data or exception) arrived """
+        metrics = self._get_metrics(device, sample.opcode)
+        metrics.latency.record((self.timer() - sample.submit_time) * 1e6)
+        metrics.os_prepare_time.record(sample.os_prepare_time * 1e6)
+        if sample.os_parse_time is not None:
+            metrics.os_parse_time.record(sample.os_parse_time * 1e6)
+        if sample.kernel_duration is not None:
+            metrics.kernel_duration.record(sample.kernel_duration * 1e6)
+        transferred = sample.transferred
+        if transferred is None:
+            # reported by the executer on read commands; the response data spans the whole allocation length
+            transferred = getattr(sample.command, "transferred_length", None)
+        if transferred is None and result is not None and not isinstance(result, Exception):
+            transferred = sum(len(view) for view in result) if isinstance(result, list) else len(result)
+        if transferred is not None:
+            metrics.transferred.record(transferred)
+        metrics.statuses[get_status_class(result)] += 1
+
+    def record_pack_time(self, device, command, seconds):
+        """ Records the time a CDB spent before sending command """
+        self._get_metrics(device, _get_opcode(command)).pack_time.record(seconds * 1e6)
+
+    def record_parse_time(self, device, command, seconds):
+        """ Records the time a CDB spent after the response of command arrived """
+        self._get_metrics(device, _get_opcode(command)).parse_time.record(seconds * 1e6)
+
+    def get(self, device=None, opcode=None):
+        """ Returns the CommandMetrics of an opcode on a device. If device or opcode is None, the metrics of all the
+        devices or opcodes are merged into a new CommandMetrics. Returns None if there are no such metrics """
+        matching = [metrics for (metrics_device, metrics_opcode), metrics in self.commands.items()
+                    if (device is None or device == metrics_device) and (opcode is None or opcode == metrics_opcode)]
+        if device is not None and opcode is not None:
+            return matching[0] if matching else None
+        if not matching:
+            return None
+        merged = CommandMetrics()
+        for metrics in matching:
+            merged.merge(metrics)
+        return merged
+
+    def snapshot(self):
+        """ Returns the metrics as a dict of (device, opcode) -> dict, suitable for serialization """
+        return dict((key, metrics.to_dict()) for key, metrics in self.commands.items())
+
+    def reset(self):
+        self.commands.clear()
+
+
+class TimedCommandExecuter(CommandExecuter):
+    """ Passed to a CDB in place of executer (the executer its driver would pass), to measure the time the CDB's
+    execute() coroutine spends packing its commands and parsing their responses. execute() runs the CDB; the time
+    from its start to the first call() is recorded as the pack time of the call's command, and the time from the
+    return of each call() to the next call() or to the end of the CDB as the parse time of the returned command """
+    def __init__(self, executer, collector, device=None):
+        super(TimedCommandExecuter, self).__init__()
+        self.executer = executer
+        self.collector = collector
+        self.device = device
+        self._mark = None
+        self._last_command = None
+
+    def execute(self, cdb):
+        """ A coroutine generator running cdb.execute(self) """
+        self._mark, self._last_command = self.collector.timer(), None
+        try:
+            result = yield cdb.execute(self)
+        finally:
+            if self._last_command is not None:
+                self.collector.record_parse_time(self.device, self._last_command,
+                                                 self.collector.timer() - self._mark)
+        yield result
+
+    def call(self, command):
+        elapsed = self.collector.timer() - self._mark
+        if self._last_command is None:
+            self.collector.record_pack_time(self.device, command, elapsed)
+        else:
+            self.collector.record_parse_time(self.device, self._last_command, elapsed)
+        try:
+            data = yield self.executer.call(command)
+        finally:
+            self._mark, self._last_command = self.collector.timer(), command
+        yield data
+
+    def send(self, command, callback=None):
+        return self.executer.send(command, callback)
+
+    def is_queue_full(self):
+        return self.executer.is_queue_full()
+
+    def wait(self):
+        return self.executer.wait()
+
+
+def timed_execute(cdb, proxy, executer):
+    """ Returns the coroutine generator running cdb.execute(proxy), with a TimedCommandExecuter in front of proxy if
+    executer records metrics """
+    collector = getattr(executer, "metrics", None)
+    if collector is None:
+        return cdb.execute(proxy)
+    return TimedCommandExecuter(proxy, collector, executer.metrics_device).execute(cdb)
@@ -0,0 +1,126 @@
+from collections import deque, Counter
+
+from . import CommandExecuter, OSAsyncIOToken
+from .retry import RetryDelay
+from .metrics import timed_execute
+from .coroutines.sync_adapter import AsyncCoroutine, sync_wait
+
+
+class CompletionToken(OSAsyncIOToken):
+    """ an IO token that is completed by the callback of a command sent to a CommandExecuterBase """
+    def __init__(self):
+        super(CompletionToken, self).__init__()
+        self.done = False
+        self.data = None
+        self.exception = None
+
+    def complete(self, data, exception):
+        self.data, self.exception, self.done = data, exception, True
+
+    def get_result(self, block=False):
+        return self.exception if self.exception is not None else self.data
+
+
+class PipelineCommandExecuter(CommandExecuter):
+    """ The executer passed to the CDBs run by pipeline_map(). call() sends the command and suspends the CDB's
+    coroutine until its response is processed, so the other CDBs can send theirs in the meantime. It is suspended
+    on a RetryDelay while waiting to send a failed command again. """
+    def __init__(self, executer):
+        super(PipelineCommandExecuter, self).__init__()
+        self.executer = executer
+
+    def call(self, command):
+        retries = Counter()
+        while True:
+            while self.executer.is_queue_full():
+                yield self.executer._process_pending_response()
+            token = CompletionToken()
+            yield self.executer.send(command, callback=token.complete)
+            try:
+                data = yield token
+                break
+            except Exception as error:
+                delay = self.executer._get_retry_delay(error, retries)
+                if delay is None:
+                    raise
+            if delay > 0:
+                yield RetryDelay(delay, self.executer.retry_policy.sleep)
+        yield data
+
+    def send(self, command, callback=None):
+        return self.executer.send(command, callback)
+
+    def is_queue_full(self):
+        return self.executer.is_queue_full()
+
+    def wait(self):
+        return self.executer.wait()
+
+
+def pipeline_map(executer, cdbs, depth=None, ordered=True):
+    """ Runs the CDBs with up to depth of them in flight at once, and yields their results, either in the order
+    of cdbs or in the order they complete. CDBs are pulled from the cdbs iterable lazily, as slots become free.
+    An exception raised by a CDB is raised when its result would have been yielded. """
+    depth = min(depth or executer.max_queue_size, executer.max_queue_size)
+    proxy = PipelineCommandExecuter(executer)
+    cdbs = iter(cdbs)
+    exhausted = False
+    waiting = dict()          # index -> coroutine suspended on a CompletionToken
+    ready = deque()           # (index, coroutine, resumed) to run
+    finished = dict()         # index -> (result, exception)
+    next_index = next_to_yield = 0
+    try:
+        while True:
+            while not exhausted and len(waiting) + len(ready) < depth:
+                try:
+                    cdb = next(cdbs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                ready.append((next_index, AsyncCoroutine(timed_execute(cdb, proxy, executer)), False))
+                next_index += 1
+
+            while ready:
+                index, coroutine, resumed = ready.popleft()
+                if resumed:
+                    coroutine.async_io_complete()
+                try:
+                    result = coroutine.loop()
+                except Exception as error:
+                    finished[index] = (None, error)
+                    continue
+                if coroutine.is_done():
+                    finished[index] = (result, None)
+                else:
+                    waiting[index] = coroutine
+
+            if ordered:
+                while next_to_yield in finished:
+                    result, error = finished.pop(next_to_yield)
+                    next_to_yield += 1
+                    if error is not None:
+                        raise error
+                    yield result
+            else:
+                while finished:
+                    result, error = finished.popitem()[1]
+                    if error is not None:
+                        raise error
+                    yield result
+
+            # a CDB waiting for a free slot may have processed responses of other CDBs
+            for index in [index for index, coroutine in waiting.items() if coroutine.get_result().done]:
+                ready.append((index, waiting.pop(index), True))
+            if ready or (not exhausted and len(waiting) < depth):
+                continue
+            if not waiting:
+                break
+            if executer.is_queue_empty():
+                # the CDBs left are all waiting to send a failed command again
+                min((coroutine.get_result() for coroutine in waiting.values()),
+                    key=lambda delay: delay.deadline).get_result(block=True)
+            else:
+                sync_wait(executer._process_pending_response())
+    finally:
+        # don't leave responses of abandoned CDBs behind for the next user of the executer
+        sync_wait(executer.wait())
@@ -0,0 +1,39 @@
+class AdaptiveQueueDepth(object):
+    """ Additive-increase/multiplicative-decrease control of the number of commands an executer keeps in flight.
+
+    The depth grows by one for every `depth` commands that complete without their latency rising above
+    latency_threshold times the baseline (the lowest latency seen, slowly following the recent latencies), and is
+    multiplied by backoff_factor whenever the target reports congestion (TASK SET FULL, BUSY, or a full queue). """
+    def __init__(self, max_depth, initial_depth=1, min_depth=1, backoff_factor=0.5, latency_threshold=1.5,
+                 baseline_decay=0.01):
+        super(AdaptiveQueueDepth, self).__init__()
+        self.max_depth = max_depth
+        self.min_depth = min_depth
+        self.backoff_factor = backoff_factor
+        self.latency_threshold = latency_threshold
+        self.baseline_decay = baseline_decay
+        self.depth = max(min_depth, min(initial_depth, max_depth))
+        self.baseline_latency = None
+        self.congestion_count = 0
+        self._growth_credit = 0.0
+
+    def on_success(self, latency):
+        if self.baseline_latency is None or latency < self.baseline_latency:
+            self.baseline_latency = latency
+        else:
+            self.baseline_latency += (latency - self.baseline_latency) * self.baseline_decay
+        if latency > self.baseline_latency * self.latency_threshold:
+            return
+        self._growth_credit += 1.0 / self.depth
+        if self._growth_credit >= 1:
+            self._growth_credit = 0.0
+            self.depth = min(self.max_depth, self.depth + 1)
+
+    def on_congestion(self):
+        self.congestion_count += 1
+        self._growth_credit = 0.0
+        self.depth = max(self.min_depth, int(self.depth * self.backoff_factor))
+
+    def __repr__(self):
+        return "<AdaptiveQueueDepth depth={} max_depth={} congestion_count={}>".format(
+            self.depth, self.max_depth, self.congestion_count)
@@ -0,0 +1,202 @@
+import heapq
+import itertools
+import select
+import time
+from collections import deque
+
+from .errors import AsiException
+from .retry import RetryDelay
+from .metrics import timed_execute
+from .coroutines.sync_adapter import AsyncCoroutine, sync_wait
+from .pipeline import PipelineCommandExecuter
+
+
+class ReactorJob(object):
+    """ A CDB submitted to an EpollReactor, running its execute() coroutine against one executer """
+    def __init__(self, executer, cdb):
+        super(ReactorJob, self).__init__()
+        self.executer = executer
+        self.cdb = cdb
+        self.done = False
+        self.result = None
+        self.exception = None
+        self._coroutine = None
+
+    def get_result(self):
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+    def __repr__(self):
+        return "<ReactorJob {!r} done={}>".format(self.cdb, self.done)
+
+
+class _Device(object):
+    def __init__(self, executer, max_in_flight):
+        self.executer = executer
+        self.proxy = PipelineCommandExecuter(executer)
+        self.max_in_flight = min(max_in_flight or executer.max_queue_size, executer.max_queue_size)
+        self.queued_jobs = deque()
+        self.running_jobs = []
+
+
+class EpollReactor(object):
+    """ Drives the responses of many command executers from a single epoll object.
+
+    Executers are registered by the file descriptor of their io object (executer.io.fd). Whenever a descriptor
+    becomes readable, the reactor processes one pending response of that executer, which in turn calls the callback
+    that was passed to send(). No time is spent sleeping or polling descriptors that have nothing to read.
+
+    CDBs can be submitted too, for any number of devices; their execute() coroutines are all driven by the same
+    loop, with at most max_in_flight of them (and so of their commands) running per device:
+
+        jobs = [reactor.submit(executer, StandardInquiryCommand()) for executer in executers]
+        for job in reactor.as_completed():
+            print(job.executer, job.get_result())
+    """
+    def __init__(self):
+        super(EpollReactor, self).__init__()
+        self._epoll = select.epoll()
+        self._executers = dict()
+        self._devices = dict()
+        self._completed_jobs = deque()
+        self._retry_delays = []     # a heap of (deadline, sequence number, device) of jobs waiting to retry a command
+        self._sequence = itertools.count()
+
+    def register(self, executer, max_in_flight=None):
+        """ max_in_flight limits the number of submitted CDBs running on the executer (by default, and at most,
+        its max_queue_size) """
+        fd = executer.io.fd
+        if fd in self._executers:
+            raise AsiException("File descriptor %d is already registered" % fd)
+        self._epoll.register(fd, select.EPOLLIN)
+        self._executers[fd] = executer
+        self._devices[fd] = _Device(executer, max_in_flight)
+
+    def unregister(self, executer):
+        fd = executer.io.fd
+        self._epoll.unregister(fd)
+        del self._executers[fd]
+        del self._devices[fd]
+
+    def get_executers(self):
+        return list(self._executers.values())
+
+    def is_idle(self):
+        return not self.has_pending_jobs() and \
+            all(executer.is_queue_empty() for executer in self._executers.values())
+
+    def has_pending_jobs(self):
+        return any(device.queued_jobs or device.running_jobs for device in self._devices.values())
+
+    def submit(self, executer, cdb):
+        """ Schedules cdb.execute() on executer (registering it if needed) and returns a ReactorJob """
+        fd = executer.io.fd
+        if self._executers.get(fd) is not executer:
+            self.register(executer)
+        device = self._devices[fd]
+        job = ReactorJob(executer, cdb)
+        device.queued_jobs.append(job)
+        self._start_jobs(device)
+        return job
+
+    def as_completed(self, timeout=None):
+        """ Yields submitted jobs as they complete, until no submitted job is left """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            while self._completed_jobs:
+                yield self._completed_jobs.popleft()
+            if not self.has_pending_jobs():
+                return
+            self.poll(self._remaining(deadline))
+
+    def wait_for(self, *jobs, **kwargs):
+        """ Runs the loop until the given jobs complete, and returns their results (raising the first failure) """
+        deadline = None if kwargs.get("timeout") is None else time.time() + kwargs["timeout"]
+        while not all(job.done for job in jobs):
+            self.poll(self._remaining(deadline))
+        for job in jobs:
+            if job in self._completed_jobs:
+                self._completed_jobs.remove(job)
+        return [job.get_result() for job in jobs]
+
+    def _remaining(self, deadline):
+        if deadline is None:
+            return None
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise IOError("Timeout while waiting for pending responses")
+        return remaining
+
+    def _start_jobs(self, device):
+        while device.queued_jobs and len(device.running_jobs) < device.max_in_flight:
+            job = device.queued_jobs.popleft()
+            job._coroutine = AsyncCoroutine(timed_execute(job.cdb, device.proxy, device.executer))
+            self._step_job(device, job)
+
+    def _step_job(self, device, job):
+        try:
+            result = job._coroutine.loop()
+        except Exception as error:
+            self._finish_job(device, job, None, error)
+            return
+        if job._coroutine.is_done():
+            self._finish_job(device, job, result, None)
+            return
+        if job not in device.running_jobs:
+            device.running_jobs.append(job)
+        if isinstance(result, RetryDelay):
+            heapq.heappush(self._retry_delays, (result.deadline, next(self._sequence), device))
+
+    def _finish_job(self, device, job, result, exception):
+        if job in device.running_jobs:
+            device.running_jobs.remove(job)
+        job.result, job.exception, job.done = result, exception, True
+        self._completed_jobs.append(job)
+
+    def _resume_jobs(self, device):
+        # resuming a job may process the responses of other jobs of the device, so repeat until none is ready
+        while True:
+            ready_jobs = [job for job in device.running_jobs if job._coroutine.get_result().done]
+            if not ready_jobs:
+                break
+            for job in ready_jobs:
+                job._coroutine.async_io_complete()
+                self._step_job(device, job)
+        self._start_jobs(device)
+
+    def poll(self, timeout=None):
+        """ Waits up to timeout seconds (forever if None) for responses and dispatches them to their callbacks, and
+        resumes the jobs whose retry delay is over. Returns the number of responses processed. """
+        if self._retry_delays:
+            next_retry = max(0, self._retry_delays[0][0] - time.time())
+            timeout = next_retry if timeout is None else min(timeout, next_retry)
+        events = self._epoll.poll(-1 if timeout is None else timeout)
+        processed = 0
+        for fd, event in events:
+            executer = self._executers.get(fd)
+            if executer is None or executer.is_queue_empty():
+                continue
+            sync_wait(executer._process_pending_response())
+            processed += 1
+            self._resume_jobs(self._devices[fd])
+        now = time.time()
+        while self._retry_delays and self._retry_delays[0][0] <= now:
+            device = heapq.heappop(self._retry_delays)[2]
+            if device in self._devices.values():
+                self._resume_jobs(device)
+        return processed
+
+    def wait(self, timeout=None):
+        """ Dispatches responses until none of the registered executers has pending requests """
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.is_idle():
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                raise IOError("Timeout while waiting for pending responses")
+            self.poll(remaining)
+
+    def close(self):
+        self._epoll.close()
+        self._executers.clear()
+        self._devices.clear()
@@ -0,0 +1,222 @@
+""" Capture and replay of SCSI commands.
+
+RecordingCommandExecuter wraps an executer and appends every command it executes, with its response, to a trace
+file. ReplayCommandExecuter serves the responses from such a trace, so CDBs can be executed (and their parsing
+profiled) at full speed without the device:
+
+    with RecordingCommandExecuter(executer, "array.trace") as recorder:
+        sync_wait(StandardInquiryCommand().execute(recorder))
+
+    replayer = ReplayCommandExecuter("array.trace")
+    sync_execute(StandardInquiryCommand(), replayer)
+
+A trace is the TRACE_MAGIC header followed by records, each a RECORD_HEADER (direction, kind, CDB length, request
+data length, response data length, sense/error length) and the four byte strings. The responses of a CDB are
+replayed in the order they were recorded, starting over after the last one.
+"""
+import importlib
+import mmap
+import struct
+from collections import namedtuple
+
+from . import CommandExecuter, CommandExecuterBase, SCSIReadCommand, SCSIWriteCommand, DEFAULT_MAX_QUEUE_SIZE
+from .errors import AsiException, AsiCheckConditionError
+from .buffers import buffer_bytes, is_buffer_sequence, read_result_view
+
+TRACE_MAGIC = b"ASITRC\x00\x01"
+RECORD_HEADER = struct.Struct("<BBHIII")
+
+DIRECTION_NONE = 0
+DIRECTION_READ = 1
+DIRECTION_WRITE = 2
+
+KIND_DATA = 0
+KIND_CHECK_CONDITION = 1    # the sense buffer is recorded
+KIND_ERROR = 2              # the exception class name and message are recorded, separated by a newline
+
+TraceRecord = namedtuple("TraceRecord", ["direction", "kind", "cdb", "request_data", "response_data", "sense"])
+
+
+class AsiReplayMissError(AsiException):
+    pass
+
+
+class RecordingCommandExecuter(CommandExecuter):
+    """ Executes commands with executer and appends them to the trace file at path (or to an open binary file) """
+    def __init__(self, executer, path_or_file):
+        super(RecordingCommandExecuter, self).__init__()
+        self.executer = executer
+        if hasattr(path_or_file, "write"):
+            self.file, self._owns_file = path_or_file, False
+        else:
+            self.file, self._owns_file = open(path_or_file, "ab"), True
+        self.file.seek(0, 2)
+        if self.file.tell() == 0:
+            self.file.write(TRACE_MAGIC)
+
+    def record(self, command, data, exception):
+        if isinstance(command, SCSIReadCommand):
+            direction, request_data = DIRECTION_READ, b""
+        elif isinstance(command, SCSIWriteCommand):
+            direction, request_data = DIRECTION_WRITE, buffer_bytes(command.data)
+        else:
+            direction, request_data = DIRECTION_NONE, b""
+        if exception is None:
+            kind, response_data, sense = KIND_DATA, buffer_bytes(data), b""
+            if direction == DIRECTION_READ and command.transferred_length is not None:
+                # only the bytes the device transferred; the replayer pads them to the allocation length again
+                response_data = response_data[:command.transferred_length]
+        elif isinstance(exception, AsiCheckConditionError):
+            kind, response_data, sense = KIND_CHECK_CONDITION, b"", buffer_bytes(exception.sense_buffer)
+        else:
+            message = "{}\n{}".format(type(exception).__name__, exception)
+            kind, response_data, sense = KIND_ERROR, b"", message.encode("utf-8")
+        cdb = buffer_bytes(command.command)
+        self.file.write(RECORD_HEADER.pack(direction, kind, len(cdb), len(request_data), len(response_data),
+                                           len(sense)))
+        self.file.write(cdb + request_data + response_data + sense)
+
+    def call(self, command):
+        try:
+            data = yield self.executer.call(command)
+        except Exception as exception:
+            self.record(command, None, exception)
+            raise
+        self.record(command, data, None)
+        yield data
+
+    def call_sync(self, command):
+        try:
+            data = self.executer.call_sync(command)
+        except Exception as exception:
+            self.record(command, None, exception)
+            raise
+        self.record(command, data, None)
+        return data
+
+    def send(self, command, callback=None):
+        def recording_callback(data, exception):
+            self.record(command, data, exception)
+            if callback is not None:
+                callback(data, exception)
+        return self.executer.send(command, recording_callback)
+
+    def is_queue_full(self):
+        return self.executer.is_queue_full()
+
+    def wait(self):
+        return self.executer.wait()
+
+    def close(self):
+        if self._owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _read_records(buffer):
+    """ Yields (offset of the record data, header fields) of the records in a trace buffer """
+    if bytes(buffer[:len(TRACE_MAGIC)]) != TRACE_MAGIC:
+        raise AsiException("Not an infi.asi trace")
+    offset = len(TRACE_MAGIC)
+    while offset < len(buffer):
+        fields = RECORD_HEADER.unpack_from(buffer, offset)
+        offset += RECORD_HEADER.size
+        yield offset, fields
+        offset += sum(fields[2:])
+
+
+def read_trace(path):
+    """ Yields the TraceRecords of a trace file """
+    with open(path, "rb") as trace_file:
+        buffer = trace_file.read()
+    for offset, (direction, kind, cdb_length, request_length, response_length, sense_length) in _read_records(buffer):
+        ends = [offset + cdb_length, offset + cdb_length + request_length,
+                offset + cdb_length + request_length + response_length]
+        yield TraceRecord(direction, kind, buffer[offset:ends[0]], buffer[ends[0]:ends[1]], buffer[ends[1]:ends[2]],
+                          buffer[ends[2]:ends[2] + sense_length])
+
+
+class ReplayCommandExecuter(CommandExecuterBase):
+    """ Serves the responses recorded in a trace file, which is memory-mapped and indexed by CDB. Commands whose
+    CDB is not in the trace fail with AsiReplayMissError """
+    def __init__(self, path, max_queue_size=DEFAULT_MAX_QUEUE_SIZE):
+        super(ReplayCommandExecuter, self).__init__(max_queue_size)
+        with open(path, "rb") as trace_file:
+            self._mmap = mmap.mmap(trace_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._responses = dict()    # CDB -> [list of (kind, response offset, response length, sense length), next]
+        for offset, (direction, kind, cdb_length, request_length, response_length, sense_length) in \
+                _read_records(self._mmap):
+            cdb = self._mmap[offset:offset + cdb_length]
+            entry = self._responses.setdefault(cdb, [[], 0])
+            entry[0].append((kind, offset + cdb_length + request_length, response_length, sense_length))
+        self._in_flight = []
+
+    def _next_response(self, cdb):
+        entry = self._responses.get(cdb)
+        if entry is None:
+            return None
+        responses, index = entry
+        entry[1] = (index + 1) % len(responses)
+        return responses[index]
+
+    def _os_prepare_to_send(self, command, packet_index):
+        return (packet_index, command)
+
+    def _os_send_sync(self, os_data):
+        self._in_flight.append(os_data)
+
+    def _os_send(self, os_data):
+        yield self._os_send_sync(os_data)
+
+    def _os_receive_sync(self):
+        packet_index, command = self._in_flight.pop(0)
+        cdb = buffer_bytes(command.command)
+        response = self._next_response(cdb)
+        if response is None:
+            return (AsiReplayMissError("No recorded response for CDB {!r}".format(cdb)), packet_index)
+        kind, offset, response_length, sense_length = response
+        if kind == KIND_CHECK_CONDITION:
+            return (self._check_condition(self._mmap[offset + response_length:offset + response_length + sense_length]),
+                    packet_index)
+        if kind == KIND_ERROR:
+            return (self._error(self._mmap[offset + response_length:offset + response_length + sense_length]),
+                    packet_index)
+        if not isinstance(command, SCSIReadCommand) or command.max_response_length == 0:
+            return (None, packet_index)
+        # like the executers, the response spans the allocation length
+        length = min(response_length, command.max_response_length)
+        command.transferred_length = length
+        data = self._mmap[offset:offset + length]
+        if command.buffer is None:
+            return (data + b"\x00" * (command.max_response_length - length), packet_index)
+        if is_buffer_sequence(command.buffer):
+            views = read_result_view(command.buffer, command.max_response_length)
+            read_result_view(command.buffer, length, source=data)
+            return (views, packet_index)
+        view = read_result_view(command.buffer, command.max_response_length)
+        view[:length] = data
+        return (view, packet_index)
+
+    def _os_receive(self):
+        yield self._os_receive_sync()
+
+    def _error(self, recorded):
+        name, _, message = recorded.decode("utf-8").partition("\n")
+        # not "from . import errors": the star imports of infi.asi shadow its errors submodule
+        error_class = getattr(importlib.import_module(".errors", __package__), name, None)
+        if isinstance(error_class, type) and issubclass(error_class, AsiException):
+            try:
+                return error_class(message)
+            except TypeError:
+                return error_class()    # errors with a fixed message
+        return AsiException(message)
+
+    def close(self):
+        self._mmap.close()
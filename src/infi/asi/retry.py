@@ -0,0 +1,110 @@
+import time
+from collections import Counter
+
+from . import OSAsyncIOToken
+from .errors import AsiCheckConditionError, AsiBusyError, AsiTaskSetFullError, AsiReservationConflictError
+
+UNIT_ATTENTION = "unit_attention"
+BECOMING_READY = "becoming_ready"
+BUSY = "busy"
+RESERVATION_CONFLICT = "reservation_conflict"
+
+# NOT READY additional sense codes (code, qualifier) of a logical unit that will be ready soon
+BECOMING_READY_CODES = frozenset([
+    (0x04, 0x01),   # LOGICAL UNIT IS IN PROCESS OF BECOMING READY
+    (0x04, 0x0A),   # LOGICAL UNIT NOT ACCESSIBLE, ASYMMETRIC ACCESS STATE TRANSITION
+])
+
+
+class RetryRule(object):
+    """ Retry a class of errors up to max_retries times per command, waiting delay seconds before the first retry
+    and multiplying the delay by backoff (up to max_delay) before each of the next ones """
+    def __init__(self, max_retries, delay=0, backoff=2.0, max_delay=None):
+        super(RetryRule, self).__init__()
+        self.max_retries = max_retries
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+
+    def get_delay(self, retry):
+        delay = self.delay * (self.backoff ** retry)
+        return delay if self.max_delay is None else min(delay, self.max_delay)
+
+    def __repr__(self):
+        return "RetryRule(max_retries={}, delay={}, backoff={}, max_delay={})".format(
+            self.max_retries, self.delay, self.backoff, self.max_delay)
+
+
+class RetryPolicy(object):
+    """ Decides whether a command that failed is sent again by its executer, and after how long.
+
+    Errors are classified by SCSI status and sense key/ASC/ASCQ (see classify()) and each class has its own
+    RetryRule; pass rules to override the defaults, or a None rule to never retry a class. The retries and the
+    exhausted budgets of every class are counted in `retries` and `exhausted` for monitoring. Synchronous callers
+    spend the delays in sleep(), which blocks the calling thread by default; coroutines driven by a reactor or an
+    event loop wait for them without blocking it (see RetryDelay).
+    """
+    def __init__(self, rules=None, sleep=time.sleep):
+        super(RetryPolicy, self).__init__()
+        self.rules = {
+            UNIT_ATTENTION: RetryRule(max_retries=3),
+            BECOMING_READY: RetryRule(max_retries=10, delay=0.5, backoff=1.5, max_delay=5),
+            BUSY: RetryRule(max_retries=10, delay=0.01, backoff=2, max_delay=1),
+            RESERVATION_CONFLICT: RetryRule(max_retries=3, delay=0.1, backoff=2, max_delay=1),
+        }
+        self.rules.update(rules or {})
+        self.sleep = sleep
+        self.retries = Counter()
+        self.exhausted = Counter()
+
+    def classify(self, exception):
+        """ Returns the class of a command's exception, or None if it shouldn't be retried """
+        if isinstance(exception, AsiCheckConditionError) and exception.sense_obj is not None:
+            sense = exception.sense_obj
+            additional_sense_code = (sense.additional_sense_code.code, sense.additional_sense_code.qualifier)
+            if sense.sense_key == "UNIT_ATTENTION":
+                return UNIT_ATTENTION
+            if sense.sense_key == "NOT_READY" and additional_sense_code in BECOMING_READY_CODES:
+                return BECOMING_READY
+        elif isinstance(exception, (AsiBusyError, AsiTaskSetFullError)):
+            return BUSY
+        elif isinstance(exception, AsiReservationConflictError):
+            return RESERVATION_CONFLICT
+        return None
+
+    def get_retry_delay(self, exception, retries):
+        """ Returns the number of seconds to wait before sending the command again, or None if the command should
+        fail. retries is a Counter of the command's retries so far by class, and is updated """
+        error_class = self.classify(exception)
+        rule = self.rules.get(error_class)
+        if rule is None:
+            return None
+        if retries[error_class] >= rule.max_retries:
+            self.exhausted[error_class] += 1
+            return None
+        delay = rule.get_delay(retries[error_class])
+        retries[error_class] += 1
+        self.retries[error_class] += 1
+        return delay
+
+
+class RetryDelay(OSAsyncIOToken):
+    """ The IO token a command coroutine yields to wait delay seconds before sending a failed command again. Reactors
+    keep running other coroutines and resume it once done is true; synchronous drivers call get_result(block=True),
+    which waits in sleep(delay) """
+    def __init__(self, delay, sleep=time.sleep):
+        super(RetryDelay, self).__init__()
+        self.delay = delay
+        self.deadline = time.time() + delay
+        self.sleep = sleep
+        self._slept = False
+
+    @property
+    def done(self):
+        return self._slept or time.time() >= self.deadline
+
+    def get_result(self, block=False):
+        if block and not self.done:
+            self.sleep(self.delay)
+            self._slept = True
+        return None
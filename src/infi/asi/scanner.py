@@ -0,0 +1,190 @@
+""" Scans many SCSI devices in parallel: device paths are sharded across a pool of processes, each of which drives
+its share of the devices with an EpollReactor (or one device at a time where epoll isn't available), parses their
+INQUIRY data and streams back compact ScanRecords.
+
+    python -m infi.asi.scanner --workers 8 --chunk-size 32 /dev/sg*
+"""
+from __future__ import print_function
+import binascii
+import multiprocessing
+import select
+from collections import namedtuple
+from functools import partial
+
+from .errors import AsiCheckConditionError
+
+ScanRecord = namedtuple("ScanRecord", ["path", "peripheral_device_type", "vendor_id", "product_id", "revision",
+                                       "serial_number", "designators", "error"])
+ScanRecord.__doc__ = """ The result of scanning a device. designators is a tuple of (designator type, association,
+hex string) taken from the Device Identification VPD page. If scanning failed, error holds the error message and the
+other fields may be None. """
+
+DEFAULT_CHUNK_SIZE = 16
+DEFAULT_TIMEOUT = 60
+
+
+class ScanCommand(object):
+    """ Runs the INQUIRY commands of a device scan and returns a ScanRecord. Its execute() is a coroutine like the
+    CDBs', so it can be run with sync_wait() or submitted to a reactor. """
+    def __init__(self, path):
+        super(ScanCommand, self).__init__()
+        self.path = path
+
+    def _get_vpd_page(self, executer, command_class):
+        try:
+            page = yield command_class().execute(executer)
+        except AsiCheckConditionError:
+            page = None    # the device doesn't support this page
+        yield page
+
+    def execute(self, executer):
+        from .cdb.inquiry.standard import StandardInquiryCommand
+        from .cdb.inquiry.vpd_pages.unit_serial_number import UnitSerialNumberVPDPageCommand
+        from .cdb.inquiry.vpd_pages.device_identification import DeviceIdentificationVPDPageCommand
+        inquiry = yield StandardInquiryCommand().execute(executer)
+        serial_number_page = yield self._get_vpd_page(executer, UnitSerialNumberVPDPageCommand)
+        identification_page = yield self._get_vpd_page(executer, DeviceIdentificationVPDPageCommand)
+        designators = () if identification_page is None else tuple(
+            (designator.designator_type, designator.association,
+             binascii.hexlify(designator.pack()[4:]).decode("ascii"))
+            for designator in identification_page.designators_list)
+        yield ScanRecord(path=self.path,
+                         peripheral_device_type=inquiry.peripheral_device.type,
+                         vendor_id=_strip(inquiry.t10_vendor_identification),
+                         product_id=_strip(inquiry.product_identification),
+                         revision=_strip(inquiry.product_revision_level),
+                         serial_number=None if serial_number_page is None else
+                         _strip(serial_number_page.product_serial_number),
+                         designators=designators,
+                         error=None)
+
+
+def _strip(value):
+    if isinstance(value, bytes):
+        value = value.decode("ascii", "replace")
+    return value.strip()
+
+
+def _error_record(path, error):
+    return ScanRecord(path, None, None, None, None, None, (), "{}: {}".format(type(error).__name__, error))
+
+
+def open_executer(path):
+    """ The default executer factory: opens path and returns a command executer for it """
+    from . import create_os_file, create_platform_command_executer
+    return create_platform_command_executer(create_os_file(path))
+
+
+def _close_executer(executer):
+    for close in (getattr(executer, "close", None), executer.io.close):
+        try:
+            if close is not None:
+                close()
+        except Exception:
+            pass
+
+
+def scan_chunk(paths, executer_factory=open_executer, timeout=DEFAULT_TIMEOUT):
+    """ Scans the devices in paths from the calling process and returns a list of ScanRecords, one per path """
+    executers = dict()
+    records = []
+    for path in paths:
+        try:
+            executers[path] = executer_factory(path)
+        except Exception as error:
+            records.append(_error_record(path, error))
+    try:
+        if hasattr(select, "epoll") and all(hasattr(executer.io, "fd") for executer in executers.values()):
+            records.extend(_scan_with_reactor(executers, timeout))
+        else:
+            records.extend(_scan_one_by_one(executers))
+    finally:
+        for executer in executers.values():
+            _close_executer(executer)
+    return records
+
+
+def _scan_with_reactor(executers, timeout):
+    from .reactor import EpollReactor
+    reactor = EpollReactor()
+    try:
+        jobs = dict((reactor.submit(executer, ScanCommand(path)), path) for path, executer in executers.items())
+        try:
+            for job in reactor.as_completed(timeout):
+                try:
+                    yield job.get_result()
+                except Exception as error:
+                    yield _error_record(jobs[job], error)
+        except IOError as error:
+            for job, path in jobs.items():
+                if not job.done:
+                    yield _error_record(path, error)
+    finally:
+        reactor.close()
+
+
+def _scan_one_by_one(executers):
+    from .coroutines.sync_adapter import sync_wait
+    for path, executer in executers.items():
+        try:
+            yield sync_wait(ScanCommand(path).execute(executer))
+        except Exception as error:
+            yield _error_record(path, error)
+
+
+def _chunks(paths, chunk_size):
+    chunk = []
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def scan(paths, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, executer_factory=open_executer,
+         timeout=DEFAULT_TIMEOUT):
+    """ Scans the devices in paths (any iterable, consumed lazily) and yields a ScanRecord per device as the chunks
+    of chunk_size paths are done. workers is the number of processes (by default, the number of CPUs); with 0 the
+    devices are scanned in the calling process. executer_factory must be picklable (a module-level function). A
+    device that fails produces a record with its error, and doesn't stop the scan. """
+    scan_function = partial(scan_chunk, executer_factory=executer_factory, timeout=timeout)
+    if workers == 0:
+        for chunk in _chunks(paths, chunk_size):
+            for record in scan_function(chunk):
+                yield record
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        for records in pool.imap_unordered(scan_function, _chunks(paths, chunk_size)):
+            for record in records:
+                yield record
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Scan SCSI devices in parallel")
+    parser.add_argument("paths", nargs="+", help="device paths")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="devices per work item")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="timeout per chunk in seconds")
+    args = parser.parse_args(argv)
+    failed = 0
+    for record in scan(args.paths, args.workers, args.chunk_size, timeout=args.timeout):
+        if record.error is not None:
+            failed += 1
+            print("{}\terror\t{}".format(record.path, record.error))
+            continue
+        print("\t".join([record.path, record.vendor_id, record.product_id, record.revision,
+                         record.serial_number or "", " ".join(value for _, _, value in record.designators)]))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
@@ -93,6 +93,10 @@ def get_sense_object_from_buffer(buf):
     response_code = SCSISenseResponseCode.create_from_string(buf)
     # spc4r30 4.5:
     if response_code.code in (0x70, 0x71):
+        # devices may return fewer bytes than the fixed format defines (e.g. additional sense length 0)
+        min_size = SCSISenseDataFixed.min_max_sizeof().min
+        if len(buf) < min_size:
+            buf = bytes(buf) + b"\x00" * (min_size - len(buf))
         sense = SCSISenseDataFixed.create_from_string(buf)
     elif response_code.code in (0x72, 0x73):
         sense = SCSISenseDataDescriptorBased.create_from_string(buf)
@@ -2,6 +2,7 @@ from . import CommandExecuterBase, DEFAULT_TIMEOUT_IN_SEC, SCSIReadCommand, SCSI
 from . import SCSI_STATUS_CODES
 from . import gevent_friendly
 from .errors import AsiSCSIError, AsiRequestQueueFullError
+from .buffers import create_read_buffer, read_result_view, create_write_buffer
 from ctypes import *
 from logging import getLogger
 
@@ -115,6 +116,8 @@ class SCSICMD(Structure):
     ("uscsi_rqbuf", c_void_p),
     ("uscsi_path_instance", c_ulong)]
 
+    user_buffer = None
+
     def __init__(self, *args, **kwargs):
         super(SCSICMD, self).__init__(*args, **kwargs)
         self.source_buffer = None
@@ -162,13 +165,14 @@ class SCSICMD(Structure):
         if isinstance(command, SCSIReadCommand):
             if command.max_response_length > 0:
                 scsicmd.uscsi_flags = USCSI_READ | USCSI_DEFAULT_FLAGS
-                scsicmd.set_data_buffer(create_string_buffer(command.max_response_length))
+                scsicmd.user_buffer = command.buffer
+                scsicmd.set_data_buffer(create_read_buffer(command))
             else:
                 scsicmd.uscsi_flags = USCSI_WRITE | USCSI_DEFAULT_FLAGS
                 scsicmd.set_data_buffer(None)
         else:
             scsicmd.uscsi_flags = USCSI_WRITE | USCSI_DEFAULT_FLAGS
-            scsicmd.set_data_buffer(create_string_buffer(command.data, len(command.data)))
+            scsicmd.set_data_buffer(create_write_buffer(command.data))
 
         return scsicmd
 
@@ -227,7 +231,10 @@ class SolarisCommandExecuter(CommandExecuterBase):
 
         data = None
         if request_cmd.uscsi_flags & USCSI_READ and request_cmd.uscsi_buflen != 0:
-            data = request_cmd.data_buffer.raw
+            if request_cmd.user_buffer is not None:
+                data = read_result_view(request_cmd.user_buffer, request_cmd.uscsi_buflen, request_cmd.data_buffer)
+            else:
+                data = request_cmd.data_buffer.raw
 
         return (data, packet_id)
 
@@ -13,12 +13,11 @@ class UnixFile(OSFile):
         self._read_timeout = read_timeout
 
     def read(self, size):
-        start_time = time.time()
+        deadline = time.time() + self._read_timeout
 
-        # A time-out value of zero specifies a poll and never blocks:
-        while not select.select([self.fd], [], [], 0)[0]:
-            time.sleep(0.01)
-            if time.time() > start_time + self._read_timeout:
+        # block until the descriptor is readable, rather than polling it, so a response is read as soon as it arrives
+        while not select.select([self.fd], [], [], max(0, deadline - time.time()))[0]:
+            if time.time() >= deadline:
                 raise IOError("Timeout while waiting for file descriptor to become readable")
 
         return os.read(self.fd, size)
@@ -3,6 +3,7 @@ from . import CommandExecuterBase, DEFAULT_MAX_QUEUE_SIZE, SCSIReadCommand, SCSI
 from .errors import AsiOSError, AsiSCSIError
 from . import OSAsyncIOToken, OSFile, OSAsyncFile, OSAsyncReactor, DEFAULT_TIMEOUT, gevent_friendly
 from .coroutines.sync_adapter import AsyncCoroutine
+from .buffers import create_read_buffer, read_result_view, create_write_buffer, buffer_length
 import six
 
 # Taken from Windows DDK
@@ -312,6 +313,8 @@ class SCSIPassThroughDirect(Structure):
         ("sense_buffer", c_ubyte * SENSE_SIZE)
     ]
 
+    user_buffer = None
+
     def set_data_buffer(self, buf):
         if buf is not None:
             self.data_buffer = buf
@@ -344,14 +347,15 @@ class SCSIPassThroughDirect(Structure):
         if isinstance(command, SCSIReadCommand):
             if command.max_response_length > 0:
                 spt.DataIn = SCSI_IOCTL_DATA_IN
-                spt.set_data_buffer(create_string_buffer(command.max_response_length))
+                spt.user_buffer = command.buffer
+                spt.set_data_buffer(create_read_buffer(command))
             else:
                 spt.DataIn = SCSI_IOCTL_DATA_UNSPECIFIED
                 spt.set_data_buffer(None)
         else:
-            if len(command.data) > 0:
+            if buffer_length(command.data) > 0:
                 spt.DataIn = SCSI_IOCTL_DATA_OUT
-                spt.set_data_buffer(create_string_buffer(command.data, len(command.data)))
+                spt.set_data_buffer(create_write_buffer(command.data))
             else:
                 spt.DataIn = SCSI_IOCTL_DATA_UNSPECIFIED
 
@@ -382,7 +386,10 @@ class Win32CommandExecuter(CommandExecuterBase):
             return
         data = None
         if spt.DataIn == SCSI_IOCTL_DATA_IN and spt.DataTransferLength != 0:
-            data = spt.data_buffer.raw[0:spt.DataTransferLength]
+            if spt.user_buffer is not None:
+                data = read_result_view(spt.user_buffer, spt.DataTransferLength, spt.data_buffer)
+            else:
+                data = spt.data_buffer.raw[0:spt.DataTransferLength]
 
         yield (data, spt.packet_id)
 
@@ -0,0 +1,419 @@
+"""
+A benchmark suite for infi.asi, writing its results as JSON so releases can be compared:
+
+    python asi_benchmark.py --output before.json
+    python asi_benchmark.py --output after.json --filter parse.
+
+The groups are:
+
+  pack        create_datagram() of the CDBs
+  parse       decoding the responses of every page class of cdb.inquiry, cdb.diagnostic, cdb.persist, report_luns,
+              rtpg and read_capacity
+  sense       decoding fixed and descriptor format sense data
+  trampoline  executing CDBs synchronously with sync_wait() (the coroutine trampoline) and with sync_execute()
+  iops        end-to-end READ(10) commands at several queue depths, on an EmulatedCommandExecuter and (on Linux) a
+              LinuxCommandExecuter of a FakeSgDevice - or of a real device, with --device
+
+No device is needed: the responses come from an emulator.VirtualLun, and the SES pages from the samples of
+test_diagnostic. The micro-benchmarks report the best and median microseconds per operation of --repeat rounds;
+the iops benchmarks report commands per second, the CPU time per command and the latency percentiles.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import struct
+import sys
+import time
+
+from infi.asi import create_platform_command_executer, create_os_file
+from infi.asi.coroutines.sync_adapter import sync_wait, sync_execute
+from infi.asi.emulator import VirtualLun, LatencyModel, EmulatedCommandExecuter, create_fc_transport_id
+from infi.asi.emulator import create_fixed_sense
+from infi.asi.metrics import timer
+from infi.asi.sense import get_sense_object_from_buffer
+
+try:
+    cpu_time = time.process_time
+except AttributeError:
+    cpu_time = time.clock
+
+READ10_OPCODE = 0x28
+
+
+def get_version():
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution("infi.asi").version
+    except Exception:
+        return None
+
+
+def measure(func, repeat, min_time):
+    """ Calls func in rounds of enough calls to take min_time seconds. Returns (best, median) microseconds per call
+    of repeat rounds, and the number of calls per round """
+    number = 1
+    while True:
+        start_time = timer()
+        for i in range(number):
+            func()
+        duration = timer() - start_time
+        if duration >= min_time:
+            break
+        number = number * 10 if duration < min_time / 10 else int(number * min_time / duration) + 1
+    rounds = [duration]
+    for i in range(repeat - 1):
+        start_time = timer()
+        for i in range(number):
+            func()
+        rounds.append(timer() - start_time)
+    rounds.sort()
+    return rounds[0] / number * 1e6, rounds[len(rounds) // 2] / number * 1e6, number
+
+
+# pack
+
+def get_pack_benchmarks():
+    from infi.asi.cdb.tur import TestUnitReadyCommand
+    from infi.asi.cdb.read import Read6Command, Read10Command, Read12Command, Read16Command
+    from infi.asi.cdb.write import Write6Command, Write10Command, Write12Command, Write16Command
+    from infi.asi.cdb.write_same import WriteSame10Command, WriteSame16Command
+    from infi.asi.cdb.compare_and_write import CompareAndWriteCommand
+    from infi.asi.cdb.unmap import UnmapCommand
+    from infi.asi.cdb.read_capacity import ReadCapacity10Command, ReadCapacity16Command
+    from infi.asi.cdb.report_luns import ReportLunsCommand
+    from infi.asi.cdb.rtpg import RTPGCommand
+    from infi.asi.cdb.inquiry.standard import StandardInquiryCommand
+    from infi.asi.cdb.inquiry.vpd_pages.block_limits import BlockLimitsPageCommand
+    from infi.asi.cdb.diagnostic.ses_pages.configuration import ConfigurationDiagnosticPagesCommand
+    from infi.asi.cdb.persist.input import PersistentReserveInCommand
+    from infi.asi.cdb.persist.input import PERSISTENT_RESERVE_IN_SERVICE_ACTION_CODES as IN_SERVICE_ACTIONS
+    from infi.asi.cdb.persist.output import PersistentReserveOutCommand
+    from infi.asi.cdb.persist.output import PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES as OUT_SERVICE_ACTIONS
+    block = b"\x00" * 512
+    commands = [("tur", TestUnitReadyCommand()),
+                ("read6", Read6Command(0x1234, 8)),
+                ("read10", Read10Command(0x123456, 8)),
+                ("read12", Read12Command(0x123456, 8)),
+                ("read16", Read16Command(0x123456789, 8)),
+                ("write6", Write6Command(0x1234, block)),
+                ("write10", Write10Command(0x123456, block)),
+                ("write12", Write12Command(0x123456, block)),
+                ("write16", Write16Command(0x123456789, block)),
+                ("write_same10", WriteSame10Command(0x123456, block, 64)),
+                ("write_same16", WriteSame16Command(0x123456789, block, 64)),
+                ("compare_and_write", CompareAndWriteCommand(0x123456, block * 2, 1)),
+                ("unmap", UnmapCommand([(0x1000, 64), (0x2000, 64)])),
+                ("read_capacity10", ReadCapacity10Command()),
+                ("read_capacity16", ReadCapacity16Command()),
+                ("report_luns", ReportLunsCommand()),
+                ("rtpg", RTPGCommand()),
+                ("standard_inquiry", StandardInquiryCommand()),
+                ("block_limits_inquiry", BlockLimitsPageCommand()),
+                ("ses_configuration", ConfigurationDiagnosticPagesCommand()),
+                ("persistent_reserve_in", PersistentReserveInCommand(IN_SERVICE_ACTIONS.READ_FULL_STATUS)),
+                ("persistent_reserve_out", PersistentReserveOutCommand(OUT_SERVICE_ACTIONS.REGISTER,
+                                                                       service_action_reservation_key=1))]
+    return [(name, command.create_datagram) for name, command in commands]
+
+
+# parse
+
+def execute_on_lun(lun, command, initiator=b"", allocation_length=None):
+    """ Returns the response data of a CDB (by default, of its allocation length) executed on a VirtualLun """
+    if allocation_length is None:
+        allocation_length = command.allocation_length
+    status, data = lun.execute(bytes(command.create_datagram()), b"", allocation_length, initiator)
+    assert status == 0, "{!r} failed with status {:#x}".format(command, status)
+    return data
+
+
+def create_persistent_reservations(lun):
+    """ Registers two initiators on lun and reserves it for the first. Returns the initiators """
+    from infi.asi.cdb.persist.output import PersistentReserveOutCommand
+    from infi.asi.cdb.persist.output import PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES as SERVICE_ACTIONS
+    initiators = [create_fc_transport_id(), create_fc_transport_id()]
+    for key, initiator in enumerate(initiators, 1):
+        command = PersistentReserveOutCommand(SERVICE_ACTIONS.REGISTER, service_action_reservation_key=key)
+        lun.execute(bytes(command.create_datagram()), bytes(command.parameter_list_datagram), 0, initiator)
+    command = PersistentReserveOutCommand(SERVICE_ACTIONS.RESERVE, reservation_key=1)
+    lun.execute(bytes(command.create_datagram()), bytes(command.parameter_list_datagram), 0, initiators[0])
+    return initiators
+
+
+def create_rtpg_descriptor(target_port_group, ports, preferred=False):
+    """ Returns a target port group descriptor, in the active/optimized state, of the relative target ports """
+    header = struct.pack(">BBHBBBB", 0x80 if preferred else 0x00, 0x8f, target_port_group, 0, 0, 0, len(ports))
+    return header + b"".join(struct.pack(">HH", 0, port) for port in ports)
+
+
+def get_parse_benchmarks():
+    from infi.asi.cdb.inquiry.standard import StandardInquiryCommand, StandardInquiryDataBuffer
+    from infi.asi.cdb.inquiry.vpd_pages import get_vpd_page, get_vpd_page_data, SUPPORTED_VPD_PAGES_DATA
+    from infi.asi.cdb.inquiry.vpd_pages.unknown import UnknownVPDPageBuffer
+    from infi.asi.cdb.diagnostic.ses_pages.supported_pages import SupportedDiagnosticPagesData
+    from infi.asi.cdb.diagnostic.ses_pages.configuration import ConfigurationDiagnosticPagesData
+    from infi.asi.cdb.diagnostic.ses_pages.enclosure_status import EnclosureStatusDiagnosticPagesData
+    from infi.asi.cdb.diagnostic.ses_pages.element_descriptor import ElementDescriptorDiagnosticPagesData
+    from infi.asi.cdb.diagnostic.ses_pages.vendor_0x80 import Vendor0x80DiagnosticPagesData
+    from infi.asi.cdb.diagnostic.ses_pages.unknown import UnknownDiagnosticPageData
+    from infi.asi.cdb.persist.input import PersistentReserveInCommand, SERVICE_ACTION_TO_RESPONSE_BUFFER_CLASS
+    from infi.asi.cdb.persist.input import PERSISTENT_RESERVE_IN_SERVICE_ACTION_CODES
+    from infi.instruct.buffer import Buffer
+    from infi.asi.cdb.report_luns import ReportLunsCommand, ReportLunsData
+    from infi.asi.cdb.rtpg import TargetPortGroupLengthOnlyResponse, TargetPortGroupExtendedResponse
+    from infi.asi.cdb.read_capacity import ReadCapacity10Command, ReadCapacity16Command
+    from infi.asi.cdb.read_capacity import ReportReadCapacityData10, ReportReadCapacityData16
+    from test_diagnostic import SES_CONFIGURATION_PAGE_SAMPLE, SES_ENCL_STATUS_PAGE_SAMPLE
+    from test_diagnostic import SES_ELEMENT_DESCR_PAGE_SAMPLE
+
+    def buffer_parser(buffer_class, data, *args):
+        def parse():
+            buffer_class(*args).unpack(data)
+        return parse
+
+    def touch(obj):
+        """ Reads every field of a parsed page, unpacking the lazy lists """
+        if isinstance(obj, list):
+            for item in obj:
+                touch(item)
+        elif isinstance(obj, Buffer):
+            for field in type(obj).__fields__:
+                touch(getattr(obj, field.attr_name()))
+
+    def buffer_reader(buffer_class, data, *args):
+        def parse_and_read():
+            obj = buffer_class(*args)
+            obj.unpack(data)
+            touch(obj)
+        return parse_and_read
+
+    def struct_parser(struct_class, data):
+        def parse():
+            struct_class.create_from_string(data)
+        return parse
+
+    lun = VirtualLun(luns=range(256))
+    benchmarks = [("inquiry.standard", buffer_parser(StandardInquiryDataBuffer,
+                                                     execute_on_lun(lun, StandardInquiryCommand(allocation_length=96))))]
+    for page_code, buffer_class in sorted(SUPPORTED_VPD_PAGES_DATA.items()):
+        data = execute_on_lun(lun, get_vpd_page(page_code)())
+        benchmarks.append(("inquiry.vpd_{:#04x}".format(page_code), buffer_parser(get_vpd_page_data(page_code), data)))
+    benchmarks.append(("inquiry.vpd_unknown", buffer_parser(UnknownVPDPageBuffer,
+                                                            b"\x00\xc8\x00\x20" + bytes(bytearray(range(32))))))
+
+    configuration_page = ConfigurationDiagnosticPagesData(None)
+    configuration_page.unpack(SES_CONFIGURATION_PAGE_SAMPLE)
+    benchmarks.extend([
+        ("diagnostic.supported_pages", buffer_parser(SupportedDiagnosticPagesData,
+                                                     b"\x00\x00\x00\x09\x00\x01\x02\x04\x05\x07\x0a\x0e\x80", None)),
+        ("diagnostic.configuration", buffer_parser(ConfigurationDiagnosticPagesData, SES_CONFIGURATION_PAGE_SAMPLE,
+                                                   None)),
+        ("diagnostic.enclosure_status", buffer_parser(EnclosureStatusDiagnosticPagesData, SES_ENCL_STATUS_PAGE_SAMPLE,
+                                                      configuration_page)),
+        ("diagnostic.enclosure_status.read_all", buffer_reader(EnclosureStatusDiagnosticPagesData,
+                                                               SES_ENCL_STATUS_PAGE_SAMPLE, configuration_page)),
+        ("diagnostic.element_descriptor", buffer_parser(ElementDescriptorDiagnosticPagesData,
+                                                        SES_ELEMENT_DESCR_PAGE_SAMPLE, configuration_page)),
+        ("diagnostic.vendor_0x80", buffer_parser(Vendor0x80DiagnosticPagesData,
+                                                 b"\x80\x00\x00\x80" + b"\xff" * 0x80, None)),
+        ("diagnostic.unknown", buffer_parser(UnknownDiagnosticPageData, b"\x81\x00\x00\x08" + b"\x01" * 8))])
+
+    initiators = create_persistent_reservations(lun)
+    for service_action, buffer_class in sorted(SERVICE_ACTION_TO_RESPONSE_BUFFER_CLASS.items()):
+        data = execute_on_lun(lun, PersistentReserveInCommand(service_action), initiators[0])
+        benchmarks.append(("persist." + buffer_class.__name__, buffer_parser(buffer_class, data)))
+    buffer_class = SERVICE_ACTION_TO_RESPONSE_BUFFER_CLASS[PERSISTENT_RESERVE_IN_SERVICE_ACTION_CODES.READ_FULL_STATUS]
+    data = execute_on_lun(lun, PersistentReserveInCommand(PERSISTENT_RESERVE_IN_SERVICE_ACTION_CODES.READ_FULL_STATUS),
+                          initiators[0])
+    benchmarks.append(("persist.{}.read_all".format(buffer_class.__name__), buffer_reader(buffer_class, data)))
+
+    report_luns_data = execute_on_lun(lun, ReportLunsCommand())
+
+    def parse_report_luns():
+        # as ReportLunsCommand.execute()
+        result = ReportLunsData.create_from_string(report_luns_data)
+        result.hex_lun_list = [hex(lun) for lun in result.lun_list]
+        result.normalize_lun_list()
+        return result
+
+    def parse_and_read_report_luns():
+        result = parse_report_luns()
+        list(result.lun_list), list(result.hex_lun_list)
+    benchmarks.extend([("report_luns.256_luns", parse_report_luns),
+                       ("report_luns.256_luns.read_all", parse_and_read_report_luns)])
+
+    descriptors = create_rtpg_descriptor(1, [1, 2], preferred=True) + create_rtpg_descriptor(2, [3, 4])
+    benchmarks.extend([
+        ("rtpg.length_only", buffer_parser(TargetPortGroupLengthOnlyResponse,
+                                           struct.pack(">I", len(descriptors)) + descriptors)),
+        ("rtpg.extended", buffer_parser(TargetPortGroupExtendedResponse,
+                                        struct.pack(">IBBB", len(descriptors), 0x10, 0, 0) + descriptors)),
+        ("read_capacity.10", struct_parser(ReportReadCapacityData10,
+                                           execute_on_lun(lun, ReadCapacity10Command(), allocation_length=8))),
+        ("read_capacity.16", struct_parser(ReportReadCapacityData16,
+                                           execute_on_lun(lun, ReadCapacity16Command())))])
+    return benchmarks
+
+
+# sense
+
+def get_sense_benchmarks():
+    fixed = create_fixed_sense(0x03, 0x11, 0x00, information=0x123456)
+    short_fixed = b"\x70\x00\x06\x00\x00\x00\x00\x00"
+    # an information descriptor (type 0x00) and a sense key specific descriptor (type 0x02)
+    descriptor = (b"\x72\x05\x24\x00\x00\x00\x00\x14" + b"\x00\x0a\x80\x00" + struct.pack(">Q", 0x123456) +
+                  b"\x02\x06\x00\x00\xc0\x00\x02\x00")
+    return [(name, lambda data=data: get_sense_object_from_buffer(data))
+            for name, data in (("fixed", fixed), ("fixed_short", short_fixed), ("descriptor", descriptor))]
+
+
+# trampoline
+
+def get_trampoline_benchmarks():
+    from infi.asi.cdb.tur import TestUnitReadyCommand
+    from infi.asi.cdb.read import Read10Command
+    from infi.asi.cdb.inquiry.standard import StandardInquiryCommand
+    executer = EmulatedCommandExecuter(VirtualLun(block_count=1024))
+    benchmarks = []
+    for name, cdb in (("tur", TestUnitReadyCommand()), ("read10", Read10Command(0, 8)),
+                      ("standard_inquiry", StandardInquiryCommand())):
+        benchmarks.append(("{}.sync_wait".format(name), lambda cdb=cdb: sync_wait(cdb.execute(executer))))
+        benchmarks.append(("{}.sync_execute".format(name), lambda cdb=cdb: sync_execute(cdb, executer)))
+    return benchmarks
+
+
+def run_micro_benchmarks(group, benchmarks, args, results):
+    for name, func in benchmarks:
+        if not is_selected(args, group, name):
+            continue
+        best, median, number = measure(func, args.repeat, args.min_time)
+        results.append(dict(group=group, name=name, best_usec=best, median_usec=median, calls_per_round=number,
+                            rounds=args.repeat))
+        report("{:<12} {:<52} {:>10.2f} usec (median {:.2f})".format(group, name, best, median))
+
+
+# iops
+
+def create_emulated_executer(depth, latency):
+    return EmulatedCommandExecuter(VirtualLun(), max_queue_size=depth, latency=latency), None
+
+
+def create_fake_sg_executer(depth, latency):
+    from infi.asi.fake_sg import FakeSgDevice
+    from infi.asi.linux import LinuxCommandExecuter
+    device = FakeSgDevice(VirtualLun(), latency=latency)
+    io = device.open()
+
+    def close():
+        io.close()
+        device.close()
+    return LinuxCommandExecuter(io, max_queue_size=depth), close
+
+
+def get_device_executer_factory(path):
+    def create_device_executer(depth, latency):
+        os_file = create_os_file(path)
+        return create_platform_command_executer(os_file, max_queue_size=depth), os_file.close
+    return create_device_executer
+
+
+def run_iops(create_executer, depth, latency, commands, blocks):
+    from infi.asi.cdb.read import Read10Command
+    executer, close = create_executer(depth, latency)
+    try:
+        metrics = executer.enable_metrics()
+        lbas = [(index * 7919 * blocks) % (1 << 20) for index in range(commands)]
+        start_time, start_cpu_time = timer(), cpu_time()
+        for result in executer.map((Read10Command(lba, blocks) for lba in lbas), depth=depth, ordered=False):
+            pass
+        duration, cpu_duration = timer() - start_time, cpu_time() - start_cpu_time
+    finally:
+        if close is not None:
+            close()
+    latencies = metrics.get(opcode=READ10_OPCODE).latency
+    return dict(commands=commands, seconds=duration, iops=commands / duration,
+                cpu_usec_per_command=cpu_duration / commands * 1e6, latency_mean_usec=latencies.mean,
+                latency_p50_usec=latencies.percentile(50), latency_p99_usec=latencies.percentile(99))
+
+
+def run_iops_benchmarks(args, results):
+    latency = LatencyModel(base=args.latency / 1e6) if args.latency else None
+    targets = [("emulated", create_emulated_executer)]
+    if sys.platform.startswith("linux"):
+        targets.append(("fake_sg", create_fake_sg_executer))
+    if args.device:
+        targets = [("device", get_device_executer_factory(args.device))]
+    for target, create_executer in targets:
+        for depth in args.queue_depths:
+            name = "{}.qd{}".format(target, depth)
+            if not is_selected(args, "iops", name):
+                continue
+            result = run_iops(create_executer, depth, latency if target != "device" else None, args.commands,
+                              args.blocks)
+            result.update(group="iops", name=name, queue_depth=depth, blocks=args.blocks,
+                          latency_model_usec=args.latency if target != "device" else None)
+            results.append(result)
+            report("{:<12} {:<52} {:>10.0f} IOPS, {:.1f} CPU usec/command, p99 latency {} usec".format(
+                "iops", name, result["iops"], result["cpu_usec_per_command"], result["latency_p99_usec"]))
+
+
+def is_selected(args, group, name):
+    full_name = "{}.{}".format(group, name)
+    return not args.filter or any(pattern in full_name for pattern in args.filter)
+
+
+def report(line):
+    sys.stderr.write(line + "\n")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks infi.asi and writes the results as JSON")
+    parser.add_argument("--output", help="the JSON file to write (by default, standard output)")
+    parser.add_argument("--filter", action="append", metavar="SUBSTRING",
+                        help="run only the benchmarks whose group.name contains SUBSTRING (repeatable)")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds per micro-benchmark (default: %(default)s)")
+    parser.add_argument("--min-time", type=float, default=0.05,
+                        help="minimal seconds per micro-benchmark round (default: %(default)s)")
+    parser.add_argument("--queue-depths", type=lambda value: [int(depth) for depth in value.split(",")],
+                        default=[1, 4, 16, 64], help="comma separated (default: 1,4,16,64)")
+    parser.add_argument("--commands", type=int, default=5000,
+                        help="commands per iops benchmark (default: %(default)s)")
+    parser.add_argument("--blocks", type=int, default=8, help="blocks per READ(10) (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=100.0,
+                        help="emulated service time per command in microseconds, 0 for none (default: %(default)s)")
+    parser.add_argument("--device", help="run the iops benchmarks on this device (read only) instead of emulated ones")
+    parser.add_argument("--no-compiled-decoders", action="store_true",
+                        help="parse the responses with infi.instruct only (see cdb.fixed_layout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.no_compiled_decoders:
+        from infi.asi.cdb.fixed_layout import disable_compiled_decoders
+        disable_compiled_decoders()
+    results = []
+    run_micro_benchmarks("pack", get_pack_benchmarks(), args, results)
+    run_micro_benchmarks("parse", get_parse_benchmarks(), args, results)
+    run_micro_benchmarks("sense", get_sense_benchmarks(), args, results)
+    run_micro_benchmarks("trampoline", get_trampoline_benchmarks(), args, results)
+    run_iops_benchmarks(args, results)
+    document = dict(metadata=dict(infi_asi_version=get_version(), python_version=platform.python_version(),
+                                  python_implementation=platform.python_implementation(),
+                                  platform=platform.platform(), machine=platform.machine(),
+                                  cpu_count=os.cpu_count() if hasattr(os, "cpu_count") else None,
+                                  time=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                                  arguments=dict(vars(args))),
+                    results=results)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(document, output_file, indent=2, sort_keys=True)
+    else:
+        json.dump(document, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Compares the completion latency of the polling loop UnixFile.read used to run (select() with a zero timeout and a
+10 ms sleep), of UnixFile.read, one executer at a time, and of the epoll reactor.
+
+No device is needed: every executer completes its commands from a timer thread that writes the packet id to a pipe
+after a fixed delay, and the latency is the time between that write and the invocation of the send() callback.
+"""
+from __future__ import print_function
+import os
+import select
+import sys
+import struct
+import threading
+import time
+from infi.asi import CommandExecuterBase, SCSIReadCommand
+from infi.asi.unix import UnixFile
+from infi.asi.reactor import EpollReactor
+from infi.asi.coroutines.sync_adapter import sync_wait
+
+DEVICE_LATENCY = 0.0005
+
+
+class PollingUnixFile(UnixFile):
+    def read(self, size):
+        start_time = time.time()
+        while not select.select([self.fd], [], [], 0)[0]:
+            time.sleep(0.01)
+            if time.time() > start_time + self._read_timeout:
+                raise IOError("Timeout while waiting for file descriptor to become readable")
+        return os.read(self.fd, size)
+
+
+class TimerPipeCommandExecuter(CommandExecuterBase):
+    def __init__(self, completion_times, max_queue_size=32, file_class=UnixFile):
+        super(TimerPipeCommandExecuter, self).__init__(max_queue_size)
+        read_fd, self.write_fd = os.pipe()
+        self.io = file_class(read_fd)
+        self.completion_times = completion_times
+
+    def _complete(self, packet_index):
+        self.completion_times[(self, packet_index)] = time.time()
+        os.write(self.write_fd, struct.pack("I", packet_index))
+
+    def _os_prepare_to_send(self, command, packet_index):
+        return packet_index
+
+    def _os_send(self, os_data):
+        timer = threading.Timer(DEVICE_LATENCY, self._complete, (os_data,))
+        timer.start()
+        yield timer
+
+    def _os_receive(self):
+        raw = yield self.io.read(4)
+        packet_id = struct.unpack("I", raw)[0]
+        yield (packet_id, packet_id)
+
+    def close(self):
+        self.io.close()
+        os.close(self.write_fd)
+
+
+def print_latencies(name, latencies):
+    latencies = sorted(latencies)
+    mean = sum(latencies) / len(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print("%-10s commands=%d, mean latency: %.1f usec, p99 latency: %.1f usec" %
+          (name, len(latencies), mean * 1e6, p99 * 1e6))
+
+
+def make_callback(executer, completion_times, latencies):
+    def callback(packet_id, exception):
+        latencies.append(time.time() - completion_times.pop((executer, packet_id)))
+    return callback
+
+
+def benchmark_unix_file(iterations, file_class):
+    completion_times, latencies = dict(), []
+    executer = TimerPipeCommandExecuter(completion_times, file_class=file_class)
+    for i in range(iterations):
+        sync_wait(executer.send(SCSIReadCommand(b"\x00" * 6, 0),
+                                callback=make_callback(executer, completion_times, latencies)))
+        sync_wait(executer.wait())
+    executer.close()
+    return latencies
+
+
+def benchmark_reactor(iterations, executer_count):
+    completion_times, latencies = dict(), []
+    reactor = EpollReactor()
+    executers = [TimerPipeCommandExecuter(completion_times) for i in range(executer_count)]
+    for executer in executers:
+        reactor.register(executer)
+    for i in range(iterations // executer_count):
+        for executer in executers:
+            sync_wait(executer.send(SCSIReadCommand(b"\x00" * 6, 0),
+                                    callback=make_callback(executer, completion_times, latencies)))
+        reactor.wait()
+    reactor.close()
+    for executer in executers:
+        executer.close()
+    return latencies
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print_latencies("polling", benchmark_unix_file(iterations, PollingUnixFile))
+    print_latencies("unix file", benchmark_unix_file(iterations, UnixFile))
+    print_latencies("epoll", benchmark_reactor(iterations, 1))
+    print_latencies("epoll x16", benchmark_reactor(iterations, 16))
+
+
+if __name__ == "__main__":
+    main()
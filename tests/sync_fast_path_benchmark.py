@@ -0,0 +1,55 @@
+"""
+Measures the CPU time per command of executing CDBs synchronously with sync_wait() (the coroutine trampoline) and
+with sync_execute() (plain function calls), on a LinuxCommandExecuter.
+
+No device is needed: the io object completes every command as soon as its SGIO header is written.
+"""
+from __future__ import print_function
+import sys
+import time
+from infi.asi.linux import LinuxCommandExecuter
+from infi.asi.cdb.tur import TestUnitReadyCommand
+from infi.asi.cdb.read import Read10Command
+from infi.asi.coroutines.sync_adapter import sync_wait, sync_execute
+
+try:
+    cpu_time = time.process_time
+except AttributeError:
+    cpu_time = time.clock
+
+
+class LoopbackIO(object):
+    def __init__(self):
+        self.responses = []
+
+    def write(self, buffer):
+        self.responses.append(bytes(buffer))
+        return len(buffer)
+
+    def read(self, size):
+        return self.responses.pop()
+
+
+def run_sync_wait(cdb, executer):
+    return sync_wait(cdb.execute(executer))
+
+
+def benchmark(run, cdb, iterations):
+    executer = LinuxCommandExecuter(LoopbackIO())
+    start_time = cpu_time()
+    for i in range(iterations):
+        run(cdb, executer)
+    return (cpu_time() - start_time) / iterations * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for name, cdb in (("tur", TestUnitReadyCommand()), ("read10", Read10Command(0, 1))):
+        trampoline = benchmark(run_sync_wait, cdb, iterations)
+        fast_path = benchmark(sync_execute, cdb, iterations)
+        print("%-8s iters=%d, sync_wait %.1f usec/command, sync_execute %.1f usec/command (%.0f%% less CPU)" %
+              (name, iterations, trampoline, fast_path, (1 - fast_path / trampoline) * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import os
+import sys
+import struct
+from unittest import TestCase, SkipTest
+from infi.asi import CommandExecuterBase, SCSIReadCommand, AsiException
+from infi.asi.errors import AsiTaskSetFullError
+
+
+class EchoCommandExecuter(CommandExecuterBase):
+    """ completes every command immediately; the response data is the command itself. The first task_set_full
+    commands fail with TASK SET FULL """
+    def __init__(self, max_queue_size):
+        super(EchoCommandExecuter, self).__init__(max_queue_size)
+        from infi.asi.unix import UnixFile
+        read_fd, self.write_fd = os.pipe()
+        self.io = UnixFile(read_fd)
+        self.max_in_flight = 0
+        self.task_set_full = 0
+
+    def _os_prepare_to_send(self, command, packet_index):
+        return (packet_index, command.command)
+
+    def _os_send(self, os_data):
+        self.max_in_flight = max(self.max_in_flight, len(self.pending_packets))
+        packet_index, data = os_data
+        yield os.write(self.write_fd, struct.pack("BB", packet_index, len(data)) + data)
+
+    def _os_receive(self):
+        packet_id, length = struct.unpack("BB", (yield self.io.read(2)))
+        data = yield self.io.read(length)
+        if self.task_set_full:
+            self.task_set_full -= 1
+            yield (AsiTaskSetFullError(), packet_id)
+        elif data == b"error":
+            yield (AsiException("error"), packet_id)
+        else:
+            yield (data, packet_id)
+
+    def close(self):
+        self.io.close()
+        os.close(self.write_fd)
+
+
+class EchoCommand(object):
+    def __init__(self, *values):
+        self.values = values
+
+    def execute(self, executer):
+        results = []
+        for value in self.values:
+            result = yield executer.call(SCSIReadCommand(value, 0))
+            results.append(result)
+        yield results
+
+
+class AsyncioCommandExecuterTestCase(TestCase):
+    def setUp(self):
+        if sys.version_info < (3, 5):
+            raise SkipTest()
+        import asyncio
+        from infi.asi.aio import AsyncioCommandExecuter
+        self.loop = asyncio.new_event_loop()
+        self.executer = EchoCommandExecuter(max_queue_size=4)
+        self.asyncio_executer = AsyncioCommandExecuter(self.executer, loop=self.loop)
+
+    def tearDown(self):
+        self.asyncio_executer.close()
+        self.executer.close()
+        self.loop.close()
+
+    def test_execute(self):
+        result = self.loop.run_until_complete(self.asyncio_executer.execute(EchoCommand(b"a", b"bc")))
+        self.assertEqual(result, [b"a", b"bc"])
+
+    def test_many_commands_in_flight(self):
+        import asyncio
+        commands = [EchoCommand(str(i).encode("ascii")) for i in range(50)]
+
+        async def execute_all():
+            return await asyncio.gather(*[self.asyncio_executer.execute(command) for command in commands])
+
+        results = self.loop.run_until_complete(execute_all())
+        self.assertEqual(results, [[str(i).encode("ascii")] for i in range(50)])
+        self.assertEqual(self.executer.max_in_flight, 4)
+        self.assertTrue(self.executer.is_queue_empty())
+
+    def test_exception(self):
+        with self.assertRaises(AsiException):
+            self.loop.run_until_complete(self.asyncio_executer.execute(EchoCommand(b"error")))
+        self.assertTrue(self.executer.is_queue_empty())
+
+    def test_execute_async(self):
+        from infi.asi.aio import execute_async
+        result = self.loop.run_until_complete(execute_async(EchoCommand(b"a", b"bc"), self.asyncio_executer))
+        self.assertEqual(result, [b"a", b"bc"])
+
+    def test_call_async_many_commands_in_flight(self):
+        import asyncio
+
+        async def execute_all():
+            return await asyncio.gather(*[self.asyncio_executer.call_async(SCSIReadCommand(str(i).encode("ascii"), 0))
+                                          for i in range(50)])
+
+        results = self.loop.run_until_complete(execute_all())
+        self.assertEqual(results, [str(i).encode("ascii") for i in range(50)])
+        self.assertEqual(self.executer.max_in_flight, 4)
+        self.assertTrue(self.executer.is_queue_empty())
+
+    def test_execute_async_exception(self):
+        from infi.asi.aio import execute_async
+        with self.assertRaises(AsiException):
+            self.loop.run_until_complete(execute_async(EchoCommand(b"a", b"error"), self.asyncio_executer))
+        self.assertTrue(self.executer.is_queue_empty())
+
+    def test_other_devices_run_while_retrying(self):
+        import asyncio
+        import time
+        from infi.asi.aio import AsyncioCommandExecuter
+        from infi.asi.retry import RetryPolicy, RetryRule, BUSY
+        self.executer.retry_policy = RetryPolicy({BUSY: RetryRule(max_retries=2, delay=0.1)})
+        self.executer.task_set_full = 2
+        other_executer = EchoCommandExecuter(max_queue_size=4)
+        other_asyncio_executer = AsyncioCommandExecuter(other_executer, loop=self.loop)
+        completed = []
+
+        async def execute(name, coroutine):
+            result = await coroutine
+            completed.append((name, result, time.time() - start))
+
+        async def execute_all():
+            await asyncio.gather(execute("a", self.asyncio_executer.execute(EchoCommand(b"a"))),
+                                 execute("b", self.asyncio_executer.call_async(SCSIReadCommand(b"b", 0))),
+                                 execute("c", other_asyncio_executer.execute(EchoCommand(b"c"))))
+
+        start = time.time()
+        try:
+            self.loop.run_until_complete(execute_all())
+        finally:
+            other_asyncio_executer.close()
+            other_executer.close()
+        self.assertEqual(completed[0][:2], ("c", [b"c"]))
+        self.assertLess(completed[0][2], 0.1)
+        self.assertEqual(sorted(completed[1:])[0][:2], ("a", [b"a"]))
+        self.assertEqual(sorted(completed[1:])[1][:2], ("b", b"b"))
+        self.assertGreaterEqual(min(elapsed for name, result, elapsed in completed[1:]), 0.1)
+        self.assertEqual(self.executer.retry_policy.retries, {BUSY: 2})
+
+    def test_task_set_full_command_is_sent_again(self):
+        from infi.asi.aio import execute_async
+        self.executer.enable_adaptive_queue_depth()
+        self.executer.task_set_full = 2
+        result = self.loop.run_until_complete(self.asyncio_executer.execute(EchoCommand(b"a")))
+        self.assertEqual(result, [b"a"])
+        self.executer.task_set_full = 1
+        result = self.loop.run_until_complete(execute_async(EchoCommand(b"b"), self.asyncio_executer))
+        self.assertEqual(result, [b"b"])
+        self.assertEqual(self.executer.queue_depth_controller.congestion_count, 3)
+        self.assertTrue(self.executer.is_queue_empty())
+
+
+class SyncAwaitTestCase(TestCase):
+    def setUp(self):
+        if sys.version_info < (3, 5):
+            raise SkipTest()
+
+    def test_cdb_execute_async(self):
+        from infi.asi.aio import SyncAwaitableCommandExecuter, sync_await
+        from infi.asi.cdb.tur import TestUnitReadyCommand
+        from test_retry import ScriptedCommandExecuter
+        executer = SyncAwaitableCommandExecuter(ScriptedCommandExecuter([None]))
+        self.assertTrue(sync_await(TestUnitReadyCommand().execute_async(executer)))
+
+    def test_exception_can_be_caught_by_cdb(self):
+        from infi.asi.aio import SyncAwaitableCommandExecuter, execute_async, sync_await
+
+        class FallbackCommand(object):
+            def execute(self, executer):
+                try:
+                    result = yield EchoCommand(b"error").execute(executer)
+                except AsiException:
+                    result = yield EchoCommand(b"fallback").execute(executer)
+                yield result
+
+        from test_retry import ScriptedCommandExecuter
+        executer = SyncAwaitableCommandExecuter(ScriptedCommandExecuter([AsiException("error"), b"ok"]))
+        self.assertEqual(sync_await(execute_async(FallbackCommand(), executer)), [b"ok"])
+
+    def test_ses_enclosure_status(self):
+        from infi.asi.aio import SyncAwaitableCommandExecuter, sync_await
+        from infi.asi.cdb.diagnostic.ses_pages.aio import get_enclosure_status_page
+        from test_diagnostic import SES_CONFIGURATION_PAGE_SAMPLE, SES_ENCL_STATUS_PAGE_SAMPLE
+        from test_retry import ScriptedCommandExecuter
+        scripted = ScriptedCommandExecuter([SES_CONFIGURATION_PAGE_SAMPLE, SES_ENCL_STATUS_PAGE_SAMPLE])
+        status_page = sync_await(get_enclosure_status_page(SyncAwaitableCommandExecuter(scripted)))
+        self.assertEqual([bytearray(command.command)[2] for command in scripted.sent_commands], [0x01, 0x02])
+        self.assertEqual(len(status_page.conf_page.type_descriptor_header_list), 8)
+        self.assertEqual(len(status_page.status_descriptors), 8)
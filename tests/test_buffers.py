@@ -0,0 +1,59 @@
+from unittest import TestCase
+from ctypes import addressof, memmove
+from infi.asi import SCSIReadCommand, buffers
+from infi.asi.buffers import buffer_length, create_read_buffer, create_write_buffer, read_result_view
+from infi.asi.buffers import byte_view, pin_scatter_buffers
+import array
+
+
+class ScatterGatherFallbackTestCase(TestCase):
+    """ platforms without native scatter-gather gather writes and scatter reads through an intermediate buffer """
+    def test_buffer_length(self):
+        self.assertEqual(buffer_length(b"\x00" * 3), 3)
+        self.assertEqual(buffer_length([b"\x00" * 3, bytearray(5), memoryview(b"\x00")]), 9)
+
+    def test_gather_write(self):
+        buffer = create_write_buffer([b"ab", bytearray(b"cd"), memoryview(b"ef")])
+        self.assertEqual(buffer.raw, b"abcdef")
+
+    def test_scatter_read(self):
+        buffers = [bytearray(2), bytearray(3), bytearray(2)]
+        source = create_read_buffer(SCSIReadCommand(b"", 6, buffers))
+        source.raw = b"abcdef"
+        views = read_result_view(buffers, 4, source)
+        self.assertEqual([view.tobytes() for view in views], [b"ab", b"cd", b""])
+        self.assertEqual(buffers, [bytearray(b"ab"), bytearray(b"cd\x00"), bytearray(2)])
+
+    def test_scatter_read_into_read_only_buffer(self):
+        with self.assertRaises(TypeError):
+            create_read_buffer(SCSIReadCommand(b"", 4, [bytearray(2), b"\x00" * 2]))
+
+
+class WithoutMemoryviewCastTestCase(TestCase):
+    """ Python 2 memoryviews can't be cast, nor pinned with ctypes """
+    def setUp(self):
+        self._original, buffers._PY3_MEMORYVIEW = buffers._PY3_MEMORYVIEW, False
+
+    def tearDown(self):
+        buffers._PY3_MEMORYVIEW = self._original
+
+    def test_multi_byte_items_are_viewed_through_a_copy(self):
+        view = byte_view(array.array('H', [1, 2]))
+        self.assertEqual((view.itemsize, len(view), view.readonly), (1, 4, True))
+
+    def test_scatter_buffers_are_pinned_through_their_objects(self):
+        targets = [bytearray(2), bytearray(3)]
+        pinned = pin_scatter_buffers(targets, 4)
+        self.assertEqual([len(item) for item in pinned], [2, 2])
+        memmove(addressof(pinned[1]), b"xy", 2)
+        self.assertEqual(targets[1], bytearray(b"xy\x00"))
+
+    def test_memoryviews_are_copied_for_writes(self):
+        data = bytearray(b"ab")
+        buffer = create_write_buffer(memoryview(data))
+        data[0:1] = b"x"
+        self.assertEqual(buffer.raw, b"ab")
+
+    def test_memoryviews_cannot_be_read_into(self):
+        with self.assertRaises(TypeError):
+            create_read_buffer(SCSIReadCommand(b"", 2, memoryview(bytearray(2))))
@@ -324,6 +324,38 @@ Enclosure Status diagnostic page:
             print("{!r} has {!r} elements".format(config_page.type_descriptor_header_list[idx].element_type,
                                                   len(status_page.status_descriptors[idx].individual_elements)))
 
+    def test_enclosure_status_diagnostics_page_is_unpacked_lazily(self):
+        import pickle
+        from infi.asi.cdb.fixed_layout import LazyList
+        from infi.asi.cdb.diagnostic.ses_pages.enclosure_status import EnclosureStatusDiagnosticPagesData
+        from infi.asi.cdb.diagnostic.ses_pages.enclosure_status import ArrayDeviceSlotStatusElement
+        config_page = self.test_configuration_diagnostics_page()
+        status_page = EnclosureStatusDiagnosticPagesData(config_page)
+        self.assertEqual(status_page.unpack(SES_ENCL_STATUS_PAGE_SAMPLE), len(SES_ENCL_STATUS_PAGE_SAMPLE))
+        self.assertIsInstance(vars(status_page)["status_descriptors"], LazyList)
+        self.assertIsInstance(status_page.status_descriptors, list)
+        descriptor = status_page.status_descriptors[0]
+        self.assertIsInstance(vars(descriptor)["individual_elements"], LazyList)
+        element = descriptor.individual_elements[0]
+        self.assertIsInstance(element, ArrayDeviceSlotStatusElement)
+        self.assertEqual(element.element_status_code, 1)
+        self.assertIs(status_page.status_descriptors[0].individual_elements[0], element)
+        # pickling unpacks the rest
+        status_page = EnclosureStatusDiagnosticPagesData(config_page)
+        status_page.unpack(SES_ENCL_STATUS_PAGE_SAMPLE)
+        status_page = pickle.loads(pickle.dumps(status_page))
+        self.assertIsInstance(vars(status_page)["status_descriptors"], list)
+        self.assertIsInstance(vars(status_page.status_descriptors[-1])["individual_elements"], list)
+        # instruct unpacks other buffers
+        eager_status_page = EnclosureStatusDiagnosticPagesData(config_page)
+        eager_status_page.unpack(memoryview(SES_ENCL_STATUS_PAGE_SAMPLE))
+        self.assertIsInstance(vars(eager_status_page)["status_descriptors"], list)
+        self.assertEqual(repr(status_page), repr(eager_status_page))
+        for descriptor, eager_descriptor in zip(status_page.status_descriptors, eager_status_page.status_descriptors):
+            self.assertEqual(repr(descriptor.overall_element), repr(eager_descriptor.overall_element))
+            self.assertEqual([repr(item) for item in descriptor.individual_elements],
+                             [repr(item) for item in eager_descriptor.individual_elements])
+
     def test_element_descriptor_diagnostics_page(self):
         """
 Element Descriptor In diagnostic page:
@@ -0,0 +1,262 @@
+import pickle
+from unittest import TestCase
+from infi.asi import SCSIReadCommand
+from infi.asi.errors import AsiCheckConditionError, AsiReservationConflictError, AsiTaskSetFullError
+from infi.asi.coroutines.sync_adapter import sync_execute
+from infi.asi.emulator import VirtualLun, EmulatedCommandExecuter, LatencyModel
+from infi.asi.cdb.persist.input import PersistentReserveInCommand, PERSISTENT_RESERVE_IN_SERVICE_ACTION_CODES
+from infi.asi.cdb.persist.output import PersistentReserveOutCommand, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES
+from infi.asi.cdb.persist.output import PERSISTENT_RESERVE_OUT_TYPES
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class EmulatorTestCase(TestCase):
+    def setUp(self):
+        self.lun = VirtualLun(block_count=4096, serial="EMU-TEST")
+        self.executer = EmulatedCommandExecuter(self.lun)
+
+    def assertCheckCondition(self, cdb, sense_key, asc, executer=None):
+        with self.assertRaises(AsiCheckConditionError) as context:
+            sync_execute(cdb, executer or self.executer)
+        sense = context.exception.sense_obj
+        self.assertEqual(sense.sense_key, sense_key)
+        self.assertEqual((sense.additional_sense_code.code, sense.additional_sense_code.qualifier), asc)
+
+
+class InquiryTestCase(EmulatorTestCase):
+    def test_standard_inquiry(self):
+        from infi.asi.cdb.inquiry.standard import StandardInquiryCommand
+        result = sync_execute(StandardInquiryCommand(), self.executer)
+        self.assertEqual(result.t10_vendor_identification, "INFI-ASI")
+        self.assertEqual(result.product_identification, "VIRTUAL LUN")
+        self.assertEqual(result.peripheral_device.type, 0)
+        self.assertEqual(result.cmd_que, 1)
+
+    def test_short_response_spans_allocation_length(self):
+        metrics = self.executer.enable_metrics()
+        command = SCSIReadCommand(b"\x12\x00\x00\x00\x60\x00", 96)
+        data = self.executer.call_sync(command)
+        self.assertEqual((len(data), command.transferred_length), (96, 36))
+        self.assertEqual(data[36:], b"\x00" * 60)
+        self.assertEqual(metrics.get(opcode=0x12).transferred.total, 36)
+
+    def test_vpd_pages(self):
+        from infi.asi.cdb.inquiry import vpd_pages
+        supported = sync_execute(vpd_pages.SupportedVPDPagesCommand(), self.executer)
+        self.assertEqual(set(supported.vpd_parameters), set(vpd_pages.SUPPORTED_VPD_PAGES_COMMANDS))
+        for page_code in supported.vpd_parameters:
+            page = sync_execute(vpd_pages.get_vpd_page(page_code)(), self.executer)
+            self.assertEqual(page.page_code & 0xff, page_code)     # signed in the ATA information page
+
+    def test_vpd_page_contents(self):
+        from infi.asi.cdb.inquiry import vpd_pages
+        serial = sync_execute(vpd_pages.UnitSerialNumberVPDPageCommand(), self.executer)
+        self.assertEqual(serial.product_serial_number, "EMU-TEST")
+        identification = sync_execute(vpd_pages.DeviceIdentificationVPDPageCommand(), self.executer)
+        self.assertEqual([designator.designator_type for designator in identification.designators_list], [3, 1])
+        self.assertEqual(identification.designators_list[0].naa, 6)
+        ata = sync_execute(vpd_pages.AtaInformationVPDPageCommand(), self.executer)
+        self.assertEqual(ata.identify_device.serial_number.strip(), "EMU-TEST")
+        limits = sync_execute(vpd_pages.BlockLimitsPageCommand(), self.executer)
+        self.assertEqual(limits.maximum_compare_and_write_length, 1)
+        self.assertEqual(limits.maximum_unmap_block_descriptor_count, 256)
+        self.assertEqual(limits.ugavalid, 1)
+        provisioning = sync_execute(vpd_pages.LogicalBlockProvisioningPageCommand(), self.executer)
+        self.assertEqual((provisioning.lbpu, provisioning.lbpws, provisioning.lbprz), (1, 1, 1))
+        self.assertEqual(sync_execute(vpd_pages.VeritasVPDPageCommand(), self.executer).is_thin_lun, 1)
+
+    def test_unsupported_page(self):
+        from infi.asi.cdb.inquiry.vpd_pages import UnknownVPDPageCommand
+        self.assertCheckCondition(UnknownVPDPageCommand(0x86)(), "ILLEGAL_REQUEST", (0x24, 0x00))
+
+    def test_unsupported_opcode(self):
+        from infi.asi.coroutines.sync_adapter import sync_wait
+        with self.assertRaises(AsiCheckConditionError) as context:
+            sync_wait(self.executer.call(SCSIReadCommand(b"\x1a\x00\x3f\x00\xff\x00", 255)))    # MODE SENSE
+        self.assertEqual(context.exception.sense_obj.additional_sense_code.code, 0x20)
+
+
+class BlockCommandsTestCase(EmulatorTestCase):
+    def test_read_capacity(self):
+        from infi.asi.cdb.read_capacity import ReadCapacity10Command, ReadCapacity16Command
+        capacity = sync_execute(ReadCapacity10Command(), self.executer)
+        self.assertEqual((capacity.last_logical_block_address, capacity.block_length_in_bytes), (4095, 512))
+        capacity = sync_execute(ReadCapacity16Command(), self.executer)
+        self.assertEqual((capacity.last_logical_block_address, capacity.tpe, capacity.troz), (4095, 1, 1))
+
+    def test_read_capacity_10_of_huge_lun(self):
+        from infi.asi.cdb.read_capacity import ReadCapacity10Command
+        executer = EmulatedCommandExecuter(VirtualLun(block_count=1 << 40))
+        self.assertEqual(sync_execute(ReadCapacity10Command(), executer).last_logical_block_address, 0xffffffff)
+        self.assertEqual(executer.lun.blocks, {})
+
+    def test_read_and_write(self):
+        from infi.asi.cdb import read, write
+        for index, (write_class, read_class) in enumerate([(write.Write6Command, read.Read6Command),
+                                                           (write.Write10Command, read.Read10Command),
+                                                           (write.Write12Command, read.Read12Command),
+                                                           (write.Write16Command, read.Read16Command)]):
+            data = bytes(bytearray([index + 1])) * 1024
+            sync_execute(write_class(100 + index * 2, data), self.executer)
+            self.assertEqual(sync_execute(read_class(100 + index * 2, 2), self.executer), data)
+        self.assertEqual(sync_execute(read.Read10Command(0, 1), self.executer), b"\x00" * 512)
+        self.assertEqual(sorted(self.lun.blocks), list(range(100, 108)))
+
+    def test_read_into_buffer(self):
+        from infi.asi.cdb.read import Read16Command
+        from infi.asi.cdb.write import Write16Command
+        sync_execute(Write16Command(7, b"x" * 512), self.executer)
+        buffer = bytearray(512)
+        result = sync_execute(Read16Command(7, 1, buffer=buffer), self.executer)
+        self.assertEqual(bytes(buffer), b"x" * 512)
+        self.assertEqual(bytes(result), b"x" * 512)
+
+    def test_out_of_range(self):
+        from infi.asi.cdb.read import Read16Command
+        self.assertCheckCondition(Read16Command(4095, 2), "ILLEGAL_REQUEST", (0x21, 0x00))
+
+    def test_write_same_and_unmap(self):
+        from infi.asi.cdb.read import Read10Command
+        from infi.asi.cdb.write_same import WriteSame10Command, WriteSame16Command
+        from infi.asi.cdb.unmap import UnmapCommand
+        sync_execute(WriteSame16Command(10, b"a" * 512, number_of_blocks=20), self.executer)
+        self.assertEqual(sync_execute(Read10Command(10, 20), self.executer), b"a" * 512 * 20)
+        sync_execute(UnmapCommand([(10, 5), (25, 5)]), self.executer)
+        self.assertEqual(sorted(self.lun.blocks), list(range(15, 25)))
+        sync_execute(WriteSame10Command(15, b"\x00" * 512, number_of_blocks=10), self.executer)
+        self.assertEqual(self.lun.blocks, {})
+
+    def test_compare_and_write(self):
+        from infi.asi.cdb.read import Read10Command
+        from infi.asi.cdb.write import Write10Command
+        from infi.asi.cdb.compare_and_write import CompareAndWriteCommand
+        sync_execute(Write10Command(3, b"old!" * 128), self.executer)
+        sync_execute(CompareAndWriteCommand(3, b"old!" * 128 + b"new!" * 128, 1), self.executer)
+        self.assertEqual(sync_execute(Read10Command(3, 1), self.executer), b"new!" * 128)
+        with self.assertRaises(AsiCheckConditionError) as context:
+            sync_execute(CompareAndWriteCommand(3, b"new?" * 128 + b"bad!" * 128, 1), self.executer)
+        self.assertEqual(context.exception.sense_obj.sense_key, "MISCOMPARE")
+        self.assertEqual(context.exception.sense_obj.information, 3)
+        self.assertEqual(sync_execute(Read10Command(3, 1), self.executer), b"new!" * 128)
+
+    def test_report_luns(self):
+        from infi.asi.cdb.report_luns import ReportLunsCommand
+        executer = EmulatedCommandExecuter(VirtualLun(luns=[0, 1, 7]))
+        self.assertEqual(sync_execute(ReportLunsCommand(), executer).lun_list, [0, 1, 7])
+
+
+class PersistentReservationTestCase(EmulatorTestCase):
+    def setUp(self):
+        super(PersistentReservationTestCase, self).setUp()
+        self.other = EmulatedCommandExecuter(self.lun)
+
+    def reserve_out(self, executer, service_action, **kwargs):
+        return sync_execute(PersistentReserveOutCommand(service_action, **kwargs), executer)
+
+    def reserve_in(self, service_action):
+        return sync_execute(PersistentReserveInCommand(service_action), self.executer)
+
+    def test_register_and_reserve(self):
+        from infi.asi.cdb.write import Write10Command
+        from infi.asi.cdb.read import Read10Command
+        self.reserve_out(self.executer, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES.REGISTER,
+                         service_action_reservation_key=0xabba)
+        self.reserve_out(self.other, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES.REGISTER,
+                         service_action_reservation_key=0xbeef)
+        self.reserve_out(self.executer, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES.RESERVE, reservation_key=0xabba,
+                         pr_type=PERSISTENT_RESERVE_OUT_TYPES.WRITE_EXCLUSIVE)
+        keys = self.reserve_in(PERSISTENT_RESERVE_IN_SERVICE_ACTION_CODES.READ_KEYS)
+        self.assertEqual((keys.pr_generation, keys.key_list), (2, [0xabba, 0xbeef]))
+        reservation = self.reserve_in(PERSISTENT_RESERVE_IN_SERVICE_ACTION_CODES.READ_RESERVATION)
+        self.assertEqual((reservation.reservation_key, reservation.pr_type), (0xabba, 1))
+
+        with self.assertRaises(AsiReservationConflictError):
+            sync_execute(Write10Command(0, b"\x01" * 512), self.other)
+        sync_execute(Read10Command(0, 1), self.other)
+        sync_execute(Write10Command(0, b"\x01" * 512), self.executer)
+        with self.assertRaises(AsiReservationConflictError):
+            self.reserve_out(self.other, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES.RESERVE, reservation_key=0xbeef,
+                             pr_type=PERSISTENT_RESERVE_OUT_TYPES.WRITE_EXCLUSIVE)
+
+        status = self.reserve_in(PERSISTENT_RESERVE_IN_SERVICE_ACTION_CODES.READ_FULL_STATUS)
+        self.assertEqual([(descriptor.reservation_key, descriptor.reservation_holder)
+                          for descriptor in status.full_status_descriptors], [(0xabba, 1), (0xbeef, 0)])
+        status = self.reserve_in(PERSISTENT_RESERVE_IN_SERVICE_ACTION_CODES.READ_FULL_STATUS)
+        status = pickle.loads(pickle.dumps(status))
+        self.assertIsInstance(status.full_status_descriptors, list)
+        self.assertEqual([descriptor.reservation_key for descriptor in status.full_status_descriptors],
+                         [0xabba, 0xbeef])
+
+    def test_wrong_key(self):
+        self.reserve_out(self.executer, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES.REGISTER,
+                         service_action_reservation_key=0xabba)
+        with self.assertRaises(AsiReservationConflictError):
+            self.reserve_out(self.executer, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES.RESERVE, reservation_key=0x1)
+
+    def test_preempt(self):
+        from infi.asi.cdb.write import Write10Command
+        self.reserve_out(self.executer, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES.REGISTER,
+                         service_action_reservation_key=0xabba)
+        self.reserve_out(self.other, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES.REGISTER,
+                         service_action_reservation_key=0xbeef)
+        self.reserve_out(self.executer, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES.RESERVE, reservation_key=0xabba,
+                         pr_type=PERSISTENT_RESERVE_OUT_TYPES.EXCLUSIVE_ACCESS)
+        self.reserve_out(self.other, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES.PREEMPT, reservation_key=0xbeef,
+                         service_action_reservation_key=0xabba, pr_type=PERSISTENT_RESERVE_OUT_TYPES.EXCLUSIVE_ACCESS)
+        self.assertEqual(self.reserve_in(PERSISTENT_RESERVE_IN_SERVICE_ACTION_CODES.READ_KEYS).key_list, [0xbeef])
+        with self.assertRaises(AsiReservationConflictError):
+            sync_execute(Write10Command(0, b"\x01" * 512), self.executer)
+
+    def test_unregister_releases(self):
+        self.reserve_out(self.executer, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES.REGISTER,
+                         service_action_reservation_key=0xabba)
+        self.reserve_out(self.executer, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES.RESERVE, reservation_key=0xabba)
+        self.reserve_out(self.executer, PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES.REGISTER, reservation_key=0xabba)
+        reservation = self.reserve_in(PERSISTENT_RESERVE_IN_SERVICE_ACTION_CODES.READ_RESERVATION)
+        self.assertEqual(reservation.additional_length, 0)
+        self.assertEqual(self.lun.registrations, {})
+
+
+class TimingTestCase(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def create_executer(self, lun, latency, **kwargs):
+        return EmulatedCommandExecuter(lun, latency=latency, timer=self.clock.time, sleep=self.clock.sleep, **kwargs)
+
+    def test_commands_in_flight_complete_in_parallel(self):
+        from infi.asi.cdb.read import Read10Command
+        executer = self.create_executer(VirtualLun(), LatencyModel(base=0.001, per_byte=0.000001), max_queue_size=8)
+        results = list(executer.map((Read10Command(0, blocks) for blocks in (8, 1, 4)), ordered=False))
+        self.assertEqual([len(result) for result in results], [512, 2048, 4096])
+        self.assertAlmostEqual(self.clock.now, 0.001 + 4096 * 0.000001)
+
+    def test_task_set_full(self):
+        from infi.asi.cdb.tur import TestUnitReadyCommand
+        from infi.asi.coroutines.sync_adapter import sync_wait
+        executer = self.create_executer(VirtualLun(queue_depth=2), LatencyModel(base=0.01))
+        results = []
+        for i in range(3):
+            sync_wait(executer.send(SCSIReadCommand(b"\x00" * 6, 0), lambda *args: results.append(args)))
+        sync_wait(executer.wait())
+        self.assertIsInstance(results[0][1], AsiTaskSetFullError)
+        self.assertEqual([result[1] for result in results[1:]], [None, None])
+
+        executer.enable_adaptive_queue_depth()
+        self.assertEqual(list(executer.map([TestUnitReadyCommand() for i in range(6)])), [True] * 6)
+
+    def test_jitter_is_reproducible(self):
+        first, second = LatencyModel(0.001, jitter=0.5, seed=1), LatencyModel(0.001, jitter=0.5, seed=1)
+        latencies = [first(0x28, 512) for i in range(10)]
+        self.assertEqual(latencies, [second(0x28, 512) for i in range(10)])
+        self.assertTrue(all(0.0005 <= latency <= 0.0015 for latency in latencies))
@@ -0,0 +1,97 @@
+import time
+from unittest import TestCase
+from infi.asi import SCSIReadCommand
+from infi.asi.errors import AsiCheckConditionError, AsiReservationConflictError, AsiTaskSetFullError
+from infi.asi.coroutines.sync_adapter import sync_wait, sync_execute
+from infi.asi.emulator import VirtualLun, LatencyModel
+from infi.asi.fake_sg import FakeSgDevice
+from infi.asi.linux import LinuxCommandExecuter
+
+
+class FakeSgDeviceTestCase(TestCase):
+    def setUp(self):
+        self.lun = VirtualLun(block_count=1024)
+        self.device = FakeSgDevice(self.lun)
+        self.io = self.device.open()
+        self.executer = LinuxCommandExecuter(self.io, max_queue_size=8)
+
+    def tearDown(self):
+        self.io.close()
+        self.device.close()
+
+    def test_read_and_write(self):
+        from infi.asi.cdb.read import Read10Command
+        from infi.asi.cdb.write import Write16Command
+        sync_execute(Write16Command(10, b"ab" * 512), self.executer)
+        self.assertEqual(sync_execute(Read10Command(10, 2), self.executer), b"ab" * 512)
+        self.assertEqual(self.lun.read_blocks(10, 2), b"ab" * 512)
+
+    def test_scatter_gather(self):
+        from infi.asi.cdb.read import Read10Command
+        from infi.asi.cdb.write import Write10Command
+        sync_execute(Write10Command(0, [b"x" * 100, bytearray(b"y" * 924)]), self.executer)
+        buffers = [bytearray(512), bytearray(512)]
+        sync_execute(Read10Command(0, 2, buffer=buffers), self.executer)
+        self.assertEqual(b"".join(bytes(buffer) for buffer in buffers), b"x" * 100 + b"y" * 924)
+
+    def test_short_response(self):
+        from infi.asi.cdb.inquiry.standard import StandardInquiryCommand
+        metrics = self.executer.enable_metrics()
+        result = sync_execute(StandardInquiryCommand(allocation_length=96), self.executer)
+        self.assertEqual(result.product_identification, "VIRTUAL LUN")
+        self.assertEqual(metrics.get(opcode=0x12).transferred.max, 36)
+
+    def test_check_condition(self):
+        from infi.asi.cdb.read import Read16Command
+        with self.assertRaises(AsiCheckConditionError) as context:
+            sync_execute(Read16Command(1024, 1), self.executer)
+        self.assertEqual(context.exception.sense_obj.sense_key, "ILLEGAL_REQUEST")
+        self.assertEqual(context.exception.sense_obj.additional_sense_code.code, 0x21)
+
+    def test_reservation_conflict(self):
+        from infi.asi.cdb.write import Write10Command
+        from infi.asi.cdb.persist.output import PersistentReserveOutCommand
+        from infi.asi.cdb.persist.output import PERSISTENT_RESERVE_OUT_SERVICE_ACTION_CODES as SERVICE_ACTIONS
+        sync_execute(PersistentReserveOutCommand(SERVICE_ACTIONS.REGISTER, service_action_reservation_key=1),
+                     self.executer)
+        sync_execute(PersistentReserveOutCommand(SERVICE_ACTIONS.RESERVE, reservation_key=1), self.executer)
+        with FakeSgDevice(self.lun) as other_device:
+            io = other_device.open()
+            try:
+                with self.assertRaises(AsiReservationConflictError):
+                    sync_execute(Write10Command(0, b"\x01" * 512), LinuxCommandExecuter(io))
+            finally:
+                io.close()
+
+
+class FakeSgDeviceTimingTestCase(TestCase):
+    def create_executer(self, lun, latency, max_queue_size=8):
+        device = FakeSgDevice(lun, latency=latency)
+        io = device.open()
+        self.addCleanup(device.close)
+        self.addCleanup(io.close)
+        return LinuxCommandExecuter(io, max_queue_size=max_queue_size)
+
+    def test_completion_order(self):
+        from infi.asi.cdb.read import Read10Command
+        executer = self.create_executer(VirtualLun(), LatencyModel(base=0.001, per_byte=0.00001))
+        metrics = executer.enable_metrics()
+        results = list(executer.as_completed(Read10Command(0, blocks) for blocks in (8, 1, 4)))
+        self.assertEqual([len(result) for result in results], [512, 2048, 4096])
+        self.assertEqual(metrics.get(opcode=0x28).kernel_duration.max, 41000)
+
+    def test_commands_in_flight_complete_in_parallel(self):
+        from infi.asi.cdb.tur import TestUnitReadyCommand
+        executer = self.create_executer(VirtualLun(), LatencyModel(base=0.05))
+        start_time = time.time()
+        self.assertEqual(list(executer.map(TestUnitReadyCommand() for i in range(8))), [True] * 8)
+        self.assertLess(time.time() - start_time, 0.05 * 4)
+
+    def test_task_set_full(self):
+        executer = self.create_executer(VirtualLun(queue_depth=2), LatencyModel(base=0.01))
+        results = []
+        for i in range(3):
+            sync_wait(executer.send(SCSIReadCommand(b"\x00" * 6, 0), lambda *args: results.append(args)))
+        sync_wait(executer.wait())
+        self.assertIsInstance(results[0][1], AsiTaskSetFullError)
+        self.assertEqual([result[1] for result in results[1:]], [None, None])
@@ -0,0 +1,242 @@
+import copy
+import pickle
+import random
+import struct
+from unittest import TestCase
+from infi.instruct.buffer import Buffer, be_uint_field, list_field, bytes_ref, b_uint8
+from infi.instruct.errors import InstructError
+from infi.instruct.struct import Struct
+from infi.asi.cdb.control import Control
+from infi.asi.cdb.read import Read6Command, Read10Command, Read12Command, Read16Command
+from infi.asi.cdb.write import Write6Command, Write10Command, Write12Command, Write16Command
+from infi.asi.cdb.inquiry.standard import StandardInquiryDataBuffer
+from infi.asi.cdb.inquiry.vpd_pages.block_limits import BlockLimitsVPDPageBuffer
+from infi.asi.cdb.read_capacity import ReportReadCapacityData16
+from infi.asi.cdb.persist.input import SERVICE_ACTION_TO_RESPONSE_BUFFER_CLASS
+from infi.asi.cdb.rtpg import TargetPortGroupLengthOnlyResponse, TargetPortGroupExtendedResponse
+from infi.asi.cdb.fixed_layout import FixedLayoutEncoder, FixedLayoutDecoder, FixedLayoutBuffer, LazyList
+from infi.asi.cdb.fixed_layout import fixed_int, fixed_list, fixed_lazy_list, lazy_list_fields
+from infi.asi.cdb.fixed_layout import enable_compiled_decoders, disable_compiled_decoders, compiled_decoders_enabled
+
+FLAGS = dict(fua_nv=1, fua=1, dpo=1, RelAdr=1, mmc4=1, rdprotect=3, wrprotect=3, reserved=3, group_number=5)
+
+
+class FixedLayoutEncoderTestCase(TestCase):
+    def create_commands(self, rng):
+        lba, blocks = rng.randrange(1 << 21), rng.randrange(1, 256)
+        block = b"\x00" * 512
+        yield Read6Command(lba, blocks)
+        yield Write6Command(lba, block * blocks)
+        lba, blocks = rng.randrange(1 << 32), rng.randrange(1 << 16)
+        yield Read10Command(lba, blocks)
+        yield Write10Command(lba, block * (blocks % 64))
+        yield Read12Command(lba, rng.randrange(1 << 32))
+        yield Write12Command(lba, block * (blocks % 64 + 1))
+        lba = rng.randrange(1 << 64)
+        yield Read16Command(lba, rng.randrange(1 << 32))
+        yield Write16Command(lba, block * (blocks % 64))
+
+    def randomize_fields(self, command, rng):
+        for name, width in FLAGS.items():
+            if hasattr(command, name):
+                # instruct masks bit fields to their width; so must the encoder
+                setattr(command, name, rng.randrange(1 << (width + 1)))
+        command.control = Control(naca=rng.randrange(2), vendor_specific=rng.randrange(4))
+
+    def test_matches_instruct(self):
+        rng = random.Random(0)
+        for i in range(200):
+            for command in self.create_commands(rng):
+                if i:
+                    self.randomize_fields(command, rng)
+                self.assertIsNotNone(type(command).__dict__.get("_encoder_"))
+                self.assertEqual(command.create_datagram(), type(command).write_to_string(command),
+                                 repr(command))
+
+    def test_size(self):
+        for command_class, size in ((Read6Command, 6), (Read10Command, 10), (Read12Command, 12),
+                                    (Read16Command, 16), (Write6Command, 6), (Write10Command, 10),
+                                    (Write12Command, 12), (Write16Command, 16)):
+            self.assertEqual(command_class._encoder_.size, size)
+
+    def test_packing_error(self):
+        command = Read10Command(0, 1)
+        command.logical_block_address = 1 << 32
+        with self.assertRaises(InstructError):
+            type(command).write_to_string(command)
+        with self.assertRaises(InstructError):
+            command.create_datagram()
+
+    def test_subclass_uses_instruct(self):
+        class ShortRead10Command(Read10Command):
+            _fields_ = Read10Command._fields_[:-1]
+
+        self.assertEqual(ShortRead10Command(1, 1).create_datagram(), b"\x28\x00\x00\x00\x00\x01\x00\x00\x01")
+
+    def test_encoder(self):
+        class Command(object):
+            length = 0x0102
+            flag = 3
+            field = 0x1f
+
+        encoder = FixedLayoutEncoder([("B", 0x12), ("H", "length"), ("B", [("flag", 0, 1), ("field", 3, 5)])])
+        self.assertEqual(encoder.encode(Command()), b"\x12\x01\x02\xf9")
+
+
+def fields_of(obj):
+    if isinstance(obj, list):
+        return [fields_of(item) for item in obj]
+    if isinstance(obj, (Buffer, Struct)):
+        return (type(obj).__name__,
+                sorted((key, fields_of(getattr(obj, key))) for key in list(vars(obj)) if not key.startswith("_")))
+    return (type(obj).__name__, obj)
+
+
+class FixedLayoutDecoderTestCase(TestCase):
+    def tearDown(self):
+        enable_compiled_decoders()
+
+    def unpack(self, buffer_class, data, compiled):
+        (enable_compiled_decoders if compiled else disable_compiled_decoders)()
+        try:
+            if issubclass(buffer_class, Struct):
+                return fields_of(buffer_class.create_from_string(data))
+            obj = buffer_class()
+            size = obj.unpack(data)
+            return size, fields_of(obj)
+        except Exception as error:
+            return type(error)
+        finally:
+            enable_compiled_decoders()
+
+    def assert_matches_instruct(self, buffer_class, data):
+        self.assertEqual(self.unpack(buffer_class, data, True), self.unpack(buffer_class, data, False),
+                         "{} {!r}".format(buffer_class.__name__, data))
+
+    def create_rtpg_descriptors(self, rng):
+        descriptors = b""
+        for i in range(rng.randrange(4)):
+            count = rng.choice([0, 1, 2, rng.randrange(256)])
+            descriptors += struct.pack(">HHHBB", rng.randrange(1 << 16), rng.randrange(1 << 16), 0,
+                                       rng.randrange(256), count) + b"\x00\x00\x00\x01" * rng.randrange(4)
+        return descriptors
+
+    def create_full_status(self, rng):
+        descriptors = b""
+        for i in range(rng.randrange(4)):
+            transport_id = bytes(bytearray(rng.randrange(256) for i in range(rng.randrange(30))))
+            additional_length = max(0, len(transport_id) + rng.randrange(-2, 3))
+            descriptors += b"\x01" * 20 + struct.pack(">I", additional_length) + transport_id
+        return b"\x00\x00\x00\x01" + struct.pack(">I", max(0, len(descriptors) + rng.randrange(-4, 2))) + descriptors
+
+    def test_matches_instruct(self):
+        rng = random.Random(0)
+        buffer_classes = [StandardInquiryDataBuffer, BlockLimitsVPDPageBuffer, ReportReadCapacityData16,
+                          TargetPortGroupLengthOnlyResponse, TargetPortGroupExtendedResponse] + \
+            list(SERVICE_ACTION_TO_RESPONSE_BUFFER_CLASS.values())
+        for i in range(100):
+            for buffer_class in buffer_classes:
+                data = bytes(bytearray(rng.choice([0, 1, 0xff, rng.randrange(256)]) for i in range(rng.randrange(80))))
+                self.assert_matches_instruct(buffer_class, data)
+            descriptors = self.create_rtpg_descriptors(rng)
+            self.assert_matches_instruct(TargetPortGroupLengthOnlyResponse,
+                                         struct.pack(">I", len(descriptors)) + descriptors)
+            self.assert_matches_instruct(TargetPortGroupExtendedResponse,
+                                         struct.pack(">I", len(descriptors)) + b"\x10\x00\x00" + descriptors)
+            data = self.create_full_status(rng)
+            self.assert_matches_instruct(SERVICE_ACTION_TO_RESPONSE_BUFFER_CLASS[3], data[:rng.randrange(len(data) + 1)])
+            keys = bytes(bytearray(rng.randrange(256) for i in range(8 * rng.randrange(4))))
+            self.assert_matches_instruct(SERVICE_ACTION_TO_RESPONSE_BUFFER_CLASS[0],
+                                         b"\x00" * 4 + struct.pack(">I", len(keys) + rng.choice([0, 0, 8])) + keys)
+
+    def test_decoder(self):
+        class Descriptor(FixedLayoutBuffer, Buffer):
+            length = be_uint_field(where=bytes_ref[0:2])
+            values = list_field(type=b_uint8, where=bytes_ref[2:2 + length])
+
+            _decoder_ = FixedLayoutDecoder([fixed_int("length", 0, "H"),
+                                            fixed_list("values", 2, "B", end=lambda obj, length: 2 + obj.length)])
+
+        descriptor = Descriptor()
+        self.assertEqual(Descriptor._decoder_.decode(descriptor, b"\xff\x00\x02\x05\x06\x07", 1, 6), 4)
+        self.assertEqual((descriptor.length, descriptor.values), (2, [5, 6]))
+        # too short: instruct unpacks it
+        self.assertIsNone(Descriptor._decoder_.decode(descriptor, b"\x00", 0, 1))
+        with self.assertRaises(InstructError):
+            descriptor.unpack(b"\x00")
+
+    def test_disable(self):
+        data = b"\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x02\x00" + b"\x00" * 20
+        self.assertTrue(compiled_decoders_enabled())
+        disable_compiled_decoders()
+        self.assertFalse(compiled_decoders_enabled())
+        self.assertEqual(ReportReadCapacityData16.create_from_string(data).block_length_in_bytes, 0x200)
+        enable_compiled_decoders()
+        self.assertEqual(ReportReadCapacityData16.create_from_string(data).block_length_in_bytes, 0x200)
+
+
+class LazyItem(FixedLayoutBuffer, Buffer):
+    length = be_uint_field(where=bytes_ref[0])
+    values = list_field(type=b_uint8, where=bytes_ref[1:1 + length])
+
+    _decoder_ = FixedLayoutDecoder([fixed_int("length", 0, "B"),
+                                    fixed_list("values", 1, "B", end=lambda obj, length: 1 + obj.length)])
+
+
+def get_lazy_item_size(buffer, offset, end):
+    size = 1 + bytearray(buffer[offset:offset + 1])[0]
+    return size if offset + size <= end else None
+
+
+@lazy_list_fields("items")
+class LazyPage(FixedLayoutBuffer, Buffer):
+    length = be_uint_field(where=bytes_ref[0:2])
+    items = list_field(type=LazyItem, where=bytes_ref[2:2 + length])
+
+    _decoder_ = FixedLayoutDecoder([fixed_int("length", 0, "H"),
+                                    fixed_lazy_list("items", 2, LazyItem, get_lazy_item_size,
+                                                    end=lambda obj, length: 2 + obj.length)])
+
+
+class LazyListTestCase(TestCase):
+    def test_lazy_list_field(self):
+        decoded = []
+
+        def decode_item(index):
+            decoded.append(index)
+            return index * 10
+
+        @lazy_list_fields("items")
+        class Page(Buffer):
+            items = list_field(type=b_uint8, where=bytes_ref[0:])
+
+        self.assertIs(Page.items, Page.__fields__[0])
+        page = Page()
+        self.assertIsNone(page.items)
+        page.items = LazyList(4, decode_item)
+        self.assertEqual(decoded, [])
+        self.assertEqual(page.items, [0, 10, 20, 30])
+        self.assertIs(page.items, page.items)
+        self.assertEqual(decoded, [0, 1, 2, 3])
+        page.items = [1, 2]
+        self.assertEqual(page.pack(), b"\x01\x02")
+
+    def test_fixed_lazy_list(self):
+        page = LazyPage()
+        self.assertEqual(page.unpack(bytearray(b"\x00\x05\x01\x07\x02\x08\x09")), 7)
+        self.assertIsInstance(vars(page)["items"], LazyList)
+        self.assertIsInstance(page.items, list)
+        self.assertEqual([item.values for item in page.items], [[7], [8, 9]])
+        # a malformed list is unpacked by instruct
+        page = LazyPage()
+        self.assertEqual(page.unpack(b"\x00\x04\x01\x07\x02\x08\x09"), 6)
+        self.assertIsInstance(vars(page)["items"], list)
+
+    def test_pickle_and_copy(self):
+        for copy_page in (lambda page: pickle.loads(pickle.dumps(page)), copy.deepcopy):
+            page = LazyPage()
+            page.unpack(b"\x00\x05\x01\x07\x02\x08\x09")
+            page_copy = copy_page(page)
+            self.assertIsInstance(vars(page_copy)["items"], list)
+            self.assertEqual([item.values for item in page_copy.items], [[7], [8, 9]])
+            self.assertEqual(page_copy.pack(), page.pack())
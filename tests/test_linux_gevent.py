@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+from unittest import TestCase, SkipTest
+from infi.asi import SCSIReadCommand
+from infi.asi.errors import AsiCheckConditionError
+from infi.asi.linux import LinuxCommandExecuter, SGIO
+
+RESPONSE_DELAY = 0.1
+
+
+class DelayedPipeIO(object):
+    """ an sg device that answers every SGIO header written to it with the same header after delay seconds, from
+    another thread, like a device completing commands in the background """
+    def __init__(self, delay=RESPONSE_DELAY, fail=False):
+        from infi.asi.unix import UnixFile
+        read_fd, self.write_fd = os.pipe()
+        self.file = UnixFile(read_fd)
+        self.fd = read_fd
+        self.delay = delay
+        self.fail = fail
+        self.timers = []
+
+    def write(self, buffer):
+        sgio = SGIO.from_string(bytes(buffer))
+        if self.fail:
+            sgio.status = 0x02
+        timer = threading.Timer(self.delay, os.write, (self.write_fd, sgio.to_raw()))
+        self.timers.append(timer)
+        timer.start()
+        return len(buffer)
+
+    def read(self, size):
+        return self.file.read(size)
+
+    def close(self):
+        for timer in self.timers:
+            timer.join()
+        self.file.close()
+        os.close(self.write_fd)
+
+
+def measure_hub_blocking(function):
+    """ runs function in a greenlet and returns (its result, the longest time the hub was blocked meanwhile) """
+    import gevent
+    gaps = []
+    greenlet = gevent.spawn(function)
+
+    def ticker():
+        last_tick = time.time()
+        while not greenlet.ready():
+            gevent.sleep(0.001)
+            gaps.append(time.time() - last_tick)
+            last_tick = time.time()
+
+    gevent.joinall([greenlet, gevent.spawn(ticker)])
+    return greenlet.get(), max(gaps)
+
+
+class GeventTestCase(TestCase):
+    def setUp(self):
+        try:
+            import gevent
+        except ImportError:
+            raise SkipTest("gevent is not installed")
+
+
+class GeventLinuxCommandExecuterTestCase(GeventTestCase):
+    def setUp(self):
+        super(GeventLinuxCommandExecuterTestCase, self).setUp()
+        self.io = DelayedPipeIO()
+
+    def tearDown(self):
+        self.io.close()
+
+    def call_many(self, executer, count):
+        import gevent
+        from infi.asi.coroutines.sync_adapter import sync_wait
+        greenlets = [gevent.spawn(lambda: sync_wait(executer.call(SCSIReadCommand(b"\x00" * 6, 0))))
+                     for i in range(count)]
+        gevent.joinall(greenlets, raise_error=True)
+        return [greenlet.get() for greenlet in greenlets]
+
+    def test_hub_is_not_blocked(self):
+        from infi.asi.linux_gevent import GeventLinuxCommandExecuter
+        executer = GeventLinuxCommandExecuter(self.io, max_queue_size=4)
+        start_time = time.time()
+        results, blocked = measure_hub_blocking(lambda: self.call_many(executer, 8))
+        self.assertEqual(results, [None] * 8)
+        self.assertLess(blocked, RESPONSE_DELAY / 2)
+        # two rounds of max_queue_size commands in flight
+        self.assertLess(time.time() - start_time, RESPONSE_DELAY * 4)
+        self.assertTrue(executer.is_queue_empty())
+
+    def test_blocking_executer_blocks_the_hub(self):
+        from infi.asi.coroutines.sync_adapter import sync_wait
+        executer = LinuxCommandExecuter(self.io)
+        results, blocked = measure_hub_blocking(lambda: sync_wait(executer.call(SCSIReadCommand(b"\x00" * 6, 0))))
+        self.assertGreaterEqual(blocked, RESPONSE_DELAY / 2)
+
+    def test_exception(self):
+        from infi.asi.linux_gevent import GeventLinuxCommandExecuter
+        from infi.asi.coroutines.sync_adapter import sync_execute
+        from infi.asi.cdb.tur import TestUnitReadyCommand
+        self.io.fail = True
+        executer = GeventLinuxCommandExecuter(self.io)
+        with self.assertRaises(AsiCheckConditionError):
+            sync_execute(TestUnitReadyCommand(), executer)
+        self.assertTrue(executer.is_queue_empty())
+
+
+class GeventIoctlCommandExecuterTestCase(GeventTestCase):
+    def test_ioctls_run_in_threadpool(self):
+        from infi.asi.linux_gevent import GeventIoctlCommandExecuter
+        import gevent
+
+        class SleepingIoctlCommandExecuter(GeventIoctlCommandExecuter):
+            def _ioctl(self, sgio):
+                time.sleep(RESPONSE_DELAY)
+
+        executer = SleepingIoctlCommandExecuter(io=None, max_queue_size=4)
+
+        def call_all():
+            from infi.asi.coroutines.sync_adapter import sync_execute
+            from infi.asi.cdb.tur import TestUnitReadyCommand
+            greenlets = [gevent.spawn(sync_execute, TestUnitReadyCommand(), executer) for i in range(4)]
+            gevent.joinall(greenlets, raise_error=True)
+            return [greenlet.get() for greenlet in greenlets]
+
+        start_time = time.time()
+        results, blocked = measure_hub_blocking(call_all)
+        self.assertEqual(results, [True] * 4)
+        self.assertLess(blocked, RESPONSE_DELAY / 2)
+        self.assertLess(time.time() - start_time, RESPONSE_DELAY * 2)
+        self.assertTrue(executer.is_queue_empty())
+
+    def test_close_leaves_threadpool_running(self):
+        from infi.asi.linux_gevent import GeventIoctlCommandExecuter
+        from gevent.threadpool import ThreadPool
+        threadpool = ThreadPool(1)
+        executer = GeventIoctlCommandExecuter(io=None, threadpool=threadpool)
+        self.assertIs(executer.pool.threadpool, threadpool)
+        executer.close()
+        self.assertEqual(threadpool.spawn(lambda: 1).get(), 1)
+        threadpool.kill()
@@ -0,0 +1,79 @@
+import threading
+import time
+from ctypes import memset
+from unittest import TestCase
+from infi.asi import SCSIReadCommand
+from infi.asi.coroutines.sync_adapter import sync_wait
+from infi.asi.linux import ThreadPoolIoctlCommandExecuter, IoctlThreadPool, SG_DXFER_FROM_DEV
+
+
+class FakeIoctlCommandExecuter(ThreadPoolIoctlCommandExecuter):
+    """ completes every SG_IO after delay seconds, filling read data with the first byte of the CDB """
+    def __init__(self, *args, **kwargs):
+        self.delay = kwargs.pop("delay", 0.01)
+        super(FakeIoctlCommandExecuter, self).__init__(None, *args, **kwargs)
+        self.lock = threading.Lock()
+        self.in_flight = self.max_in_flight = 0
+        self.log = []
+
+    def _ioctl(self, sgio):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        first_byte = bytearray(self.command_of(sgio))[0]
+        if first_byte == 0xff:
+            raise IOError("ioctl failed")
+        if sgio.dxfer_direction == SG_DXFER_FROM_DEV:
+            memset(sgio.dxferp, first_byte, sgio.dxfer_len)
+        with self.lock:
+            self.in_flight -= 1
+            self.log.append(first_byte)
+
+    @staticmethod
+    def command_of(sgio):
+        from ctypes import string_at
+        return string_at(sgio.cmdp, sgio.cmd_len)
+
+
+class ThreadPoolIoctlCommandExecuterTestCase(TestCase):
+    def test_commands_run_concurrently(self):
+        executer = FakeIoctlCommandExecuter(max_queue_size=8, delay=0.05)
+        callback_results = []
+        start = time.time()
+        for i in range(8):
+            sync_wait(executer.send(SCSIReadCommand(bytes(bytearray([i] * 6)), 4),
+                                    callback=lambda data, exception: callback_results.append(data)))
+        sync_wait(executer.wait())
+        self.assertLess(time.time() - start, 0.05 * 4)
+        self.assertEqual(executer.max_in_flight, 8)
+        self.assertEqual(sorted(callback_results), [bytes(bytearray([i] * 4)) for i in range(8)])
+        executer.close()
+
+    def test_call(self):
+        executer = FakeIoctlCommandExecuter(max_queue_size=2, delay=0)
+        self.assertEqual(sync_wait(executer.call(SCSIReadCommand(b"\x12" * 6, 3))), b"\x12" * 3)
+        executer.close()
+
+    def test_ioctl_error(self):
+        executer = FakeIoctlCommandExecuter(max_queue_size=2, delay=0)
+        with self.assertRaises(IOError):
+            sync_wait(executer.call(SCSIReadCommand(b"\xff" * 6, 3)))
+        self.assertTrue(executer.is_queue_empty())
+        executer.close()
+
+    def test_devices_are_served_round_robin(self):
+        pool = IoctlThreadPool(workers=1)
+        busy = FakeIoctlCommandExecuter(max_queue_size=8, delay=0.01, pool=pool)
+        idle = FakeIoctlCommandExecuter(max_queue_size=8, delay=0.01, pool=pool)
+        busy.log = idle.log = []
+        for i in range(8):
+            sync_wait(busy.send(SCSIReadCommand(b"\x01" * 6, 0), callback=lambda data, exception: None))
+        for i in range(2):
+            sync_wait(idle.send(SCSIReadCommand(b"\x02" * 6, 0), callback=lambda data, exception: None))
+        sync_wait(busy.wait())
+        sync_wait(idle.wait())
+        pool.close()
+        # the idle device's commands are not queued behind all of the busy device's commands
+        self.assertEqual(sorted(busy.log), [1] * 8 + [2] * 2)
+        self.assertEqual(busy.log[5:], [1] * 5)
@@ -23,3 +23,15 @@ class StorageModel_110(unittest.TestCase):
             response = [response for response in executer._os_receive()][1]
         error, packet_id = response
         self.assertIsInstance(error, AsiSCSIError)
+
+    def test_os_receive__task_set_full_and_busy(self):
+        from infi.asi.errors import AsiTaskSetFullError, AsiBusyError
+        for status, error_class in ((0x28, AsiTaskSetFullError), (0x08, AsiBusyError)):
+            io = Mock_SGIO()
+            io.status = status
+            executer = LinuxCommandExecuter(io)
+            with patch("infi.asi.linux.SGIO") as SGIO_:
+                SGIO_.from_string.return_value = io
+                response = [response for response in executer._os_receive()][1]
+            error, packet_id = response
+            self.assertIsInstance(error, error_class)
@@ -0,0 +1,336 @@
+import struct
+from ctypes import addressof, string_at, memset, memmove
+from unittest import TestCase
+from infi.asi import SCSIReadCommand, SCSIWriteCommand
+from infi.asi.errors import AsiCheckConditionError
+from infi.asi.coroutines.sync_adapter import sync_wait, sync_execute
+from infi.asi.linux import LinuxCommandExecuter, SGIO, SGIOVec, SG_DXFER_FROM_DEV, SG_DXFER_TO_DEV, SG_DXFER_NONE
+
+
+class LoopbackIO(object):
+    """ answers every SGIO header written to it with the same header, as if the command succeeded.
+    reads are answered with data_byte repeated over the whole transfer, less resid bytes, or, if response is given,
+    with it (and the rest of the transfer as resid).
+    if sense is given, every command completes with a check condition carrying it, and if status is given, with
+    that status """
+    def __init__(self, data_byte=0, resid=0, sense=None, status=None, response=None):
+        self.responses = []
+        self.data_byte = data_byte
+        self.resid = resid
+        self.sense = sense
+        self.status = status
+        self.response = response
+
+    def write(self, buffer):
+        sgio = SGIO.from_string(bytes(buffer))
+        if self.sense is not None:
+            memmove(sgio.sbp, self.sense, len(self.sense))
+            sgio.sb_len_wr = len(self.sense)
+            sgio.status = 0x02
+        elif self.status is not None:
+            sgio.status = self.status
+        elif sgio.dxfer_direction == SG_DXFER_FROM_DEV and self.response is not None:
+            length = min(len(self.response), sgio.dxfer_len)
+            memmove(sgio.dxferp, self.response, length)
+            sgio.resid = sgio.dxfer_len - length
+        elif sgio.dxfer_direction == SG_DXFER_FROM_DEV:
+            sgio.resid = min(self.resid, sgio.dxfer_len)
+            length = sgio.dxfer_len - sgio.resid
+            for address, size in self._segments(sgio):
+                memset(address, self.data_byte, min(size, length))
+                length -= min(size, length)
+        self.responses.append(sgio.to_raw())
+        return len(buffer)
+
+    def read(self, size):
+        return self.responses.pop(0)
+
+    @staticmethod
+    def _segments(sgio):
+        if sgio.iovec_count == 0:
+            return [(sgio.dxferp, sgio.dxfer_len)]
+        iovec = (SGIOVec * sgio.iovec_count).from_address(sgio.dxferp)
+        return [(item.iov_base, item.iov_len) for item in iovec]
+
+
+class FailingIO(object):
+    """ fails every write with the given errno, as the sg driver does when it rejects a command """
+    def __init__(self, error_number):
+        self.error_number = error_number
+
+    def write(self, buffer):
+        raise OSError(self.error_number, "write failed")
+
+
+class SGIOSlotTestCase(TestCase):
+    def setUp(self):
+        self.io = LoopbackIO()
+        self.executer = LinuxCommandExecuter(self.io, max_queue_size=2)
+
+    def test_slot_is_reused(self):
+        first = self.executer._os_prepare_to_send(SCSIReadCommand(b"\x12" * 6, 36), 1)
+        header_address = addressof(first)
+        sense_address, command_address, data_address = first.sbp, first.cmdp, first.dxferp
+        second = self.executer._os_prepare_to_send(SCSIReadCommand(b"\x25" * 10, 8), 1)
+        self.assertIs(first, second)
+        self.assertEqual(addressof(second), header_address)
+        self.assertEqual((second.sbp, second.cmdp, second.dxferp), (sense_address, command_address, data_address))
+        self.assertEqual(second.cmd_len, 10)
+        self.assertEqual(second.dxfer_len, 8)
+        self.assertEqual(second.pack_id, 1)
+
+    def test_slot_buffers_grow(self):
+        sgio = self.executer._os_prepare_to_send(SCSIReadCommand(b"\x12" * 6, 36), 0)
+        sgio.fill(SCSIWriteCommand(b"\x7f" * 32, b"\x01" * 4096))
+        self.assertEqual(sgio.cmd_len, 32)
+        self.assertEqual(string_at(sgio.cmdp, sgio.cmd_len), b"\x7f" * 32)
+        self.assertEqual(sgio.dxfer_direction, SG_DXFER_TO_DEV)
+        self.assertEqual(string_at(sgio.dxferp, sgio.dxfer_len), b"\x01" * 4096)
+        sgio.fill(SCSIReadCommand(b"\x00" * 6, 0))
+        self.assertEqual(sgio.dxfer_direction, SG_DXFER_NONE)
+        self.assertEqual((sgio.dxferp, sgio.dxfer_len), (None, 0))
+
+    def test_fill_resets_response_fields(self):
+        sgio = SGIO.allocate(0)
+        sgio.status = sgio.host_status = sgio.driver_status = sgio.resid = 7
+        sgio.fill(SCSIReadCommand(b"\x12" * 6, 36))
+        self.assertEqual((sgio.status, sgio.host_status, sgio.driver_status, sgio.resid), (0, 0, 0, 0))
+        self.assertEqual(sgio.dxfer_direction, SG_DXFER_FROM_DEV)
+        self.assertEqual(sgio.interface_id, ord('S'))
+
+    def test_call(self):
+        data = sync_wait(self.executer.call(SCSIReadCommand(b"\x12" * 6, 36)))
+        self.assertEqual(data, b"\x00" * 36)
+        data = sync_wait(self.executer.call(SCSIReadCommand(b"\x12" * 6, 8)))
+        self.assertEqual(len(data), 8)
+
+
+class ZeroCopyReadTestCase(TestCase):
+    def setUp(self):
+        self.executer = LinuxCommandExecuter(LoopbackIO(data_byte=0x5a))
+
+    def test_read_into_bytearray(self):
+        buffer = bytearray(1024)
+        data = sync_wait(self.executer.call(SCSIReadCommand(b"\x28" * 10, 512, buffer)))
+        self.assertIsInstance(data, memoryview)
+        self.assertEqual(len(data), 512)
+        self.assertEqual(bytes(buffer[:512]), b"\x5a" * 512)
+        self.assertEqual(bytes(buffer[512:]), b"\x00" * 512)
+        data.release()
+        buffer.extend(b"\x00")    # the buffer is no longer pinned once the command completed
+
+    def test_read_into_memoryview_slice(self):
+        buffer = bytearray(1024)
+        sync_wait(self.executer.call(SCSIReadCommand(b"\x28" * 10, 512, memoryview(buffer)[512:])))
+        self.assertEqual(bytes(buffer), b"\x00" * 512 + b"\x5a" * 512)
+
+    def test_read_command(self):
+        from infi.asi.cdb.read import Read16Command
+        buffer = bytearray(4096)
+        data = sync_wait(Read16Command(0, 8, buffer=buffer).execute(self.executer))
+        self.assertEqual(data.tobytes(), b"\x5a" * 4096)
+
+    def test_buffer_is_unpinned_after_failure(self):
+        sense = b"\x70\x00\x03\x00\x00\x00\x00\x0a\x00\x00\x00\x00\x11\x00\x00\x00\x00\x00"
+        executer = LinuxCommandExecuter(LoopbackIO(sense=sense))
+        buffer = bytearray(1024)
+        with self.assertRaises(AsiCheckConditionError):
+            sync_wait(executer.call(SCSIReadCommand(b"\x28" * 10, 512, buffer)))
+        buffer.extend(b"\x00")    # would raise BufferError if the executer still pinned the buffer
+        buffers = [bytearray(256), bytearray(256)]
+        with self.assertRaises(AsiCheckConditionError):
+            sync_wait(executer.call(SCSIReadCommand(b"\x28" * 10, 512, buffers)))
+        for buffer in buffers:
+            buffer.extend(b"\x00")
+
+    def test_read_only_buffer(self):
+        with self.assertRaises(TypeError):
+            sync_wait(self.executer.call(SCSIReadCommand(b"\x28" * 10, 512, b"\x00" * 512)))
+
+    def test_buffer_too_small(self):
+        with self.assertRaises(ValueError):
+            sync_wait(self.executer.call(SCSIReadCommand(b"\x28" * 10, 512, bytearray(511))))
+
+
+class ZeroCopyWriteTestCase(TestCase):
+    def setUp(self):
+        self.executer = LinuxCommandExecuter(LoopbackIO())
+
+    def test_bytearray_is_pinned(self):
+        from ctypes import c_char
+        data = bytearray(b"\x11" * 4096)
+        sgio = self.executer._os_prepare_to_send(SCSIWriteCommand(b"\x8a" * 16, data), 0)
+        self.assertEqual(sgio.dxferp, addressof((c_char * len(data)).from_buffer(data)))
+        self.assertEqual(sgio.dxfer_len, 4096)
+
+    def test_bytes_are_copied(self):
+        data = b"\x22" * 4096
+        sgio = self.executer._os_prepare_to_send(SCSIWriteCommand(b"\x8a" * 16, data), 0)
+        self.assertIs(sgio.pinned_buffer, None)
+        self.assertEqual(string_at(sgio.dxferp, sgio.dxfer_len), data)
+
+    def test_read_only_memoryview_is_copied(self):
+        data = memoryview(b"\x33" * 512)
+        sgio = self.executer._os_prepare_to_send(SCSIWriteCommand(b"\x2a" * 10, data), 0)
+        self.assertEqual(string_at(sgio.dxferp, sgio.dxfer_len), b"\x33" * 512)
+
+    def test_write_command(self):
+        import mmap
+        from infi.asi.cdb.write import Write16Command
+        data = mmap.mmap(-1, 4096)
+        data.write(b"\x44" * 4096)
+        sync_wait(Write16Command(0, data).execute(self.executer))
+        data.close()    # would raise BufferError if the executer still pinned the mmap
+
+    def test_buffer_is_unpinned_after_failure(self):
+        import mmap
+        from infi.asi.errors import AsiTaskSetFullError
+        sense = b"\x70\x00\x05\x00\x00\x00\x00\x0a\x00\x00\x00\x00\x24\x00\x00\x00\x00\x00"
+        for io, error_class in ((LoopbackIO(sense=sense), AsiCheckConditionError),
+                                (LoopbackIO(status=0x28), AsiTaskSetFullError)):
+            executer = LinuxCommandExecuter(io)
+            data = bytearray(b"\x11" * 512)
+            with self.assertRaises(error_class):
+                sync_wait(executer.call(SCSIWriteCommand(b"\x2a" * 10, data)))
+            data.extend(b"\x00")    # would raise BufferError if the executer still pinned the bytearray
+            data = mmap.mmap(-1, 4096)
+            with self.assertRaises(error_class):
+                sync_wait(executer.call(SCSIWriteCommand(b"\x2a" * 10, data)))
+            data.close()
+
+    def test_buffer_is_unpinned_when_sending_fails(self):
+        import errno
+        executer = LinuxCommandExecuter(FailingIO(errno.EIO))
+        data = bytearray(b"\x11" * 512)
+        with self.assertRaises(OSError):
+            sync_wait(executer.call(SCSIWriteCommand(b"\x2a" * 10, data)))
+        self.assertIs(executer.sgio_slots[0].pinned_buffer, None)
+        data.extend(b"\x00")    # would raise BufferError if the executer still pinned the bytearray
+        buffer = bytearray(512)
+        with self.assertRaises(OSError):
+            executer.call_sync(SCSIReadCommand(b"\x28" * 10, 512, buffer))
+        self.assertIs(executer.sgio_slots[0].user_buffer, None)
+        buffer.extend(b"\x00")
+        self.assertEqual(executer.pending_count, 0)
+
+
+class ResidualTestCase(TestCase):
+    def test_transferred_length(self):
+        executer = LinuxCommandExecuter(LoopbackIO(data_byte=0x5a, resid=200))
+        command = SCSIReadCommand(b"\x12" * 6, 255)
+        data = sync_wait(executer.call(command))
+        self.assertEqual(data, b"\x5a" * 55 + b"\x00" * 200)
+        self.assertEqual(command.transferred_length, 55)
+
+    def test_rest_of_reused_buffer_is_zeroed(self):
+        io = LoopbackIO(data_byte=0x5a)
+        executer = LinuxCommandExecuter(io)
+        sync_wait(executer.call(SCSIReadCommand(b"\x12" * 6, 255)))
+        io.resid = 250
+        self.assertEqual(sync_wait(executer.call(SCSIReadCommand(b"\x12" * 6, 255))), b"\x5a" * 5 + b"\x00" * 250)
+
+    def test_user_buffer_view_spans_allocation_length(self):
+        executer = LinuxCommandExecuter(LoopbackIO(data_byte=0x5a, resid=512))
+        command = SCSIReadCommand(b"\x28" * 10, 1024, bytearray(1024))
+        data = sync_wait(executer.call(command))
+        self.assertEqual(data.tobytes(), b"\x5a" * 512 + b"\x00" * 512)
+        self.assertEqual(command.transferred_length, 512)
+
+    def test_nothing_transferred(self):
+        executer = LinuxCommandExecuter(LoopbackIO(resid=36))
+        command = SCSIReadCommand(b"\x12" * 6, 36)
+        self.assertEqual(sync_wait(executer.call(command)), b"\x00" * 36)
+        self.assertEqual(command.transferred_length, 0)
+
+    def test_short_block_limits_page(self):
+        from infi.asi.cdb.inquiry.vpd_pages.block_limits import BlockLimitsPageCommand
+        # a 20-byte page (page length 0x10), which ends after the maximum prefetch length
+        page = struct.pack(">BBHBBHIII", 0, 0xb0, 0x10, 0, 8, 1, 2048, 1024, 4096)
+        executer = LinuxCommandExecuter(LoopbackIO(response=page))
+        result = sync_execute(BlockLimitsPageCommand(), executer)
+        self.assertEqual((result.page_length, result.maximum_transfer_length), (0x10, 2048))
+        self.assertEqual((result.maximum_prefetch_xdread_xdwrite_transfer_length, result.maximum_unmap_lba_count),
+                         (4096, 0))
+
+    def test_short_standard_inquiry(self):
+        from infi.asi.cdb.inquiry.standard import StandardInquiryCommand
+        # an older target returning the first 32 bytes, up to the product identification
+        data = struct.pack(">BBBBBBBB", 0, 0, 0x05, 0x02, 27, 0, 0, 0x02) + b"VENDOR  " + b"PRODUCT".ljust(16)
+        executer = LinuxCommandExecuter(LoopbackIO(response=data))
+        result = sync_execute(StandardInquiryCommand(allocation_length=96), executer)
+        self.assertEqual((result.t10_vendor_identification, result.product_identification), ("VENDOR", "PRODUCT"))
+        self.assertEqual(result.product_revision_level, "")
+
+    def test_short_report_luns(self):
+        from infi.asi.cdb.report_luns import ReportLunsCommand
+        # a header without the LUN list, for an allocation length too short for one LUN
+        executer = LinuxCommandExecuter(LoopbackIO(response=struct.pack(">I4x", 16)))
+        self.assertEqual(sync_execute(ReportLunsCommand(allocation_length=12), executer), struct.pack(">I8x", 16))
+
+    def test_sense_is_trimmed_to_sb_len_wr(self):
+        sense = b"\x70\x00\x05\x00\x00\x00\x00\x0a\x00\x00\x00\x00\x24\x00\x00\x00\x00\x00"
+        executer = LinuxCommandExecuter(LoopbackIO(sense=sense))
+        with self.assertRaises(AsiCheckConditionError) as context:
+            sync_wait(executer.call(SCSIReadCommand(b"\x12" * 6, 36)))
+        self.assertEqual(context.exception.sense_buffer, sense)
+        self.assertEqual(context.exception.sense_obj.sense_key, "ILLEGAL_REQUEST")
+
+    def test_short_fixed_sense(self):
+        executer = LinuxCommandExecuter(LoopbackIO(sense=b"\x70\x00\x06\x00\x00\x00\x00\x00"))
+        with self.assertRaises(AsiCheckConditionError) as context:
+            sync_wait(executer.call(SCSIReadCommand(b"\x12" * 6, 36)))
+        self.assertEqual(len(context.exception.sense_buffer), 8)
+        self.assertEqual(context.exception.sense_obj.sense_key, "UNIT_ATTENTION")
+
+
+class ScatterGatherTestCase(TestCase):
+    def setUp(self):
+        self.executer = LinuxCommandExecuter(LoopbackIO(data_byte=0x5a))
+
+    def _iovec(self, sgio):
+        return [(item.iov_base, item.iov_len) for item in (SGIOVec * sgio.iovec_count).from_address(sgio.dxferp)]
+
+    def test_gather_write(self):
+        from ctypes import c_char
+        first, second = bytearray(b"\x01" * 512), bytearray(b"\x02" * 1024)
+        sgio = self.executer._os_prepare_to_send(SCSIWriteCommand(b"\x8a" * 16, [first, second, b"\x03" * 512]), 0)
+        self.assertEqual(sgio.dxfer_direction, SG_DXFER_TO_DEV)
+        self.assertEqual((sgio.iovec_count, sgio.dxfer_len, sgio.flags), (3, 2048, 0))
+        iovec = self._iovec(sgio)
+        self.assertEqual(iovec[0], (addressof((c_char * 512).from_buffer(first)), 512))
+        self.assertEqual(iovec[1], (addressof((c_char * 1024).from_buffer(second)), 1024))
+        self.assertEqual(string_at(*iovec[2]), b"\x03" * 512)
+
+    def test_plain_command_after_scatter_gather(self):
+        sgio = self.executer._os_prepare_to_send(SCSIWriteCommand(b"\x8a" * 16, [b"\x00" * 512] * 2), 0)
+        sgio.fill(SCSIWriteCommand(b"\x8a" * 16, b"\x00" * 512))
+        self.assertEqual(sgio.iovec_count, 0)
+
+    def test_scatter_read(self):
+        buffers = [bytearray(512), bytearray(512), bytearray(512)]
+        views = sync_wait(self.executer.call(SCSIReadCommand(b"\x28" * 10, 1024, buffers)))
+        self.assertEqual([len(view) for view in views], [512, 512, 0])
+        self.assertEqual(buffers, [bytearray(b"\x5a" * 512)] * 2 + [bytearray(512)])
+        for view in views:
+            view.release()
+        for buffer in buffers:
+            buffer.extend(b"\x00")    # the buffers are no longer pinned once the command completed
+
+    def test_scatter_read_with_resid(self):
+        executer = LinuxCommandExecuter(LoopbackIO(data_byte=0x5a, resid=768))
+        buffers = [bytearray(512), bytearray(512)]
+        command = SCSIReadCommand(b"\x28" * 10, 1024, buffers)
+        views = sync_wait(executer.call(command))
+        self.assertEqual([len(view) for view in views], [512, 512])
+        self.assertEqual(bytes(buffers[0]), b"\x5a" * 256 + b"\x00" * 256)
+        self.assertEqual(command.transferred_length, 256)
+
+    def test_scatter_buffers_too_small(self):
+        with self.assertRaises(ValueError):
+            sync_wait(self.executer.call(SCSIReadCommand(b"\x28" * 10, 1024, [bytearray(512)])))
+
+    def test_write_command(self):
+        from infi.asi.cdb.write import Write16Command
+        command = Write16Command(0, [bytearray(512), bytearray(1024)])
+        self.assertEqual(command.transfer_length, 3)
+        sync_wait(command.execute(self.executer))
@@ -0,0 +1,180 @@
+import binascii
+from unittest import TestCase
+from infi.asi.metrics import Histogram, STATUS_GOOD, STATUS_CHECK_CONDITION, STATUS_BUSY
+from infi.asi import SCSIReadCommand
+from infi.asi.coroutines.sync_adapter import sync_wait, sync_execute
+from infi.asi.errors import AsiCheckConditionError, AsiBusyError
+from infi.asi.linux import LinuxCommandExecuter, SGIO
+
+ILLEGAL_REQUEST_SENSE = binascii.unhexlify("f00005000000000a00000000240000c00002")
+
+
+class HistogramTestCase(TestCase):
+    def test_buckets(self):
+        histogram = Histogram()
+        for value in (0, 1, 2, 3, 4, 1000, 1023.9):
+            histogram.record(value)
+        self.assertEqual(histogram.buckets(), [(0, 0, 1), (1, 1, 1), (2, 3, 2), (4, 7, 1), (512, 1023, 2)])
+        self.assertEqual((histogram.count, histogram.min, histogram.max), (7, 0, 1023))
+
+    def test_percentile(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.percentile(50))
+        for value in range(1, 101):
+            histogram.record(value)
+        self.assertEqual(histogram.percentile(50), 63)
+        self.assertEqual(histogram.percentile(99), 100)
+        self.assertEqual(histogram.mean, 50.5)
+
+    def test_huge_values(self):
+        histogram = Histogram()
+        histogram.record(1 << 80)
+        self.assertEqual(histogram.counts[-1], 1)
+
+    def test_merge(self):
+        first, second = Histogram(), Histogram()
+        first.record(5)
+        second.record(100)
+        first.merge(second)
+        self.assertEqual((first.count, first.min, first.max, first.total), (2, 5, 100, 105))
+
+
+class TimedLoopbackIO(object):
+    """ completes every command with the given kernel duration (in milliseconds); reads transfer the whole
+    allocation length less resid bytes """
+    def __init__(self, duration=7, resid=0):
+        self.responses = []
+        self.duration = duration
+        self.resid = resid
+        self.sense = None
+
+    def write(self, buffer):
+        from ctypes import memmove
+        sgio = SGIO.from_string(bytes(buffer))
+        sgio.duration = self.duration
+        sgio.resid = min(self.resid, sgio.dxfer_len)
+        if self.sense is not None:
+            memmove(sgio.sbp, self.sense, len(self.sense))
+            sgio.sb_len_wr = len(self.sense)
+            sgio.status = 0x02
+        self.responses.append(sgio.to_raw())
+        return len(buffer)
+
+    def read(self, size):
+        return self.responses.pop(0)
+
+
+class ExecuterMetricsTestCase(TestCase):
+    def setUp(self):
+        self.io = TimedLoopbackIO(resid=24)
+        self.executer = LinuxCommandExecuter(self.io)
+        self.metrics = self.executer.enable_metrics(device="sg1")
+
+    def test_disabled_by_default(self):
+        executer = LinuxCommandExecuter(TimedLoopbackIO())
+        self.assertIsNone(executer.metrics)
+        from infi.asi.cdb.tur import TestUnitReadyCommand
+        sync_wait(TestUnitReadyCommand().execute(executer))
+        self.assertFalse(executer._metrics_samples)
+
+    def test_linux_metrics(self):
+        from infi.asi.cdb.read import Read10Command
+        from infi.asi.cdb.tur import TestUnitReadyCommand
+        for i in range(3):
+            sync_wait(Read10Command(0, 1).execute(self.executer))
+        sync_wait(TestUnitReadyCommand().execute(self.executer))
+        self.io.sense = ILLEGAL_REQUEST_SENSE
+        with self.assertRaises(AsiCheckConditionError):
+            sync_wait(TestUnitReadyCommand().execute(self.executer))
+
+        read10 = self.metrics.get("sg1", 0x28)
+        self.assertEqual(read10.latency.count, 3)
+        self.assertEqual(read10.kernel_duration.min, 7000)
+        self.assertEqual(read10.transferred.total, 3 * (512 - 24))
+        self.assertEqual(read10.os_prepare_time.count, 3)
+        self.assertEqual(read10.os_parse_time.count, 3)
+        self.assertEqual(read10.statuses, {STATUS_GOOD: 3})
+        tur = self.metrics.get("sg1", 0x00)
+        self.assertEqual(tur.statuses, {STATUS_GOOD: 1, STATUS_CHECK_CONDITION: 1})
+        self.assertEqual(tur.transferred.max, 0)
+        self.assertEqual(self.metrics.get(device="sg1").latency.count, 5)
+        self.assertIsNone(self.metrics.get("sg2", 0x28))
+        self.assertEqual(set(self.metrics.snapshot()), set([("sg1", 0x28), ("sg1", 0x00)]))
+        self.assertFalse(self.executer._metrics_samples)
+
+    def test_shared_collector(self):
+        from infi.asi.cdb.tur import TestUnitReadyCommand
+        other = LinuxCommandExecuter(TimedLoopbackIO())
+        other.enable_metrics(self.metrics, device="sg2")
+        sync_wait(TestUnitReadyCommand().execute(self.executer))
+        sync_wait(TestUnitReadyCommand().execute(other))
+        self.assertEqual(self.metrics.get(opcode=0x00).latency.count, 2)
+        self.assertEqual(self.metrics.get("sg2", 0x00).latency.count, 1)
+
+    def test_generic_executer(self):
+        from infi.asi import SCSIReadCommand
+        from test_retry import ScriptedCommandExecuter
+        executer = ScriptedCommandExecuter([b"abcd", AsiBusyError()])
+        metrics = executer.enable_metrics()
+        self.assertEqual(sync_wait(executer.call(SCSIReadCommand(b"\x12" * 6, 36))), b"abcd")
+        with self.assertRaises(AsiBusyError):
+            sync_wait(executer.call(SCSIReadCommand(b"\x12" * 6, 36)))
+        inquiry = metrics.get(None, 0x12)
+        self.assertEqual(inquiry.statuses, {STATUS_GOOD: 1, STATUS_BUSY: 1})
+        self.assertEqual(inquiry.transferred.total, 4)
+        self.assertEqual(inquiry.kernel_duration.count, 0)
+
+
+class SteppingCommand(object):
+    """ advances clock by the given times before each of its commands and after the last one """
+    def __init__(self, clock, *times):
+        self.clock = clock
+        self.times = times
+
+    def execute(self, executer):
+        data = None
+        for elapsed in self.times[:-1]:
+            self.clock.now += elapsed
+            data = yield executer.call(SCSIReadCommand(b"\x12" * 6, 8))
+        self.clock.now += self.times[-1]
+        yield data
+
+
+class CDBTimesTestCase(TestCase):
+    def setUp(self):
+        from test_emulator import FakeClock
+        self.clock = FakeClock()
+        self.executer = LinuxCommandExecuter(TimedLoopbackIO(), max_queue_size=4)
+        self.metrics = self.executer.enable_metrics(device="sg1")
+        self.metrics.timer = self.clock.time
+
+    def test_sync_execute(self):
+        sync_execute(SteppingCommand(self.clock, 3, 5), self.executer)
+        inquiry = self.metrics.get("sg1", 0x12)
+        self.assertEqual((inquiry.pack_time.count, inquiry.pack_time.total), (1, 3000000))
+        self.assertEqual((inquiry.parse_time.count, inquiry.parse_time.total), (1, 5000000))
+
+    def test_map(self):
+        list(self.executer.map(SteppingCommand(self.clock, 1, 2) for i in range(10)))
+        inquiry = self.metrics.get("sg1", 0x12)
+        self.assertEqual((inquiry.pack_time.count, inquiry.pack_time.total), (10, 10000000))
+        self.assertEqual((inquiry.parse_time.count, inquiry.parse_time.total), (10, 20000000))
+        self.assertEqual(inquiry.latency.count, 10)
+
+    def test_several_commands(self):
+        sync_execute(SteppingCommand(self.clock, 1, 2, 4), self.executer)
+        inquiry = self.metrics.get("sg1", 0x12)
+        self.assertEqual((inquiry.pack_time.count, inquiry.pack_time.total), (1, 1000000))
+        self.assertEqual((inquiry.parse_time.count, inquiry.parse_time.total), (2, 6000000))
+
+    def test_failed_command(self):
+        self.executer.io.sense = ILLEGAL_REQUEST_SENSE
+        with self.assertRaises(AsiCheckConditionError):
+            sync_execute(SteppingCommand(self.clock, 3, 5), self.executer)
+        inquiry = self.metrics.get("sg1", 0x12)
+        self.assertEqual((inquiry.pack_time.total, inquiry.parse_time.count), (3000000, 1))
+
+    def test_not_timed_without_metrics(self):
+        self.executer.disable_metrics()
+        self.assertEqual(sync_execute(SteppingCommand(self.clock, 3, 5), self.executer), b"\x00" * 8)
+        self.assertEqual(self.metrics.commands, dict())
@@ -0,0 +1,59 @@
+from unittest import TestCase
+from infi.asi import SCSIReadCommand
+from infi.asi.errors import AsiRequestQueueFullError, AsiInternalError
+from infi.asi.coroutines.sync_adapter import sync_wait
+from test_pipeline import ReorderingCommandExecuter
+
+
+class PacketIndexTestCase(TestCase):
+    def test_deep_queue(self):
+        executer = ReorderingCommandExecuter(max_queue_size=4096)
+        for i in range(4096):
+            sync_wait(executer.send(SCSIReadCommand(b"x", 0), callback=lambda data, exception: None))
+        self.assertEqual(executer.pending_count, 4096)
+        self.assertTrue(executer.is_queue_full())
+        self.assertEqual(sorted(executer.pending_packets), list(range(4096)))
+        with self.assertRaises(AsiRequestQueueFullError):
+            executer._next_packet_index()
+        for i in range(100):
+            sync_wait(executer._process_pending_response())
+        self.assertEqual(executer.pending_count, 3996)
+        self.assertEqual(sorted(executer._next_packet_index() for i in range(100)), list(range(3996, 4096)))
+
+    def test_failed_prepare_frees_packet_index(self):
+        executer = ReorderingCommandExecuter(max_queue_size=1)
+        executer._os_prepare_to_send = lambda command, packet_index: 1 // 0
+        with self.assertRaises(ZeroDivisionError):
+            sync_wait(executer.send(SCSIReadCommand(b"x", 0)))
+        self.assertEqual(executer.pending_count, 0)
+        self.assertTrue(executer.is_queue_empty())
+
+    def test_unknown_packet_id(self):
+        executer = ReorderingCommandExecuter(max_queue_size=2)
+        sync_wait(executer.send(SCSIReadCommand(b"x", 0), callback=lambda data, exception: None))
+        executer.sent[0] = (7, b"x")
+        with self.assertRaises(AsiInternalError):
+            sync_wait(executer._process_pending_response())
+
+    def test_pending_packets_view(self):
+        executer = ReorderingCommandExecuter(max_queue_size=4)
+        pending_packets = executer.pending_packets
+        self.assertIs(executer.pending_packets, pending_packets)
+        self.assertEqual(dict(pending_packets), {})
+        callback = lambda data, exception: None
+        for value in (b"a", b"b"):
+            sync_wait(executer.send(SCSIReadCommand(value, 0), callback=callback))
+        self.assertEqual(len(pending_packets), 2)
+        self.assertEqual(dict(pending_packets), {0: ((0, b"a"), callback), 1: ((1, b"b"), callback)})
+        self.assertIn(1, pending_packets)
+        self.assertNotIn(2, pending_packets)
+        self.assertNotIn(7, pending_packets)
+        self.assertNotIn("0", pending_packets)
+        with self.assertRaises(KeyError):
+            pending_packets[2]
+        with self.assertRaises(TypeError):
+            pending_packets[2] = ((2, b"c"), callback)
+        with self.assertRaises(TypeError):
+            del pending_packets[0]
+        sync_wait(executer._process_pending_response())
+        self.assertEqual(list(pending_packets), [0])
@@ -0,0 +1,98 @@
+from unittest import TestCase
+from infi.asi import CommandExecuterBase, SCSIReadCommand, AsiException
+
+
+class ReorderingCommandExecuter(CommandExecuterBase):
+    """ completes the most recently sent command first; the response data is the command itself """
+    def __init__(self, max_queue_size):
+        super(ReorderingCommandExecuter, self).__init__(max_queue_size)
+        self.sent = []
+        self.max_in_flight = 0
+
+    def _os_prepare_to_send(self, command, packet_index):
+        return (packet_index, command.command)
+
+    def _os_send(self, os_data):
+        self.sent.append(os_data)
+        self.max_in_flight = max(self.max_in_flight, len(self.sent))
+        yield len(os_data[1])
+
+    def _os_receive(self):
+        packet_index, data = self.sent.pop()
+        if data == b"error":
+            yield (AsiException("error"), packet_index)
+        else:
+            yield (data, packet_index)
+
+
+class EchoCommand(object):
+    def __init__(self, *values):
+        self.values = values
+
+    def execute(self, executer):
+        results = []
+        for value in self.values:
+            result = yield executer.call(SCSIReadCommand(value, 0))
+            results.append(result)
+        yield results
+
+
+def echo_commands(count):
+    return [EchoCommand(str(i).encode("ascii")) for i in range(count)]
+
+
+class MapTestCase(TestCase):
+    def setUp(self):
+        self.executer = ReorderingCommandExecuter(max_queue_size=4)
+
+    def test_ordered(self):
+        results = list(self.executer.map(echo_commands(20)))
+        self.assertEqual(results, [[str(i).encode("ascii")] for i in range(20)])
+        self.assertEqual(self.executer.max_in_flight, 4)
+        self.assertTrue(self.executer.is_queue_empty())
+
+    def test_as_completed(self):
+        results = list(self.executer.as_completed(echo_commands(20)))
+        self.assertNotEqual(results, [[str(i).encode("ascii")] for i in range(20)])
+        self.assertEqual(sorted(results), sorted([[str(i).encode("ascii")] for i in range(20)]))
+
+    def test_depth(self):
+        list(self.executer.map(echo_commands(20), depth=2))
+        self.assertEqual(self.executer.max_in_flight, 2)
+
+    def test_cdbs_are_pulled_lazily(self):
+        pulled = []
+
+        def cdbs():
+            for i in range(100):
+                pulled.append(i)
+                yield EchoCommand(b"x")
+
+        results = self.executer.as_completed(cdbs())
+        next(results)
+        self.assertLessEqual(len(pulled), 5)
+        results.close()
+        self.assertTrue(self.executer.is_queue_empty())
+
+    def test_multi_step_commands(self):
+        results = list(self.executer.map([EchoCommand(b"a", b"b", b"c"), EchoCommand(b"d"), EchoCommand(b"e", b"f")]))
+        self.assertEqual(results, [[b"a", b"b", b"c"], [b"d"], [b"e", b"f"]])
+
+    def test_exception(self):
+        results = self.executer.map([EchoCommand(b"a"), EchoCommand(b"error"), EchoCommand(b"c")])
+        self.assertEqual(next(results), [b"a"])
+        with self.assertRaises(AsiException):
+            next(results)
+        self.assertTrue(self.executer.is_queue_empty())
+
+    def test_empty(self):
+        self.assertEqual(list(self.executer.map([])), [])
+
+    def test_packet_index_in_flight_is_not_reused(self):
+        from infi.asi.coroutines.sync_adapter import sync_wait
+        for value in (b"a", b"b"):
+            sync_wait(self.executer.send(SCSIReadCommand(value, 0), callback=lambda data, exception: None))
+        sync_wait(self.executer._process_pending_response())    # completes b"b", leaving packet 0 in flight
+        indices = [self.executer._next_packet_index() for i in range(3)]
+        self.assertNotIn(0, indices)
+
@@ -0,0 +1,107 @@
+from unittest import TestCase
+from infi.asi import CommandExecuterBase, SCSIReadCommand
+from infi.asi.errors import AsiTaskSetFullError, AsiBusyError
+from infi.asi.queue_depth import AdaptiveQueueDepth
+from infi.asi.coroutines.sync_adapter import sync_wait
+
+
+class LimitedCommandExecuter(CommandExecuterBase):
+    """ a target that answers TASK SET FULL to commands sent while `limit` commands are already in flight """
+    def __init__(self, max_queue_size, limit, error_class=AsiTaskSetFullError):
+        super(LimitedCommandExecuter, self).__init__(max_queue_size)
+        self.limit = limit
+        self.error_class = error_class
+        self.sent = []
+        self.rejected = 0
+
+    def _os_prepare_to_send(self, command, packet_index):
+        return (packet_index, command.command)
+
+    def _os_send(self, os_data):
+        accepted = len([item for item in self.sent if item[2]])
+        self.sent.append(os_data + (accepted < self.limit,))
+        yield len(os_data[1])
+
+    def _os_receive(self):
+        packet_index, data, accepted = self.sent.pop(0)
+        if not accepted:
+            self.rejected += 1
+            yield (self.error_class(), packet_index)
+        else:
+            yield (data, packet_index)
+
+
+class EchoCommand(object):
+    def __init__(self, value):
+        self.value = value
+
+    def execute(self, executer):
+        result = yield executer.call(SCSIReadCommand(self.value, 0))
+        yield result
+
+
+class AdaptiveQueueDepthTestCase(TestCase):
+    def test_additive_increase(self):
+        controller = AdaptiveQueueDepth(max_depth=8)
+        for i in range(1 + 2 + 3):
+            controller.on_success(0.001)
+        self.assertEqual(controller.depth, 4)
+
+    def test_max_depth(self):
+        controller = AdaptiveQueueDepth(max_depth=4)
+        for i in range(100):
+            controller.on_success(0.001)
+        self.assertEqual(controller.depth, 4)
+
+    def test_no_increase_when_latency_rises(self):
+        controller = AdaptiveQueueDepth(max_depth=8, initial_depth=4)
+        controller.on_success(0.001)
+        for i in range(100):
+            controller.on_success(0.01)
+        self.assertEqual(controller.depth, 4)
+
+    def test_multiplicative_decrease(self):
+        controller = AdaptiveQueueDepth(max_depth=32, initial_depth=16)
+        controller.on_congestion()
+        self.assertEqual(controller.depth, 8)
+        for i in range(10):
+            controller.on_congestion()
+        self.assertEqual((controller.depth, controller.congestion_count), (1, 11))
+
+
+class AdaptiveExecuterTestCase(TestCase):
+    def test_fixed_depth_by_default(self):
+        executer = LimitedCommandExecuter(max_queue_size=15, limit=15)
+        self.assertEqual(executer.get_queue_depth(), 15)
+
+    def test_converges_below_target_limit(self):
+        executer = LimitedCommandExecuter(max_queue_size=32, limit=6)
+        executer.enable_adaptive_queue_depth(AdaptiveQueueDepth(32, latency_threshold=float("inf")))
+        values = [str(i).encode("ascii") for i in range(500)]
+        results = list(executer.map(EchoCommand(value) for value in values))
+        self.assertEqual(results, values)
+        self.assertGreater(executer.rejected, 0)
+        self.assertLessEqual(executer.queue_depth_controller.depth, 7)
+        self.assertTrue(executer.is_queue_empty())
+
+    def test_busy_command_is_requeued(self):
+        executer = LimitedCommandExecuter(max_queue_size=4, limit=0, error_class=AsiBusyError)
+        executer.enable_adaptive_queue_depth(max_requeue_attempts=3)
+        with self.assertRaises(AsiBusyError):
+            sync_wait(executer.call(SCSIReadCommand(b"a", 0)))
+        self.assertEqual(executer.rejected, 4)
+        self.assertTrue(executer.is_queue_empty())
+        executer.limit = 1
+        self.assertEqual(sync_wait(executer.call(SCSIReadCommand(b"b", 0))), b"b")
+
+    def test_sent_commands_wait_for_the_queue_depth(self):
+        executer = LimitedCommandExecuter(max_queue_size=8, limit=8)
+        executer.enable_adaptive_queue_depth(AdaptiveQueueDepth(8, initial_depth=2, latency_threshold=0))
+        results = []
+        for value in (b"a", b"b", b"c", b"d"):
+            sync_wait(executer.send(SCSIReadCommand(value, 0), lambda data, exception: results.append(data)))
+        self.assertEqual(executer.pending_count, 2)
+        sync_wait(executer.wait())
+        self.assertEqual(results, [b"a", b"b", b"c", b"d"])
+        self.assertEqual(executer.rejected, 0)
+        self.assertTrue(executer.is_queue_empty())
@@ -0,0 +1,190 @@
+import os
+import select
+import struct
+import time
+from unittest import TestCase, SkipTest
+from infi.asi import CommandExecuterBase, SCSIReadCommand, AsiException
+from infi.asi.errors import AsiTaskSetFullError
+from infi.asi.retry import RetryPolicy, RetryRule, BUSY
+from infi.asi.unix import UnixFile
+from infi.asi.coroutines.sync_adapter import sync_wait
+
+
+class PipeCommandExecuter(CommandExecuterBase):
+    """ completes every command immediately by writing its packet id to a pipe; commands starting with 0xff fail,
+    and so do the first task_set_full commands, with TASK SET FULL """
+    def __init__(self):
+        super(PipeCommandExecuter, self).__init__()
+        read_fd, self.write_fd = os.pipe()
+        self.io = UnixFile(read_fd)
+        self.max_in_flight = 0
+        self.task_set_full = 0
+
+    def _os_prepare_to_send(self, command, packet_index):
+        return (packet_index, command.command[:1] == b"\xff")
+
+    def _os_send(self, os_data):
+        self.max_in_flight = max(self.max_in_flight, self.pending_count)
+        yield os.write(self.write_fd, struct.pack("BB", *os_data))
+
+    def _os_receive(self):
+        raw = yield self.io.read(2)
+        packet_id, failed = struct.unpack("BB", raw)
+        if self.task_set_full:
+            self.task_set_full -= 1
+            yield (AsiTaskSetFullError(), packet_id)
+        elif failed:
+            yield (AsiException("error"), packet_id)
+        else:
+            yield (packet_id, packet_id)
+
+    def close(self):
+        self.io.close()
+        os.close(self.write_fd)
+
+
+class DataPipeCommandExecuter(PipeCommandExecuter):
+    """ returns the packet ids as a byte of response data """
+    def _os_receive(self):
+        result, packet_id = yield super(DataPipeCommandExecuter, self)._os_receive()
+        yield (result if isinstance(result, Exception) else bytes(bytearray([result])), packet_id)
+
+
+class TwoStepCommand(object):
+    """ sends two commands one after the other and returns their packet ids """
+    def execute(self, executer):
+        first = yield executer.call(SCSIReadCommand(b"\x00" * 6, 0))
+        second = yield executer.call(SCSIReadCommand(b"\x00" * 6, 0))
+        yield (first, second)
+
+
+class FailingCommand(object):
+    def execute(self, executer):
+        result = yield executer.call(SCSIReadCommand(b"\xff" * 6, 0))
+        yield result
+
+
+class EpollReactorTestCase(TestCase):
+    def setUp(self):
+        if not hasattr(select, "epoll"):
+            raise SkipTest()
+        from infi.asi.reactor import EpollReactor
+        self.reactor = EpollReactor()
+        self.executers = [PipeCommandExecuter() for i in range(3)]
+        for executer in self.executers:
+            self.reactor.register(executer)
+
+    def tearDown(self):
+        self.reactor.close()
+        for executer in self.executers:
+            executer.close()
+
+    def test_wait_dispatches_all_callbacks(self):
+        results = []
+        for executer in self.executers:
+            for i in range(4):
+                callback = lambda data, exception, executer=executer: results.append((executer, data, exception))
+                sync_wait(executer.send(SCSIReadCommand(b"\x00" * 6, 0), callback=callback))
+        self.assertFalse(self.reactor.is_idle())
+        self.reactor.wait(timeout=5)
+        self.assertTrue(self.reactor.is_idle())
+        self.assertEqual(len(results), 12)
+        for executer in self.executers:
+            self.assertEqual(sorted(data for owner, data, exception in results if owner is executer), [0, 1, 2, 3])
+
+    def test_poll_with_nothing_pending(self):
+        self.assertEqual(self.reactor.poll(0), 0)
+
+    def test_register_twice(self):
+        from infi.asi import AsiException
+        with self.assertRaises(AsiException):
+            self.reactor.register(self.executers[0])
+
+    def test_unregister(self):
+        self.reactor.unregister(self.executers[0])
+        self.assertEqual(len(self.reactor.get_executers()), 2)
+
+
+class EpollReactorJobsTestCase(TestCase):
+    def setUp(self):
+        if not hasattr(select, "epoll"):
+            raise SkipTest()
+        from infi.asi.reactor import EpollReactor
+        self.reactor = EpollReactor()
+        self.executers = [PipeCommandExecuter() for i in range(4)]
+
+    def tearDown(self):
+        self.reactor.close()
+        for executer in self.executers:
+            executer.close()
+
+    def test_as_completed(self):
+        jobs = [self.reactor.submit(executer, TwoStepCommand()) for executer in self.executers for i in range(10)]
+        completed = list(self.reactor.as_completed(timeout=5))
+        self.assertEqual(sorted(completed, key=id), sorted(jobs, key=id))
+        for job in jobs:
+            self.assertTrue(job.done)
+            self.assertEqual(len(job.get_result()), 2)
+        self.assertTrue(self.reactor.is_idle())
+
+    def test_max_in_flight(self):
+        self.reactor.register(self.executers[0], max_in_flight=3)
+        for i in range(20):
+            self.reactor.submit(self.executers[0], TwoStepCommand())
+        self.reactor.wait(timeout=5)
+        self.assertEqual(self.executers[0].max_in_flight, 3)
+        self.assertEqual(len(list(self.reactor.as_completed())), 20)
+
+    def test_wait_for(self):
+        jobs = [self.reactor.submit(executer, TwoStepCommand()) for executer in self.executers]
+        results = self.reactor.wait_for(*jobs, timeout=5)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(list(self.reactor.as_completed()), [])
+
+    def test_exception(self):
+        job = self.reactor.submit(self.executers[0], FailingCommand())
+        other = self.reactor.submit(self.executers[1], TwoStepCommand())
+        self.assertEqual(set(self.reactor.as_completed(timeout=5)), set([job, other]))
+        self.assertIsInstance(job.exception, AsiException)
+        with self.assertRaises(AsiException):
+            job.get_result()
+        other.get_result()
+
+    def test_task_set_full_command_is_sent_again(self):
+        executer = self.executers[0]
+        executer.enable_adaptive_queue_depth()
+        executer.task_set_full = 2
+        job = self.reactor.submit(executer, TwoStepCommand())
+        self.assertEqual(self.reactor.wait_for(job, timeout=5), [(0, 0)])
+        self.assertEqual(executer.queue_depth_controller.congestion_count, 2)
+        self.assertTrue(executer.is_queue_empty())
+
+    def test_cdb_times(self):
+        from test_emulator import FakeClock
+        from test_metrics import SteppingCommand
+        clock = FakeClock()
+        executer = DataPipeCommandExecuter()
+        self.executers.append(executer)
+        metrics = executer.enable_metrics()
+        metrics.timer = clock.time
+        jobs = [self.reactor.submit(executer, SteppingCommand(clock, 1, 2)) for i in range(5)]
+        self.reactor.wait_for(*jobs, timeout=5)
+        command = metrics.get(opcode=0x12)
+        self.assertEqual((command.pack_time.count, command.pack_time.total), (5, 5000000))
+        self.assertEqual((command.parse_time.count, command.parse_time.total), (5, 10000000))
+
+    def test_other_devices_run_while_retrying(self):
+        busy, other = self.executers[:2]
+        busy.retry_policy = RetryPolicy({BUSY: RetryRule(max_retries=1, delay=0.2)})
+        busy.task_set_full = 1
+        start = time.time()
+        busy_job = self.reactor.submit(busy, TwoStepCommand())
+        other_job = self.reactor.submit(other, TwoStepCommand())
+        completed = []
+        for job in self.reactor.as_completed(timeout=5):
+            completed.append((job, time.time() - start))
+        self.assertEqual([job for job, elapsed in completed], [other_job, busy_job])
+        self.assertLess(completed[0][1], 0.2)
+        self.assertGreaterEqual(completed[1][1], 0.2)
+        self.assertEqual(busy_job.get_result(), (0, 0))
+        self.assertEqual(busy.retry_policy.retries, {BUSY: 1})
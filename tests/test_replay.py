@@ -0,0 +1,109 @@
+import binascii
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from infi.asi import SCSIReadCommand
+from infi.asi.errors import AsiCheckConditionError, AsiBusyError
+from infi.asi.coroutines.sync_adapter import sync_wait, sync_execute
+from infi.asi.replay import RecordingCommandExecuter, ReplayCommandExecuter, AsiReplayMissError, read_trace
+from infi.asi.replay import DIRECTION_READ, DIRECTION_WRITE, KIND_DATA, KIND_CHECK_CONDITION, KIND_ERROR
+
+ILLEGAL_REQUEST_SENSE = binascii.unhexlify("f00005000000000a00000000240000c00002")
+
+
+class ReplayTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "test.trace")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record_linux_commands(self):
+        from infi.asi.cdb.read import Read10Command
+        from infi.asi.cdb.write import Write10Command
+        from infi.asi.cdb.tur import TestUnitReadyCommand
+        from infi.asi.linux import LinuxCommandExecuter
+        from test_linux_sgio import LoopbackIO
+        io = LoopbackIO(data_byte=0x5a, resid=12)
+        with RecordingCommandExecuter(LinuxCommandExecuter(io), self.path) as recorder:
+            self.assertEqual(sync_wait(Read10Command(0, 1).execute(recorder)), b"\x5a" * 500 + b"\x00" * 12)
+            sync_wait(Write10Command(8, b"\x01" * 512).execute(recorder))
+            io.sense = ILLEGAL_REQUEST_SENSE
+            with self.assertRaises(AsiCheckConditionError):
+                sync_execute(TestUnitReadyCommand(), recorder)
+
+    def test_trace_records(self):
+        self.record_linux_commands()
+        records = list(read_trace(self.path))
+        self.assertEqual([(record.direction, record.kind) for record in records],
+                         [(DIRECTION_READ, KIND_DATA), (DIRECTION_WRITE, KIND_DATA),
+                          (DIRECTION_READ, KIND_CHECK_CONDITION)])
+        self.assertEqual(bytearray(records[0].cdb)[0], 0x28)
+        self.assertEqual(records[0].response_data, b"\x5a" * 500)
+        self.assertEqual(records[1].request_data, b"\x01" * 512)
+        self.assertEqual(records[2].sense, ILLEGAL_REQUEST_SENSE)
+
+    def test_replay(self):
+        from infi.asi.cdb.read import Read10Command
+        from infi.asi.cdb.write import Write10Command
+        from infi.asi.cdb.tur import TestUnitReadyCommand
+        self.record_linux_commands()
+        replayer = ReplayCommandExecuter(self.path)
+        try:
+            for i in range(3):
+                self.assertEqual(sync_execute(Read10Command(0, 1), replayer), b"\x5a" * 500 + b"\x00" * 12)
+            self.assertEqual(list(replayer.map([Read10Command(0, 1)] * 5)), [b"\x5a" * 500 + b"\x00" * 12] * 5)
+            sync_wait(Write10Command(8, b"\x01" * 512).execute(replayer))
+            with self.assertRaises(AsiCheckConditionError):
+                sync_execute(TestUnitReadyCommand(), replayer)
+            with self.assertRaises(AsiReplayMissError):
+                sync_execute(Read10Command(1, 1), replayer)
+            self.assertTrue(replayer.is_queue_empty())
+        finally:
+            replayer.close()
+
+    def test_replay_into_buffers(self):
+        from infi.asi.cdb.read import Read10Command
+        self.record_linux_commands()
+        replayer = ReplayCommandExecuter(self.path)
+        buffer = bytearray(512)
+        command = SCSIReadCommand(Read10Command(0, 1).create_datagram(), 512, buffer)
+        view = replayer.call_sync(command)
+        self.assertEqual(len(view), 512)
+        self.assertEqual(buffer, b"\x5a" * 500 + b"\x00" * 12)
+        self.assertEqual(command.transferred_length, 500)
+        view.release()
+        buffers = [bytearray(256), bytearray(256)]
+        views = replayer.call_sync(SCSIReadCommand(command.command, 512, buffers))
+        self.assertEqual([len(view) for view in views], [256, 256])
+        self.assertEqual(buffers[1], b"\x5a" * 244 + b"\x00" * 12)
+        replayer.close()
+
+    def test_responses_in_recorded_order(self):
+        from test_retry import ScriptedCommandExecuter
+        command = SCSIReadCommand(b"\x12" * 6, 36)
+        recorder = RecordingCommandExecuter(ScriptedCommandExecuter([AsiBusyError(), b"first", b"second"]), self.path)
+        with self.assertRaises(AsiBusyError):
+            sync_wait(recorder.call(command))
+        self.assertEqual(sync_wait(recorder.call(command)), b"first")
+        self.assertEqual(recorder.call_sync(command), b"second")
+        recorder.close()
+        self.assertEqual([record.kind for record in read_trace(self.path)], [KIND_ERROR, KIND_DATA, KIND_DATA])
+
+        replayer = ReplayCommandExecuter(self.path)
+        with self.assertRaises(AsiBusyError):
+            replayer.call_sync(command)
+        self.assertEqual(replayer.call_sync(command), b"first".ljust(36, b"\x00"))
+        self.assertEqual(replayer.call_sync(command), b"second".ljust(36, b"\x00"))
+        with self.assertRaises(AsiBusyError):
+            replayer.call_sync(command)
+        replayer.close()
+
+    def test_appends_to_existing_trace(self):
+        from test_retry import ScriptedCommandExecuter
+        for response in (b"a", b"b"):
+            with RecordingCommandExecuter(ScriptedCommandExecuter([response]), self.path) as recorder:
+                sync_wait(recorder.call(SCSIReadCommand(b"\x12" * 6, 36)))
+        self.assertEqual([record.response_data for record in read_trace(self.path)], [b"a", b"b"])
@@ -22,3 +22,37 @@ def test_report_luns_data():
    from infi.asi.cdb.report_luns import ReportLunsData
    data = ReportLunsData.create_from_string(DATA)
    assert data.lun_list == [i for i in range(0,43)]
+
+def test_report_luns_data_lun_list_is_a_list():
+    import json
+    import pickle
+    import struct
+    from infi.asi.cdb.report_luns import ReportLunsData
+    raw = struct.pack(">I4x", 8 * 4) + b"".join(struct.pack(">H6x", lun) for lun in (0, 1, 2, 7))
+    data = ReportLunsData.create_from_string(raw)
+    assert isinstance(data.lun_list, list)
+    assert data.lun_list[-1] == 7 << 48
+    data.hex_lun_list = [hex(lun) for lun in data.lun_list]
+    data.normalize_lun_list()
+    assert data.lun_list == [0, 1, 2, 7]
+    assert data.lun_list + [8] == [0, 1, 2, 7, 8]
+    assert json.loads(json.dumps(data.hex_lun_list)) == data.hex_lun_list
+    copy = pickle.loads(pickle.dumps(data))
+    assert copy.lun_list == [0, 1, 2, 7] and copy.hex_lun_list == data.hex_lun_list
+    assert ReportLunsData.write_to_string(ReportLunsData.create_from_string(DATA)) == DATA
+
+def test_report_luns_data_with_unsupported_addressing_format():
+    import struct
+    from infi.asi.cdb.report_luns import ReportLunsData, UnsupportedLunAdressing, UnsupportedLogicalUnitAddressingMethod
+    for lun, error_class in ((0x0001000000000001, UnsupportedLunAdressing),
+                             (0x4001000000000000, UnsupportedLogicalUnitAddressingMethod)):
+        raw = struct.pack(">I4xQQ", 16, 0, lun)
+        try:
+            ReportLunsData.create_from_string(raw).normalize_lun_list()
+        except error_class as error:
+            assert error.args == (lun, )
+        else:
+            assert False, "no error raised"
+        data = ReportLunsData.create_from_string(raw)
+        data.normalize_lun_list(allow_unsupported_addressing_format=True)
+        assert data.lun_list == [0, lun >> 48]
@@ -0,0 +1,92 @@
+import binascii
+from unittest import TestCase
+from infi.asi import CommandExecuterBase, SCSIReadCommand
+from infi.asi.errors import AsiBusyError, AsiReservationConflictError, AsiCheckConditionError
+from infi.asi.retry import RetryPolicy, RetryRule, UNIT_ATTENTION, BECOMING_READY, BUSY
+from infi.asi.coroutines.sync_adapter import sync_wait
+
+UNIT_ATTENTION_SENSE = binascii.unhexlify("700006000000000A00000000290200000000")
+BECOMING_READY_SENSE = binascii.unhexlify("700002000000000A00000000040100000000")
+MEDIUM_NOT_PRESENT_SENSE = binascii.unhexlify("f00002000000000a000000003a00000000")
+ILLEGAL_REQUEST_SENSE = binascii.unhexlify("f00005000000000a00000000240000c00002")
+
+
+class ScriptedCommandExecuter(CommandExecuterBase):
+    """ answers the commands sent to it with the given responses in order; strings of sense data become check
+    conditions, exception instances are returned as is and anything else is the response data """
+    def __init__(self, responses, **kwargs):
+        super(ScriptedCommandExecuter, self).__init__(**kwargs)
+        self.responses = list(responses)
+        self.sent_commands = []
+        self.in_flight = []
+
+    def _os_prepare_to_send(self, command, packet_index):
+        self.sent_commands.append(command)
+        return packet_index
+
+    def _os_send(self, os_data):
+        self.in_flight.append(os_data)
+        yield
+
+    def _os_receive(self):
+        packet_index = self.in_flight.pop(0)
+        response = self.responses.pop(0)
+        if isinstance(response, bytes) and response[:1] in (b"\x70", b"\xf0"):
+            response = self._check_condition(response)
+        yield (response, packet_index)
+
+
+class RetryPolicyTestCase(TestCase):
+    def setUp(self):
+        self.delays = []
+        self.policy = RetryPolicy(sleep=self.delays.append)
+
+    def test_classify(self):
+        executer = ScriptedCommandExecuter([])
+        self.assertEqual(self.policy.classify(executer._check_condition(UNIT_ATTENTION_SENSE)), UNIT_ATTENTION)
+        self.assertEqual(self.policy.classify(executer._check_condition(BECOMING_READY_SENSE)), BECOMING_READY)
+        self.assertEqual(self.policy.classify(AsiBusyError()), BUSY)
+        self.assertIsNone(self.policy.classify(executer._check_condition(MEDIUM_NOT_PRESENT_SENSE)))
+        self.assertIsNone(self.policy.classify(executer._check_condition(ILLEGAL_REQUEST_SENSE)))
+        self.assertIsNone(self.policy.classify(IOError()))
+
+    def test_call_retries_the_same_command(self):
+        executer = ScriptedCommandExecuter([UNIT_ATTENTION_SENSE, BECOMING_READY_SENSE, BECOMING_READY_SENSE, b"ok"],
+                                           retry_policy=self.policy)
+        command = SCSIReadCommand(b"\x12" * 6, 36)
+        self.assertEqual(sync_wait(executer.call(command)), b"ok")
+        self.assertEqual(executer.sent_commands, [command] * 4)
+        self.assertEqual(self.delays, [0.5, 0.75])
+        self.assertEqual(self.policy.retries, {UNIT_ATTENTION: 1, BECOMING_READY: 2})
+
+    def test_budget_is_per_class(self):
+        policy = RetryPolicy({BUSY: RetryRule(max_retries=2)}, sleep=self.delays.append)
+        executer = ScriptedCommandExecuter([AsiBusyError(), AsiBusyError(), AsiBusyError()], retry_policy=policy)
+        with self.assertRaises(AsiBusyError):
+            sync_wait(executer.call(SCSIReadCommand(b"\x12" * 6, 36)))
+        self.assertEqual(len(executer.sent_commands), 3)
+        self.assertEqual(policy.exhausted, {BUSY: 1})
+
+    def test_disabled_class(self):
+        policy = RetryPolicy({UNIT_ATTENTION: None}, sleep=self.delays.append)
+        executer = ScriptedCommandExecuter([UNIT_ATTENTION_SENSE], retry_policy=policy)
+        with self.assertRaises(AsiCheckConditionError):
+            sync_wait(executer.call(SCSIReadCommand(b"\x12" * 6, 36)))
+
+    def test_no_retry_without_policy(self):
+        executer = ScriptedCommandExecuter([AsiReservationConflictError()])
+        with self.assertRaises(AsiReservationConflictError):
+            sync_wait(executer.call(SCSIReadCommand(b"\x12" * 6, 36)))
+
+    def test_map_retries(self):
+        from infi.asi.cdb.tur import TestUnitReadyCommand
+        executer = ScriptedCommandExecuter([UNIT_ATTENTION_SENSE, None, None], retry_policy=self.policy)
+        self.assertEqual(list(executer.map([TestUnitReadyCommand(), TestUnitReadyCommand()])), [True, True])
+        self.assertEqual(self.policy.retries, {UNIT_ATTENTION: 1})
+
+    def test_map_waits_for_retry_delays(self):
+        from infi.asi.cdb.tur import TestUnitReadyCommand
+        executer = ScriptedCommandExecuter([AsiBusyError(), None, None], retry_policy=self.policy)
+        self.assertEqual(list(executer.map([TestUnitReadyCommand(), TestUnitReadyCommand()])), [True, True])
+        self.assertEqual(self.delays, [0.01])
+        self.assertEqual(self.policy.retries, {BUSY: 1})
@@ -0,0 +1,82 @@
+import binascii
+import os
+import struct
+from unittest import TestCase
+from infi.asi import CommandExecuterBase
+from infi.asi.errors import AsiCheckConditionError
+from infi.asi.unix import UnixFile
+from infi.asi.scanner import scan, scan_chunk, ScanRecord
+
+STANDARD_INQUIRY = b"\x00\x00\x05\x02\x1f\x00\x00\x00" + b"NFINIDATInfiniBox       1.0 "
+SERIAL_NUMBER_PAGE = b"\x00\x80\x00\x04" + b"1234"
+DEVICE_IDENTIFICATION_PAGE = binascii.unhexlify(
+    "00830024010300106000402001f45eb566d41cd10000000001140004000000010115000400000001")
+CHECK_CONDITION_SENSE = b"\x70\x00\x05\x00\x00\x00\x00\x0a\x00\x00\x00\x00\x24\x00\x00\x00\x00\x00"
+
+
+class CannedCommandExecuter(CommandExecuterBase):
+    """ answers INQUIRY commands with canned data through a pipe; path "no-vpd" doesn't support VPD pages """
+    def __init__(self, path):
+        super(CannedCommandExecuter, self).__init__()
+        self.path = path
+        read_fd, self.write_fd = os.pipe()
+        self.io = UnixFile(read_fd)
+        self.responses = dict()
+
+    def _response(self, cdb):
+        cdb = bytearray(cdb)
+        if cdb[1] & 1 == 0:
+            return STANDARD_INQUIRY
+        if self.path == "no-vpd":
+            return self._check_condition(CHECK_CONDITION_SENSE)
+        if self.path == "broken":
+            return AsiCheckConditionError(CHECK_CONDITION_SENSE, None)
+        return {0x80: SERIAL_NUMBER_PAGE, 0x83: DEVICE_IDENTIFICATION_PAGE}[cdb[2]]
+
+    def _os_prepare_to_send(self, command, packet_index):
+        self.responses[packet_index] = self._response(command.command)
+        return packet_index
+
+    def _os_send(self, os_data):
+        yield os.write(self.write_fd, struct.pack("B", os_data))
+
+    def _os_receive(self):
+        packet_id = struct.unpack("B", (yield self.io.read(1)))[0]
+        if self.path == "broken" and isinstance(self.responses[packet_id], bytes):
+            yield (IOError("device is gone"), packet_id)
+        else:
+            yield (self.responses.pop(packet_id), packet_id)
+
+    def close(self):
+        os.close(self.write_fd)
+
+
+def canned_executer_factory(path):
+    if path == "missing":
+        raise OSError("no such device")
+    return CannedCommandExecuter(path)
+
+
+class ScannerTestCase(TestCase):
+    def test_scan_chunk(self):
+        records = dict((record.path, record) for record in
+                       scan_chunk(["sda", "no-vpd", "missing", "broken"], canned_executer_factory))
+        self.assertEqual(records["sda"], ScanRecord(
+            path="sda", peripheral_device_type=0, vendor_id="NFINIDAT", product_id="InfiniBox", revision="1.0",
+            serial_number="1234", designators=((3, 0, "6000402001f45eb566d41cd100000000"), (4, 1, "00000001"),
+                                               (5, 1, "00000001")), error=None))
+        self.assertEqual((records["no-vpd"].serial_number, records["no-vpd"].designators), (None, ()))
+        self.assertIsNone(records["no-vpd"].error)
+        self.assertIn("no such device", records["missing"].error)
+        self.assertIn("device is gone", records["broken"].error)
+
+    def test_scan_in_process(self):
+        paths = ["sd{}".format(i) for i in range(10)] + ["missing"]
+        records = list(scan(paths, workers=0, chunk_size=3, executer_factory=canned_executer_factory))
+        self.assertEqual(sorted(record.path for record in records), sorted(paths))
+
+    def test_scan_with_pool(self):
+        paths = ["sd{}".format(i) for i in range(20)] + ["missing", "broken"]
+        records = list(scan(iter(paths), workers=2, chunk_size=4, executer_factory=canned_executer_factory))
+        self.assertEqual(sorted(record.path for record in records), sorted(paths))
+        self.assertEqual(len([record for record in records if record.error is not None]), 2)
@@ -1,4 +1,5 @@
-from infi.asi.coroutines.sync_adapter import sync_wait
+from infi.asi import CommandExecuterBase, SCSIReadCommand, AsiException
+from infi.asi.coroutines.sync_adapter import sync_wait, sync_call, sync_execute
 
 def test_simple_coroutines():
     def bar():
@@ -46,3 +47,94 @@ def test_using_generator():
 
     res = sync_wait(foo())
     assert res == 10
+
+
+def test_sync_call_creates_generator_once():
+    calls = []
+
+    def foo(value):
+        calls.append(value)
+        yield value
+
+    assert sync_call(foo, 3) == 3
+    assert calls == [3]
+
+
+class EchoCommandExecuter(CommandExecuterBase):
+    """ the response data of a command is the command itself, b"error" fails """
+    def __init__(self):
+        super(EchoCommandExecuter, self).__init__(max_queue_size=1)
+        self.in_flight = []
+
+    def _os_prepare_to_send(self, command, packet_index):
+        return (packet_index, command.command)
+
+    def _os_send_sync(self, os_data):
+        self.in_flight.append(os_data)
+
+    def _os_receive_sync(self):
+        packet_index, data = self.in_flight.pop()
+        return (AsiException(data) if data == b"error" else data, packet_index)
+
+    def _os_send(self, os_data):
+        yield self._os_send_sync(os_data)
+
+    def _os_receive(self):
+        yield self._os_receive_sync()
+
+
+class EchoCDB(object):
+    def __init__(self, *values):
+        self.values = values
+
+    def _call(self, executer, value):
+        try:
+            result = yield executer.call(SCSIReadCommand(value, 0))
+        except AsiException:
+            result = None
+        yield result
+
+    def execute(self, executer):
+        results = []
+        for value in self.values:
+            result = yield self._call(executer, value)
+            results.append(result)
+        yield results
+
+
+def test_sync_execute_matches_sync_wait():
+    executer = EchoCommandExecuter()
+    cdb = EchoCDB(b"a", b"error", b"c")
+    assert sync_execute(cdb, executer) == sync_wait(cdb.execute(executer)) == [b"a", None, b"c"]
+    assert executer.is_queue_empty()
+
+
+def test_sync_execute_does_not_use_coroutines():
+    executer = EchoCommandExecuter()
+    executer._os_send = executer._os_receive = None
+    assert sync_execute(EchoCDB(b"a", b"b"), executer) == [b"a", b"b"]
+
+
+def test_sync_execute_raises_uncaught_exception():
+    import pytest
+
+    class FailingCDB(object):
+        def execute(self, executer):
+            yield executer.call(SCSIReadCommand(b"error", 0))
+            yield "unreachable"
+
+    executer = EchoCommandExecuter()
+    with pytest.raises(AsiException):
+        sync_execute(FailingCDB(), executer)
+    assert executer.is_queue_empty()
+
+
+def test_sync_execute_on_linux_executer():
+    from infi.asi.cdb.tur import TestUnitReadyCommand
+    from infi.asi.cdb.read import Read10Command
+    from infi.asi.linux import LinuxCommandExecuter
+    from test_linux_sgio import LoopbackIO
+    executer = LinuxCommandExecuter(LoopbackIO(data_byte=0x5a))
+    assert sync_execute(TestUnitReadyCommand(), executer) is True
+    assert sync_execute(Read10Command(0, 2), executer) == b"\x5a" * 1024
+    assert executer.is_queue_empty()
@@ -0,0 +1,51 @@
+"""
+Measures the host-side cost of submitting WRITE(16) commands through LinuxCommandExecuter, comparing immutable bytes
+(copied into the SGIO data buffer) with bytearray and mmap buffers (pinned in place and transferred without a copy).
+
+No device is needed: the io object completes every command as soon as its SGIO header is written.
+"""
+from __future__ import print_function
+import mmap
+import sys
+import time
+from infi.asi.linux import LinuxCommandExecuter
+from infi.asi.cdb.write import Write16Command
+from infi.asi.coroutines.sync_adapter import sync_wait
+
+MB = 1024 * 1024
+
+
+class LoopbackIO(object):
+    def __init__(self):
+        self.responses = []
+
+    def write(self, buffer):
+        self.responses.append(bytes(buffer))
+        return len(buffer)
+
+    def read(self, size):
+        return self.responses.pop()
+
+
+def benchmark(name, data, iterations):
+    executer = LinuxCommandExecuter(LoopbackIO())
+    start_time = time.time()
+    for i in range(iterations):
+        sync_wait(Write16Command(i, data).execute(executer))
+    duration = time.time() - start_time
+    print("%-10s size=%5d KiB, iters=%d, %.1f MB/s, %.1f usec/command" %
+          (name, len(data) // 1024, iterations, len(data) * iterations / duration / MB, duration / iterations * 1e6))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for size in (64 * 1024, MB, 4 * MB):
+        mapped = mmap.mmap(-1, size)
+        benchmark("bytes", b"\x00" * size, iterations)
+        benchmark("bytearray", bytearray(size), iterations)
+        benchmark("mmap", mapped, iterations)
+        mapped.close()
+
+
+if __name__ == "__main__":
+    main()